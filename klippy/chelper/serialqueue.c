@@ -827,23 +827,10 @@ serialqueue_send(struct serialqueue *sq, struct command_queue *cq, uint8_t *msg
     serialqueue_send_one(sq, cq, qm);
 }
 
-// Return a message read from the serial port (or wait for one if none
-// available)
-void __visible
-serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
+// Remove a message from the receive queue and copy it to 'pqm'
+static void
+pull_one(struct serialqueue *sq, struct pull_queue_message *pqm)
 {
-    pthread_mutex_lock(&sq->lock);
-    // Wait for message to be available
-    while (list_empty(&sq->receive_queue)) {
-        if (pollreactor_is_exit(sq->pr))
-            goto exit;
-        sq->receive_waiting = 1;
-        int ret = pthread_cond_wait(&sq->cond, &sq->lock);
-        if (ret)
-            report_errno("pthread_cond_wait", ret);
-    }
-
-    // Remove message from queue
     struct queue_message *qm = list_first_entry(
         &sq->receive_queue, struct queue_message, node);
     list_del(&qm->node);
@@ -858,13 +845,51 @@ serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
         debug_queue_add(&sq->old_receive, qm);
     else
         message_free(qm);
+}
+
+// Wait for a message to be available - returns -1 on exit
+static int
+pull_wait(struct serialqueue *sq)
+{
+    while (list_empty(&sq->receive_queue)) {
+        if (pollreactor_is_exit(sq->pr))
+            return -1;
+        sq->receive_waiting = 1;
+        int ret = pthread_cond_wait(&sq->cond, &sq->lock);
+        if (ret)
+            report_errno("pthread_cond_wait", ret);
+    }
+    return 0;
+}
 
+// Return a message read from the serial port (or wait for one if none
+// available)
+void __visible
+serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
+{
+    pthread_mutex_lock(&sq->lock);
+    if (pull_wait(sq))
+        pqm->len = -1;
+    else
+        pull_one(sq, pqm);
     pthread_mutex_unlock(&sq->lock);
-    return;
+}
 
-exit:
-    pqm->len = -1;
+// Return up to 'max' messages read from the serial port (or wait for
+// one if none available).  Returns the number of messages stored in
+// 'q' or -1 on exit.
+int __visible
+serialqueue_pull_batch(struct serialqueue *sq, struct pull_queue_message *q
+                       , int max)
+{
+    pthread_mutex_lock(&sq->lock);
+    int count = pull_wait(sq);
+    if (!count) {
+        while (count < max && !list_empty(&sq->receive_queue))
+            pull_one(sq, &q[count++]);
+    }
     pthread_mutex_unlock(&sq->lock);
+    return count;
 }
 
 void __visible
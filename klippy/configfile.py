@@ -141,6 +141,10 @@ AUTOSAVE_HEADER = """
 #*#
 """
 
+# The parsed main config is kept across restarts of the host software
+# and reused while the config file (and its includes) are unchanged
+main_config_cache = {}
+
 class PrinterConfig:
     def __init__(self, printer):
         self.printer = printer
@@ -151,6 +155,8 @@ class PrinterConfig:
         self.status_settings = {}
         self.status_warnings = []
         self.save_config_pending = False
+        # Incremented whenever the get_status() result changes
+        self.status_version = 0
         gcode = self.printer.lookup_object('gcode')
         gcode.register_command("SAVE_CONFIG", self.cmd_SAVE_CONFIG,
                                desc=self.cmd_SAVE_CONFIG_help)
@@ -224,7 +230,7 @@ class PrinterConfig:
         sbuffer = io.StringIO(data)
         fileconfig.readfp(sbuffer, filename)
     def _resolve_include(self, source_filename, include_spec, fileconfig,
-                         visited):
+                         visited, includes=None):
         dirname = os.path.dirname(source_filename)
         include_spec = include_spec.strip()
         include_glob = os.path.join(dirname, include_spec)
@@ -233,12 +239,33 @@ class PrinterConfig:
             # Empty set is OK if wildcard but not for direct file reference
             raise error("Include file '%s' does not exist" % (include_glob,))
         include_filenames.sort()
+        if includes is not None:
+            includes.append((include_glob, include_filenames, None))
         for include_filename in include_filenames:
             include_data = self._read_config_file(include_filename)
+            if includes is not None:
+                includes.append((include_glob, include_filename, include_data))
             self._parse_config(include_data, include_filename, fileconfig,
-                               visited)
+                               visited, includes)
         return include_filenames
-    def _parse_config(self, data, filename, fileconfig, visited):
+    def _check_includes(self, includes):
+        # Verify that the include files read by a cached config still
+        # resolve to the same files with the same contents
+        for include_glob, include_filename, include_data in includes:
+            if include_data is None:
+                if sorted(glob.glob(include_glob)) != include_filename:
+                    return False
+                continue
+            try:
+                with open(include_filename, 'r') as f:
+                    data = f.read().replace('\r\n', '\n')
+            except:
+                return False
+            if data != include_data:
+                return False
+        return True
+    def _parse_config(self, data, filename, fileconfig, visited,
+                      includes=None):
         path = os.path.abspath(filename)
         if path in visited:
             raise error("Recursive include of config file '%s'" % (filename))
@@ -259,18 +286,30 @@ class PrinterConfig:
                 self._parse_config_buffer(buffer, filename, fileconfig)
                 include_spec = header[8:].strip()
                 self._resolve_include(filename, include_spec, fileconfig,
-                                      visited)
+                                      visited, includes)
             else:
                 buffer.append(line)
         self._parse_config_buffer(buffer, filename, fileconfig)
         visited.remove(path)
-    def _build_config_wrapper(self, data, filename):
+    def _new_fileconfig(self):
         if sys.version_info.major >= 3:
-            fileconfig = configparser.RawConfigParser(
+            return configparser.RawConfigParser(
                 strict=False, inline_comment_prefixes=(';', '#'))
-        else:
-            fileconfig = configparser.RawConfigParser()
-        self._parse_config(data, filename, fileconfig, set())
+        return configparser.RawConfigParser()
+    def _build_config_wrapper(self, data, filename, includes=None):
+        fileconfig = self._new_fileconfig()
+        self._parse_config(data, filename, fileconfig, set(), includes)
+        return ConfigWrapper(self.printer, fileconfig, {}, 'printer')
+    def _dump_config(self, config):
+        fileconfig = config.fileconfig
+        return {section: {option: fileconfig.get(section, option)
+                          for option in fileconfig.options(section)}
+                for section in fileconfig.sections()}
+    def _load_config(self, dump):
+        # Rebuilding from the parsed values is much faster than parsing
+        # and gives each restart its own (modifiable) config
+        fileconfig = self._new_fileconfig()
+        fileconfig.read_dict(dump)
         return ConfigWrapper(self.printer, fileconfig, {}, 'printer')
     def _build_config_string(self, config):
         sfile = io.StringIO()
@@ -282,11 +321,23 @@ class PrinterConfig:
     def read_main_config(self):
         filename = self.printer.get_start_args()['config_file']
         data = self._read_config_file(filename)
+        cached = main_config_cache.get(filename)
+        if (cached is not None and cached['data'] == data
+            and self._check_includes(cached['includes'])):
+            self.autosave = self._load_config(cached['autosave'])
+            return self._load_config(cached['config'])
+        main_config_cache.pop(filename, None)
         regular_data, autosave_data = self._find_autosave_data(data)
         regular_config = self._build_config_wrapper(regular_data, filename)
         autosave_data = self._strip_duplicates(autosave_data, regular_config)
         self.autosave = self._build_config_wrapper(autosave_data, filename)
-        cfg = self._build_config_wrapper(regular_data + autosave_data, filename)
+        includes = []
+        cfg = self._build_config_wrapper(regular_data + autosave_data, filename,
+                                         includes)
+        main_config_cache[filename] = {
+            'data': data, 'includes': includes,
+            'autosave': self._dump_config(self.autosave),
+            'config': self._dump_config(cfg)}
         return cfg
     def check_unused_options(self, config):
         fileconfig = config.fileconfig
@@ -317,6 +368,7 @@ class PrinterConfig:
     def deprecate(self, section, option, value=None, msg=None):
         self.deprecated[(section, option, value)] = msg
     def _build_status(self, config):
+        self.status_version += 1
         self.status_raw_config.clear()
         for section in config.get_prefix_sections(''):
             self.status_raw_config[section.get_name()] = section_status = {}
@@ -341,6 +393,8 @@ class PrinterConfig:
                 'warnings': self.status_warnings,
                 'save_config_pending': self.save_config_pending,
                 'save_config_pending_items': self.status_save_pending}
+    def get_status_version(self):
+        return self.status_version
     # Autosave functions
     def set(self, section, option, value):
         if not self.autosave.fileconfig.has_section(section):
@@ -355,8 +409,10 @@ class PrinterConfig:
         pending[section][option] = svalue
         self.status_save_pending = pending
         self.save_config_pending = True
+        self.status_version += 1
         logging.info("save_config: set [%s] %s = %s", section, option, svalue)
     def remove_section(self, section):
+        self.status_version += 1
         if self.autosave.fileconfig.has_section(section):
             self.autosave.fileconfig.remove_section(section)
             pending = dict(self.status_save_pending)
@@ -3,10 +3,9 @@
 # Copyright (C) 2020-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, time, collections, threading, multiprocessing, os
+import logging, time, collections, threading, os
 from . import bus, motion_report
 import struct
-from multiprocessing import shared_memory
 
 # ADXL345 registers
 REG_DEVID = 0x00
@@ -118,6 +117,8 @@ class AccelQueryHelper:
 
         # shm size = (double bytes) * (count of member: samp_time, x, y and z) * total
         shm_size = 8 * 4 * total
+        # Deferred so that multiprocessing is only loaded on use
+        from multiprocessing import shared_memory
         shm = shared_memory.SharedMemory(name="psm_samples", create=True, size=shm_size)
 
         buffer = shm.buf
@@ -151,6 +152,7 @@ class AccelQueryHelper:
         gcode.respond_info("shm_size: %d, double bytes count: %d" % (shm_size, count))
 
     def write_to_file(self, filename):
+        import multiprocessing
         def write_impl():
             try:
                 # Try to re-nice writing process
@@ -338,7 +340,8 @@ class ADXL345:
         mcu.add_config_cmd("query_adxl345 oid=%d clock=0 rest_ticks=0"
                            % (oid,), on_restart=True)
         mcu.register_config_callback(self._build_config)
-        mcu.register_response(self._handle_adxl345_data, "adxl345_data", oid)
+        mcu.register_response(self._handle_adxl345_data, "adxl345_data", oid,
+                              batch=True)
         # Clock tracking
         self.last_sequence = self.max_query_duration = 0
         self.last_limit_count = self.last_error_count = 0
@@ -376,9 +379,9 @@ class ADXL345:
     # Measurement collection
     def is_measuring(self):
         return self.query_rate > 0
-    def _handle_adxl345_data(self, params):
+    def _handle_adxl345_data(self, params_list):
         with self.lock:
-            self.raw_samples.append(params)
+            self.raw_samples.extend(params_list)
     def _extract_samples(self, raw_samples):
         # Load variables to optimize inner loop below
         (x_pos, x_scale), (y_pos, y_scale), (z_pos, z_scale) = self.axes_map
@@ -4,10 +4,12 @@
 # Copyright (C) 2018-2019 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math, json, collections
+import logging, math, json, collections, importlib, copy
 from . import probe
 
 PROFILE_VERSION = 1
+# Number of built profile meshes kept in memory
+PROFILE_CACHE_SIZE = 4
 PROFILE_OPTIONS = {
     'min_x': float, 'max_x': float, 'min_y': float, 'max_y': float,
     'x_count': int, 'y_count': int, 'mesh_x_pps': int, 'mesh_y_pps': int,
@@ -35,6 +37,38 @@ def constrain(val, min_val, max_val):
 def lerp(t, v0, v1):
     return (1. - t) * v0 + t * v1
 
+# NumPy is optional - if available it is used to build interpolated
+# meshes.  Imported on first use.
+numpy_module = None
+def get_numpy():
+    global numpy_module
+    if numpy_module is None:
+        try:
+            numpy_module = importlib.import_module('numpy')
+        except ImportError:
+            numpy_module = False
+    return numpy_module or None
+
+# Weights of the probed points for each mesh index along one axis
+class InterpolationWeights:
+    def __init__(self, rows):
+        # [[(probe_index, weight), ...], ...]
+        self.rows = rows
+        self.matrix = None
+    def get_matrix(self, np):
+        if self.matrix is None:
+            pt_cnt = max([k for row in self.rows for k, w in row]) + 1
+            self.matrix = np.zeros((len(self.rows), pt_cnt))
+            for idx, row in enumerate(self.rows):
+                for k, w in row:
+                    self.matrix[idx, k] = w
+        return self.matrix
+
+# Interpolation weights are only dependent on the mesh parameters, so
+# they are shared by all meshes (and profiles) with the same parameters
+INTERPOLATION_WEIGHTS = {}
+MAX_INTERPOLATION_WEIGHTS = 16
+
 # retreive commma separated pair from config
 def parse_config_pair(config, option, default, minval=None, maxval=None):
     pair = config.getintlist(option, (default, default))
@@ -94,6 +128,7 @@ class BedMesh:
         self.bmc = BedMeshCalibrate(config, self)
         self.z_mesh = None
         self.z_mesh_bak = None
+        self.status_version = 0
         self.toolhead = None
         self.horizontal_move_z = config.getfloat('horizontal_move_z', 5.)
         self.fade_start = config.getfloat('fade_start', 1.)
@@ -250,7 +285,10 @@ class BedMesh:
         self.last_position[:] = newpos
     def get_status(self, eventtime=None):
         return self.status
+    def get_status_version(self):
+        return self.status_version
     def update_status(self):
+        self.status_version += 1
         self.status = {
             "profile_name": "",
             "mesh_min": (0., 0.),
@@ -792,26 +830,104 @@ class MoveSplitter:
         self.z_mesh = None
         self.fade_offset = 0.
         self.gcode = gcode
+        # Mesh z at the end of the last move (the start of the next one)
+        self.last_end = None
     def initialize(self, mesh, fade_offset):
         self.z_mesh = mesh
         self.fade_offset = fade_offset
+        self.last_end = None
     def build_move(self, prev_pos, next_pos, factor):
         self.prev_pos = tuple(prev_pos)
         self.next_pos = tuple(next_pos)
         self.current_pos = list(prev_pos)
         self.z_factor = factor
-        self.z_offset = self._calc_z_offset(prev_pos)
         self.traverse_complete = False
-        self.distance_checked = 0.
         axes_d = [self.next_pos[i] - self.prev_pos[i] for i in range(4)]
-        self.total_move_length = math.sqrt(sum([d*d for d in axes_d[:3]]))
         self.axis_move = [not isclose(d, 0., abs_tol=1e-10) for d in axes_d]
+        start_z = self._calc_mesh_z(self.prev_pos[0], self.prev_pos[1])
+        end_z = self._calc_mesh_z(self.next_pos[0], self.next_pos[1])
+        self.last_end = (self.next_pos[0], self.next_pos[1],
+                         self.z_mesh.generation, end_z)
+        offset = self.fade_offset
+        self.z_offset = factor * (start_z - offset) + offset
+        self.end_z_offset = factor * (end_z - offset) + offset
+        self.splits = []
+        self.split_index = 0
+        if ((self.axis_move[0] or self.axis_move[1])
+            and math.sqrt(axes_d[0]*axes_d[0] + axes_d[1]*axes_d[1])
+            >= self.move_check_distance):
+            self.splits = self._calc_splits()
+    def _calc_mesh_z(self, x, y):
+        last_end = self.last_end
+        if (last_end is not None and last_end[0] == x and last_end[1] == y
+            and last_end[2] == self.z_mesh.generation):
+            return last_end[3]
+        return self.z_mesh.calc_z(x, y)
     def _calc_z_offset(self, pos):
         z = self.z_mesh.calc_z(pos[0], pos[1])
         offset = self.fade_offset
         return self.z_factor * (z - offset) + offset
-    def _set_next_move(self, distance_from_prev):
-        t = distance_from_prev / self.total_move_length
+    def _calc_z_offset_at(self, t):
+        x, y = self.prev_pos[0], self.prev_pos[1]
+        if self.axis_move[0]:
+            x = lerp(t, x, self.next_pos[0])
+        if self.axis_move[1]:
+            y = lerp(t, y, self.next_pos[1])
+        return self._calc_z_offset((x, y))
+    def _calc_splits(self):
+        # Along an XY move the mesh z is piecewise quadratic, with breaks
+        # where the move crosses the mesh grid lines.  Create split
+        # points at those crossings (subdividing pieces that bulge away
+        # from their chord), then keep only the splits needed for the
+        # resulting segments to stay within split_delta_z / 2 of the
+        # split points.  Returns [(t, z_offset), ...].
+        z_mesh = self.z_mesh
+        tol = .5 * self.split_delta_z
+        prev_pos, next_pos = self.prev_pos, self.next_pos
+        crossings = z_mesh.get_grid_crossings(
+            prev_pos[0], prev_pos[1], next_pos[0], next_pos[1])
+        # Upper bound on the distance between the mesh and the chord of
+        # a piece spanning the entire move
+        max_bulge = .25 * abs(
+            self.z_factor * z_mesh.max_twist
+            * (next_pos[0] - prev_pos[0]) / z_mesh.mesh_x_dist
+            * (next_pos[1] - prev_pos[1]) / z_mesh.mesh_y_dist)
+        if not crossings and max_bulge <= tol:
+            return []
+        pts = [(0., self.z_offset)]
+        last_t, last_z = 0., self.z_offset
+        for t in crossings + [1.]:
+            if t == 1.:
+                z = self.end_z_offset
+            else:
+                z = self._calc_z_offset_at(t)
+            dt = t - last_t
+            if max_bulge * dt * dt > tol:
+                mid_z = self._calc_z_offset_at(last_t + .5 * dt)
+                bulge = abs(mid_z - .5 * (last_z + z))
+                if bulge > tol:
+                    count = int(math.ceil(math.sqrt(bulge / tol)))
+                    for i in range(1, count):
+                        sub_t = last_t + dt * i / count
+                        pts.append((sub_t, self._calc_z_offset_at(sub_t)))
+            pts.append((t, z))
+            last_t, last_z = t, z
+        splits = []
+        anchor_t, anchor_z = pts[0]
+        first = 1
+        for i in range(1, len(pts) - 1):
+            end_t, end_z = pts[i + 1]
+            slope = (end_z - anchor_z) / (end_t - anchor_t)
+            for t, z in pts[first:i + 1]:
+                if abs(anchor_z + slope * (t - anchor_t) - z) > tol:
+                    break
+            else:
+                continue
+            splits.append(pts[i])
+            anchor_t, anchor_z = pts[i]
+            first = i + 1
+        return splits
+    def _set_next_move(self, t):
         if t > 1. or t < 0.:
             raise self.gcode.error(
                 "bed_mesh: Slice distance is negative "
@@ -822,21 +938,16 @@ class MoveSplitter:
                     t, self.prev_pos[i], self.next_pos[i])
     def split(self):
         if not self.traverse_complete:
-            if self.axis_move[0] or self.axis_move[1]:
-                # X and/or Y axis move, traverse if necessary
-                while self.distance_checked + self.move_check_distance \
-                        < self.total_move_length:
-                    self.distance_checked += self.move_check_distance
-                    self._set_next_move(self.distance_checked)
-                    next_z = self._calc_z_offset(self.current_pos)
-                    if abs(next_z - self.z_offset) >= self.split_delta_z:
-                        self.z_offset = next_z
-                        return self.current_pos[0], self.current_pos[1], \
-                            self.current_pos[2] + self.z_offset, \
-                            self.current_pos[3]
+            if self.split_index < len(self.splits):
+                t, self.z_offset = self.splits[self.split_index]
+                self.split_index += 1
+                self._set_next_move(t)
+                return self.current_pos[0], self.current_pos[1], \
+                    self.current_pos[2] + self.z_offset, \
+                    self.current_pos[3]
             # end of move reached
             self.current_pos[:] = self.next_pos
-            self.z_offset = self._calc_z_offset(self.current_pos)
+            self.z_offset = self.end_z_offset
             # Its okay to add Z-Offset to the final move, since it will not be
             # used again.
             self.current_pos[2] += self.z_offset
@@ -855,6 +966,13 @@ class ZMesh:
         self.mesh_params = params
         self.avg_z = 0.
         self.mesh_offsets = [0., 0.]
+        # Per cell bilinear coefficients, see _build_cells()
+        self.cells = None
+        self.max_twist = 0.
+        # Incremented whenever calc_z() results may change
+        self.generation = 0
+        # Rounded copies of the matrices returned by get_*_matrix()
+        self.rounded_mesh = self.rounded_probed = None
         logging.debug('bed_mesh: probe/mesh parameters:')
         for key, value in self.mesh_params.items():
             logging.debug("%s :  %s" % (key, value))
@@ -898,18 +1016,34 @@ class ZMesh:
                 'BED_MESH_SET_ENABLE', self.cmd_BED_MESH_SET_ENABLE,
                 desc=self.cmd_BED_MESH_SET_ENABLE_helper)
     def get_mesh_matrix(self):
-        if self.mesh_matrix is not None:
-            return [[round(z, 6) for z in line]
-                    for line in self.mesh_matrix]
-        return [[]]
+        # The returned lists are shared and must not be modified
+        if self.mesh_matrix is None:
+            return [[]]
+        if self.rounded_mesh is None:
+            self.rounded_mesh = [[round(z, 6) for z in line]
+                                 for line in self.mesh_matrix]
+        return self.rounded_mesh
     def get_probed_matrix(self):
-        if self.probed_matrix is not None:
-            return [[round(z, 6) for z in line]
-                    for line in self.probed_matrix]
-        return [[]]
+        if self.probed_matrix is None:
+            return [[]]
+        if self.rounded_probed is None:
+            self.rounded_probed = [[round(z, 6) for z in line]
+                                   for line in self.probed_matrix]
+        return self.rounded_probed
     def update_mesh_probed_matrix(self, probed_matrix):
         if self.probed_matrix is not None:
             self.probed_matrix = tuple(map(tuple, probed_matrix))
+            self.rounded_probed = None
+    def copy(self):
+        # Returns an enabled mesh, without offsets, that shares the
+        # (never modified in place) matrices of this mesh
+        self.get_mesh_matrix()
+        self.get_probed_matrix()
+        mesh = copy.copy(self)
+        mesh.isenable = True
+        mesh.mesh_offsets = [0., 0.]
+        mesh.generation += 1
+        return mesh
     def get_mesh_params(self):
         return self.mesh_params
     def print_probed_matrix(self, print_func):
@@ -945,6 +1079,7 @@ class ZMesh:
             print_func("bed_mesh: Z Mesh not generated")
     def build_mesh(self, z_matrix):
         self.probed_matrix = z_matrix
+        self.rounded_mesh = self.rounded_probed = None
         self._sample(z_matrix)
         self.avg_z = (sum([sum(x) for x in self.mesh_matrix]) /
                       sum([len(x) for x in self.mesh_matrix]))
@@ -952,11 +1087,30 @@ class ZMesh:
         # should produce an offset that is divisible by common
         # z step distances
         self.avg_z = round(self.avg_z, 2)
-        self.print_mesh(logging.debug)
+        self._build_cells()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            self.print_mesh(logging.debug)
+    def _build_cells(self):
+        # z = a + b*tx + c*ty + d*tx*ty within each cell, indexed
+        # [yidx][xidx].  The largest |d| bounds the curvature of the
+        # mesh along any straight move.
+        tbl = self.mesh_matrix
+        self.cells = []
+        self.max_twist = 0.
+        for row0, row1 in zip(tbl[:-1], tbl[1:]):
+            row = []
+            for z00, z10, z01, z11 in zip(row0[:-1], row0[1:],
+                                          row1[:-1], row1[1:]):
+                row.append((z00, z10 - z00, z01 - z00, z11 - z10 - z01 + z00))
+            self.cells.append(row)
+            self.max_twist = max(self.max_twist,
+                                 max([abs(cell[3]) for cell in row]))
+        self.generation += 1
     def set_mesh_offsets(self, offsets):
         for i, o in enumerate(offsets):
             if o is not None:
                 self.mesh_offsets[i] = o
+        self.generation += 1
     def get_x_coordinate(self, index):
         return self.mesh_x_min + self.mesh_x_dist * index
     def get_y_coordinate(self, index):
@@ -964,23 +1118,58 @@ class ZMesh:
 
     def cmd_BED_MESH_SET_DISABLE(self, gcmd):
         self.isenable = False
+        self.generation += 1
     cmd_BED_MESH_SET_DISABLE_helper = " set  MESH disable"
     def cmd_BED_MESH_SET_ENABLE(self, gcmd):
         self.isenable = True
+        self.generation += 1
     cmd_BED_MESH_SET_ENABLE_helper = "set  MESH enable "
     def calc_z(self, x, y):
-        if self.isenable:
-            if self.mesh_matrix is not None:
-                tbl = self.mesh_matrix
-                tx, xidx = self._get_linear_index(x + self.mesh_offsets[0], 0)
-                ty, yidx = self._get_linear_index(y + self.mesh_offsets[1], 1)
-                z0 = lerp(tx, tbl[yidx][xidx], tbl[yidx][xidx+1])
-                z1 = lerp(tx, tbl[yidx+1][xidx], tbl[yidx+1][xidx+1])
-                return lerp(ty, z0, z1)
-            else:
-                pass
-                # No mesh table generated, no z-adjustment
-        return 0.
+        if not self.isenable or self.cells is None:
+            # No mesh table generated, no z-adjustment
+            return 0.
+        tx = (x + self.mesh_offsets[0] - self.mesh_x_min) / self.mesh_x_dist
+        xidx = int(math.floor(tx))
+        if xidx < 0:
+            xidx = 0
+        elif xidx > self.mesh_x_count - 2:
+            xidx = self.mesh_x_count - 2
+        tx = constrain(tx - xidx, 0., 1.)
+        ty = (y + self.mesh_offsets[1] - self.mesh_y_min) / self.mesh_y_dist
+        yidx = int(math.floor(ty))
+        if yidx < 0:
+            yidx = 0
+        elif yidx > self.mesh_y_count - 2:
+            yidx = self.mesh_y_count - 2
+        ty = constrain(ty - yidx, 0., 1.)
+        a, b, c, d = self.cells[yidx][xidx]
+        return a + b * tx + (c + d * tx) * ty
+    def get_grid_crossings(self, x0, y0, x1, y1):
+        # Returns the sorted positions t (0. < t < 1.) along the line
+        # from x0,y0 to x1,y1 at which calc_z() moves to a new mesh cell
+        # (or leaves/enters the mesh)
+        if not self.isenable or self.cells is None:
+            return []
+        crossings = []
+        for c0, c1, mesh_min, mesh_dist, mesh_cnt in (
+                (x0 + self.mesh_offsets[0], x1 + self.mesh_offsets[0],
+                 self.mesh_x_min, self.mesh_x_dist, self.mesh_x_count),
+                (y0 + self.mesh_offsets[1], y1 + self.mesh_offsets[1],
+                 self.mesh_y_min, self.mesh_y_dist, self.mesh_y_count)):
+            u0 = (c0 - mesh_min) / mesh_dist
+            u1 = (c1 - mesh_min) / mesh_dist
+            if u0 == u1:
+                continue
+            first = max(int(math.ceil(min(u0, u1))), 0)
+            last = min(int(math.floor(max(u0, u1))), mesh_cnt - 1)
+            for k in range(first, last + 1):
+                t = (k - u0) / (u1 - u0)
+                if 0.000000001 < t < 0.999999999:
+                    crossings.append(t)
+        crossings.sort()
+        # Drop crossings of an X and a Y grid line at the same point
+        return [t for i, t in enumerate(crossings)
+                if not i or t - crossings[i-1] > 0.000000001]
     def get_z_range(self):
         if self.mesh_matrix is not None:
             mesh_min = min([min(x) for x in self.mesh_matrix])
@@ -1009,31 +1198,18 @@ class ZMesh:
     def _sample_direct(self, z_matrix):
         self.mesh_matrix = z_matrix
     def _sample_lagrange(self, z_matrix):
-        x_mult = self.x_mult
-        y_mult = self.y_mult
-        self.mesh_matrix = \
-            [[0. if ((i % x_mult) or (j % y_mult))
-             else z_matrix[j//y_mult][i//x_mult]
-             for i in range(self.mesh_x_count)]
-             for j in range(self.mesh_y_count)]
         xpts, ypts = self._get_lagrange_coords()
-        # Interpolate X coordinates
-        for i in range(self.mesh_y_count):
-            # only interpolate X-rows that have probed coordinates
-            if i % y_mult != 0:
-                continue
-            for j in range(self.mesh_x_count):
-                if j % x_mult == 0:
-                    continue
-                x = self.get_x_coordinate(j)
-                self.mesh_matrix[i][j] = self._calc_lagrange(xpts, x, i, 0)
-        # Interpolate Y coordinates
-        for i in range(self.mesh_x_count):
-            for j in range(self.mesh_y_count):
-                if j % y_mult == 0:
-                    continue
-                y = self.get_y_coordinate(j)
-                self.mesh_matrix[j][i] = self._calc_lagrange(ypts, y, i, 1)
+        x_weights = self._get_weights(
+            ('lagrange', self.mesh_x_count, self.x_mult, tuple(xpts)),
+            lambda: self._calc_lagrange_weights(
+                xpts, self.mesh_x_count, self.x_mult,
+                self.get_x_coordinate))
+        y_weights = self._get_weights(
+            ('lagrange', self.mesh_y_count, self.y_mult, tuple(ypts)),
+            lambda: self._calc_lagrange_weights(
+                ypts, self.mesh_y_count, self.y_mult,
+                self.get_y_coordinate))
+        self._interpolate(z_matrix, x_weights, y_weights)
     def _get_lagrange_coords(self):
         xpts = []
         ypts = []
@@ -1042,111 +1218,89 @@ class ZMesh:
         for j in range(self.mesh_params['y_count']):
             ypts.append(self.get_y_coordinate(j * self.y_mult))
         return xpts, ypts
-    def _calc_lagrange(self, lpts, c, vec, axis=0):
+    def _calc_lagrange_weights(self, lpts, mesh_cnt, mult, cfunc):
         pt_cnt = len(lpts)
-        total = 0.
-        for i in range(pt_cnt):
-            n = 1.
-            d = 1.
-            for j in range(pt_cnt):
-                if j == i:
-                    continue
-                n *= (c - lpts[j])
-                d *= (lpts[i] - lpts[j])
-            if axis == 0:
-                # Calc X-Axis
-                z = self.mesh_matrix[vec][i*self.x_mult]
-            else:
-                # Calc Y-Axis
-                z = self.mesh_matrix[i*self.y_mult][vec]
-            total += z * n / d
-        return total
+        weights = []
+        for idx in range(mesh_cnt):
+            if idx % mult == 0:
+                weights.append([(idx // mult, 1.)])
+                continue
+            c = cfunc(idx)
+            row = []
+            for i in range(pt_cnt):
+                n = 1.
+                d = 1.
+                for j in range(pt_cnt):
+                    if j == i:
+                        continue
+                    n *= (c - lpts[j])
+                    d *= (lpts[i] - lpts[j])
+                row.append((i, n / d))
+            weights.append(row)
+        return weights
     def _sample_bicubic(self, z_matrix):
         # should work for any number of probe points above 3x3
-        x_mult = self.x_mult
-        y_mult = self.y_mult
         c = self.mesh_params['tension']
-        self.mesh_matrix = \
-            [[0. if ((i % x_mult) or (j % y_mult))
-             else z_matrix[j//y_mult][i//x_mult]
-             for i in range(self.mesh_x_count)]
-             for j in range(self.mesh_y_count)]
-        # Interpolate X values
-        for y in range(self.mesh_y_count):
-            if y % y_mult != 0:
+        x_weights = self._get_weights(
+            ('bicubic', self.mesh_x_count, self.x_mult, c),
+            lambda: self._calc_bicubic_weights(
+                self.mesh_x_count, self.x_mult, c))
+        y_weights = self._get_weights(
+            ('bicubic', self.mesh_y_count, self.y_mult, c),
+            lambda: self._calc_bicubic_weights(
+                self.mesh_y_count, self.y_mult, c))
+        self._interpolate(z_matrix, x_weights, y_weights)
+    def _calc_bicubic_weights(self, mesh_cnt, mult, tension):
+        # The cardinal spline is linear in its control points, so the
+        # weight of each probed point is the spline of a unit vector
+        last_pt = mesh_cnt - 1 - mult
+        weights = []
+        for idx in range(mesh_cnt):
+            if idx % mult == 0:
+                weights.append([(idx // mult, 1.)])
                 continue
-            for x in range(self.mesh_x_count):
-                if x % x_mult == 0:
-                    continue
-                pts = self._get_x_ctl_pts(x, y)
-                self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
-        # Interpolate Y values
-        for x in range(self.mesh_x_count):
-            for y in range(self.mesh_y_count):
-                if y % y_mult == 0:
-                    continue
-                pts = self._get_y_ctl_pts(x, y)
-                self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
-    def _get_x_ctl_pts(self, x, y):
-        # Fetch control points and t for a X value in the mesh
-        x_mult = self.x_mult
-        x_row = self.mesh_matrix[y]
-        last_pt = self.mesh_x_count - 1 - x_mult
-        if x < x_mult:
-            p0 = p1 = x_row[0]
-            p2 = x_row[x_mult]
-            p3 = x_row[2*x_mult]
-            t = x / float(x_mult)
-        elif x > last_pt:
-            p0 = x_row[last_pt - x_mult]
-            p1 = x_row[last_pt]
-            p2 = p3 = x_row[last_pt + x_mult]
-            t = (x - last_pt) / float(x_mult)
-        else:
-            found = False
-            for i in range(x_mult, last_pt, x_mult):
-                if x > i and x < (i + x_mult):
-                    p0 = x_row[i - x_mult]
-                    p1 = x_row[i]
-                    p2 = x_row[i + x_mult]
-                    p3 = x_row[i + 2*x_mult]
-                    t = (x - i) / float(x_mult)
-                    found = True
-                    break
-            if not found:
-                raise BedMeshError(
-                    "bed_mesh: Error finding x control points")
-        return p0, p1, p2, p3, t
-    def _get_y_ctl_pts(self, x, y):
-        # Fetch control points and t for a Y value in the mesh
-        y_mult = self.y_mult
-        last_pt = self.mesh_y_count - 1 - y_mult
-        y_col = self.mesh_matrix
-        if y < y_mult:
-            p0 = p1 = y_col[0][x]
-            p2 = y_col[y_mult][x]
-            p3 = y_col[2*y_mult][x]
-            t = y / float(y_mult)
-        elif y > last_pt:
-            p0 = y_col[last_pt - y_mult][x]
-            p1 = y_col[last_pt][x]
-            p2 = p3 = y_col[last_pt + y_mult][x]
-            t = (y - last_pt) / float(y_mult)
-        else:
-            found = False
-            for i in range(y_mult, last_pt, y_mult):
-                if y > i and y < (i + y_mult):
-                    p0 = y_col[i - y_mult][x]
-                    p1 = y_col[i][x]
-                    p2 = y_col[i + y_mult][x]
-                    p3 = y_col[i + 2*y_mult][x]
-                    t = (y - i) / float(y_mult)
-                    found = True
-                    break
-            if not found:
-                raise BedMeshError(
-                    "bed_mesh: Error finding y control points")
-        return p0, p1, p2, p3, t
+            if idx < mult:
+                ctl_pts = (0, 0, 1, 2)
+                t = idx / float(mult)
+            elif idx > last_pt:
+                i = last_pt // mult
+                ctl_pts = (i - 1, i, i + 1, i + 1)
+                t = (idx - last_pt) / float(mult)
+            else:
+                i = idx // mult
+                ctl_pts = (i - 1, i, i + 1, i + 2)
+                t = (idx - i * mult) / float(mult)
+            row = collections.OrderedDict()
+            for pos, pt in enumerate(ctl_pts):
+                p = [0., 0., 0., 0., t]
+                p[pos] = 1.
+                row[pt] = row.get(pt, 0.) + self._cardinal_spline(p, tension)
+            weights.append(list(row.items()))
+        return weights
+    def _get_weights(self, key, calc_func):
+        weights = INTERPOLATION_WEIGHTS.get(key)
+        if weights is None:
+            if len(INTERPOLATION_WEIGHTS) >= MAX_INTERPOLATION_WEIGHTS:
+                INTERPOLATION_WEIGHTS.clear()
+            weights = InterpolationWeights(calc_func())
+            INTERPOLATION_WEIGHTS[key] = weights
+        return weights
+    def _interpolate(self, z_matrix, x_weights, y_weights):
+        # The interpolation is separable - each probed row is
+        # interpolated along X, then every column along Y
+        np = get_numpy()
+        if np is not None:
+            wx = x_weights.get_matrix(np)
+            wy = y_weights.get_matrix(np)
+            z = np.array(z_matrix, dtype=float)
+            self.mesh_matrix = np.dot(np.dot(wy, z), wx.T).tolist()
+            return
+        x_rows = [[sum([z_row[k] * w for k, w in row]) for row in x_weights.rows]
+                  for z_row in z_matrix]
+        x_range = range(self.mesh_x_count)
+        self.mesh_matrix = [
+            [sum([x_rows[k][x] * w for k, w in row]) for x in x_range]
+            for row in y_weights.rows]
     def _cardinal_spline(self, p, tension):
         t = p[4]
         t2 = t*t
@@ -1167,6 +1321,8 @@ class ProfileManager:
         self.gcode = self.printer.lookup_object('gcode')
         self.bedmesh = bedmesh
         self.profiles = {}
+        # LRU of name -> (profile points, built ZMesh)
+        self.mesh_cache = collections.OrderedDict()
         self.current_profile = ""
         self.incompatible_profiles = []
         # Fetch stored profiles from Config
@@ -1230,12 +1386,8 @@ class ProfileManager:
         configfile = self.printer.lookup_object('configfile')
         cfg_name = self.name + " " + prof_name
         # set params
-        z_values = ""
-        for line in probed_matrix:
-            z_values += "\n  "
-            for p in line:
-                z_values += "%.6f, " % p
-            z_values = z_values[:-2]
+        z_values = "".join(["\n  " + ", ".join(["%.6f" % p for p in line])
+                            for line in probed_matrix])
         configfile.set(cfg_name, 'version', PROFILE_VERSION)
         configfile.set(cfg_name, 'points', z_values)
         for key, value in mesh_params.items():
@@ -1247,6 +1399,9 @@ class ProfileManager:
         profile['points'] = probed_matrix
         profile['mesh_params'] = collections.OrderedDict(mesh_params)
         self.profiles = profiles
+        # The live mesh may have been updated in place, so it is not
+        # cached - the next load builds it from the saved points
+        self.mesh_cache.pop(prof_name, None)
         self.current_profile = prof_name
         self.bedmesh.update_status()
         self.gcode.respond_info(
@@ -1254,16 +1409,25 @@ class ProfileManager:
             "for the current session.  The SAVE_CONFIG command will\n"
             "update the printer config file and restart the printer."
             % (prof_name))
-    def load_profile(self, prof_name):
-        profile = self.profiles.get(prof_name, None)
-        if profile is not None:
-            probed_matrix = profile['points']
-            mesh_params = profile['mesh_params']
-            z_mesh = ZMesh(mesh_params,self.printer)
+    def _get_profile_mesh(self, prof_name):
+        profile = self.profiles[prof_name]
+        points = profile['points']
+        cached = self.mesh_cache.pop(prof_name, None)
+        if cached is not None and cached[0] is points:
+            z_mesh = cached[1]
+        else:
+            z_mesh = ZMesh(profile['mesh_params'], self.printer)
             try:
-                z_mesh.build_mesh(probed_matrix)
+                z_mesh.build_mesh(points)
             except BedMeshError as e:
                 raise self.gcode.error(str(e))
+        self.mesh_cache[prof_name] = (points, z_mesh)
+        while len(self.mesh_cache) > PROFILE_CACHE_SIZE:
+            self.mesh_cache.popitem(last=False)
+        return z_mesh.copy()
+    def load_profile(self, prof_name):
+        if prof_name in self.profiles:
+            z_mesh = self._get_profile_mesh(prof_name)
             self.current_profile = prof_name
             self.bedmesh.set_mesh(z_mesh)
         else:
@@ -1278,6 +1442,7 @@ class ProfileManager:
             profiles = dict(self.profiles)
             del profiles[prof_name]
             self.profiles = profiles
+            self.mesh_cache.pop(prof_name, None)
             self.bedmesh.update_status()
             self.gcode.respond_info(
                 "Profile [%s] removed from storage for this session.\n"
@@ -16,6 +16,13 @@ BL24C16F_CHIP_ADDR_5 = 0x55
 BL24C16F_CHIP_ADDR_6 = 0x56
 BL24C16F_CHIP_ADDR_7 = 0x57
 
+# Power loss checkpoint layout: byte 0 holds the active record slot,
+# byte 1 is 1 while a print is being recorded (255 otherwise) and slot
+# N (1-255) is an 8 byte record at address N*8 holding the file
+# position (uint32) and the E base position (float).
+CHECKPOINT_SLOTS = 255
+CHECKPOINT_SLOT_WRITES = 256
+
 class EEPROMCommandHelper:
     def __init__(self, config, chip):
         self.printer = config.get_printer()
@@ -217,6 +224,10 @@ class BL24C16F:
         self.i2c7 = bus.MCU_I2C_from_config(
             config, default_addr=BL24C16F_CHIP_ADDR_7, default_speed=400000)
         self.mcu = self.i2c0.get_mcu()
+        # Cached active checkpoint slot (None until the first checkpoint
+        # of a print has been written)
+        self.checkpoint_slot = None
+        self.checkpoint_writes = 0
         self.printer.add_object("bl24c16f " + self.name, self)
         self.printer.register_event_handler("klippy:connect",
                                             self.handle_connect)
@@ -255,6 +266,9 @@ class BL24C16F:
         if type(data) is not list:
             data = [data]
 
+        if addr < 2:
+            # Checkpoint header changed - no longer matches the cache
+            self.checkpoint_slot = None
         index = addr // 256
         offset = addr % 256
         data.insert(0, offset)
@@ -289,6 +303,29 @@ class BL24C16F:
         pos = self.read_reg(0, 1)
         return int.from_bytes(pos, 'little')
     
+    def reset_checkpoints(self):
+        self.checkpoint_slot = None
+    def write_checkpoint(self, file_position, base_position_e):
+        # Write a power loss record with a single 8 byte page write.  The
+        # first record of a print, and every CHECKPOINT_SLOT_WRITES
+        # records after that, moves to the next slot of the ring so that
+        # writes are spread over the whole eeprom.  The header is only
+        # updated after the record in the new slot has been written.
+        record = list(struct.pack('<I', int(file_position) & 0xffffffff)
+                      + struct.pack('f', base_position_e))
+        slot = self.checkpoint_slot
+        if (slot is not None
+            and self.checkpoint_writes < CHECKPOINT_SLOT_WRITES):
+            self.write_reg(slot * 8, record)
+            self.checkpoint_writes += 1
+            return
+        if slot is None:
+            slot = self.eepromReadHeader()
+        slot = slot % CHECKPOINT_SLOTS + 1
+        self.write_reg(slot * 8, record)
+        self.write_reg(0, [slot, 1])
+        self.checkpoint_slot = slot
+        self.checkpoint_writes = 1
     def eepromReadBody(self, pos):
         file_position = self.read_reg(pos*8, 4)
         base_position_e = self.read_reg(pos*8+4, 4)
@@ -54,6 +54,99 @@ class RCLFilter:
         return out_vals
 
 
+# Incremental version of the RCTFilter -> [RCHFilter ->] RCLFilter chains
+# run by Filter.cal_offset_by_vals() (hft_hz=None) and
+# Filter.cal_filter_by_vals().  The results are identical to the batch
+# versions.  RCTFilter passes the last two samples through unchanged, so
+# only the earlier ("stable") samples advance the filter state; the last
+# two are filtered from a copy of that state on every update.  Both IIR
+# stages start from the first sample of the window, so the state is
+# rebuilt from the new window start whenever the window slides.  An
+# update is therefore only O(new samples) while the window fills; once
+# it is full every new sample costs O(window), like the batch versions
+# (but without the list copies of the separate filter stages).  See
+# scripts/bench_filter_stream.py for a check against the batch versions.
+class FilterStream:
+    def __init__(self, s_count, cut_len, lft_k1, hft_hz=None, acq_hz=80):
+        self.s_count = s_count
+        self.cut_len = cut_len
+        self.lft_k1 = lft_k1
+        self.hft_coff = None
+        if hft_hz is not None:
+            rc = 1. / 2. / math.pi / hft_hz
+            self.hft_coff = rc / (rc + 1. / acq_hz)
+        self.reset()
+
+    def reset(self):
+        self.count = -1
+        self.start = -1
+        self.stable = 0
+        self.result = None
+        # Per channel: [last stable tft value, hft output, lft output]
+        self.states = [None] * self.s_count
+        self.outs = [[] for i in range(self.s_count)]
+
+    def _filter(self, state, out, tvals):
+        # 'state' is [last tft value, hft output, lft output], or None
+        # before the first sample of the window
+        coff = self.hft_coff
+        k1 = self.lft_k1
+        for t in tvals:
+            if state is None:
+                h = 0 if coff is not None else t
+                state = [t, h, h]
+            else:
+                last_t, last_h, last_l = state
+                h = (t - last_t + last_h) * coff if coff is not None else t
+                state = [t, h, last_l * (1 - k1) + h * k1]
+            out.append(state[2])
+        return state
+
+    def update(self, count, valss):
+        # 'count' is the total number of samples received and 'valss' the
+        # current window (the last len(valss[0]) of them) per channel
+        size = len(valss[0])
+        start = count - size
+        if count == self.count and self.result is not None:
+            return self.result
+        if start != self.start or count < self.count:
+            self.reset()
+            self.start = start
+        self.count = count
+        stable = max(size - 2, 0)
+        tails = []
+        for ch in range(self.s_count):
+            vals = valss[ch]
+            out = self.outs[ch]
+            # RCTFilter output for the samples that became stable
+            tvals = []
+            for i in range(self.stable, stable):
+                a, b, c = math.fabs(vals[i]), math.fabs(vals[i + 1]), \
+                    math.fabs(vals[i + 2])
+                idx = 0 if a <= b and a <= c else (1 if b <= c else 2)
+                tvals.append(vals[i + idx])
+            self.states[ch] = self._filter(self.states[ch], out, tvals)
+            tail = []
+            self._filter(self.states[ch], tail, vals[stable:size])
+            tails.append(tail)
+        self.stable = stable
+        cut_len = self.cut_len
+        tmp_vals = [[], [], [], []]
+        for ch in range(self.s_count):
+            if cut_len:
+                tmp_vals[ch] = (self.outs[ch] + tails[ch])[-cut_len:]
+        out_vals = []
+        for i in range(len(tmp_vals[0])):
+            sums = 0
+            for ch in range(self.s_count):
+                sums += math.fabs(tmp_vals[ch][i])
+            out_vals.append(sums)
+        for ch in range(self.s_count):
+            tmp_vals[ch] = [abs(v) for v in tmp_vals[ch]]
+        self.result = (out_vals, tmp_vals)
+        return self.result
+
+
 class Filter:
     def __init__(self, config):
         self.hft_hz = config.getfloat('hft_hz', default=5, minval=0.1, maxval=10.)
@@ -71,6 +164,14 @@ class Filter:
     def get_hft(self, cut_hz, acq_hz):
         return RCHFilter(cut_frq_hz=cut_hz, acq_frq_hz=acq_hz)
 
+    def get_offset_stream(self, s_count, lft_k1, cut_len):
+        # Incremental cal_offset_by_vals()
+        return FilterStream(s_count, cut_len, lft_k1)
+
+    def get_filter_stream(self, s_count, hft_hz, lft_k1, cut_len):
+        # Incremental cal_filter_by_vals()
+        return FilterStream(s_count, cut_len, lft_k1, hft_hz=hft_hz)
+
     def cal_offset_by_vals(self, s_count, new_valss, lft_k1, cut_len):
         out_vals = []
         tmp_vals = [[], [], [], []]
@@ -1,6 +1,49 @@
-import math, logging
+import math, logging, bisect
 from .bed_mesh import *
 
+# Piecewise linear interpolation between [[pos, gap], ...] breakpoints
+# (clamped to the first/last gap), with the breakpoint positions and
+# segment deltas precomputed so that a lookup is a single bisect
+class GapTable:
+    def __init__(self, points):
+        self.pos = [p[0] for p in points]
+        self.gaps = [p[1] for p in points]
+        self.pos_d = [self.pos[i + 1] - self.pos[i]
+                      for i in range(len(points) - 1)]
+        self.gap_d = [self.gaps[i + 1] - self.gaps[i]
+                      for i in range(len(points) - 1)]
+        self.min_pos = self.pos[0]
+        self.max_pos = self.pos[-1]
+        self.min_gap = self.gaps[0]
+        self.max_gap = self.gaps[-1]
+    def get(self, pos):
+        if pos <= self.min_pos:
+            return self.min_gap
+        if pos >= self.max_pos:
+            return self.max_gap
+        i = bisect.bisect_left(self.pos, pos) - 1
+        return self.gap_d[i] * (pos - self.pos[i]) / self.pos_d[i] + self.gaps[i]
+
+# Bilinear interpolation between the gaps measured at the four mesh
+# corners (min_x/min_y, max_x/min_y, min_x/max_y, max_x/max_y)
+class GapSurface:
+    def __init__(self, min_x, min_y, max_x, max_y, corner_gaps):
+        z0, z1, z2, z3 = corner_gaps
+        self.min_x = min_x
+        self.min_y = min_y
+        if math.fabs(max_x - min_x) < 0.001 or math.fabs(max_y - min_y) < 0.001:
+            self.inv_dx = self.inv_dy = 0.
+            self.coeffs = (0., 0., 0., 0.)
+            return
+        self.inv_dx = 1. / (max_x - min_x)
+        self.inv_dy = 1. / (max_y - min_y)
+        self.coeffs = (z0, z1 - z0, z2 - z0, z3 - z2 - z1 + z0)
+    def get(self, x, y):
+        u = (x - self.min_x) * self.inv_dx
+        v = (y - self.min_y) * self.inv_dy
+        c0, cu, cv, cuv = self.coeffs
+        return c0 + cu * u + cv * v + cuv * u * v
+
 class GapAutoComp:
     def __init__(self, config):
         self.printer = config.get_printer()
@@ -18,6 +61,7 @@ class GapAutoComp:
         self.z_gaps = list(config.getfloatlist("z_gaps"))
         
         self.x_1dps = self.y_1dps = self.z_2dps = None
+        self._build_tables()
 
         self.gcode = self.printer.lookup_object('gcode')
         self.gcode.register_command('SET_GAP_AUTO_COMP', self.cmd_SET_GAP_AUTO_COMP, desc=self.cmd_SET_GAP_AUTO_COMP_help)
@@ -54,12 +98,25 @@ class GapAutoComp:
         if len(self.z_gaps) == 4:
             self.z_2dps = [[min_x, min_y, self.z_gaps[0]], [max_x, min_y, self.z_gaps[1]], [min_x, max_y, self.z_gaps[2]], [max_x, max_y, self.z_gaps[3]]]
 
+        self._build_tables()
+
         if self.show_msg:
             self.gcode.respond_info('X_GAPS=%s' % str(self.x_gaps if not self.x_1dps else self.x_1dps))
             self.gcode.respond_info('Y_GAPS=%s' % str(self.y_gaps if not self.y_1dps else self.y_1dps))
             self.gcode.respond_info('Z_GAPS=%s' % str(self.z_gaps if not self.z_2dps else self.z_2dps))
         pass        
 
+    def _build_tables(self):
+        # Compile the gap calibration into the lookup tables used by
+        # deal_move() and get_gaps()
+        self.x_table = GapTable(self.x_1dps if self.x_1dps else [[0., self.x_gaps[0]]])
+        self.y_table = GapTable(self.y_1dps if self.y_1dps else [[0., self.y_gaps[0]]])
+        if self.z_2dps:
+            (min_x, min_y, z0), (max_x, _, z1), (_, max_y, z2), (_, _, z3) = self.z_2dps
+            self.z_surface = GapSurface(min_x, min_y, max_x, max_y, (z0, z1, z2, z3))
+        else:
+            self.z_surface = GapSurface(0., 0., 1., 1., [self.z_gaps[0]] * 4)
+
     def get_linear2(self, p1, p2, po, is_base_x):
         if (math.fabs(p1[0] - p2[0]) < 0.001 and is_base_x) or (math.fabs(p1[1] - p2[1]) < 0.001 and not is_base_x):
             return po
@@ -69,11 +126,13 @@ class GapAutoComp:
         return po
     
     def get_best_rdy_z(self, rdy_x, rdy_y):
-        p_left = [self.z_gaps[0][0], rdy_y, 0]
-        p_right = [self.z_gaps[2][0], rdy_y, 0]
+        # Interpolate along Y on the min_x and max_x mesh edges, then
+        # along X between the two
+        p_left = [self.z_2dps[0][0], rdy_y, 0]
+        p_right = [self.z_2dps[1][0], rdy_y, 0]
         p_mid = [rdy_x, rdy_y, 0]
-        p_left = self.get_linear2(self.z_gaps[0], self.z_gaps[1], p_left, False)
-        p_right = self.get_linear2(self.z_gaps[2], self.z_gaps[3], p_right, False)
+        p_left = self.get_linear2(self.z_2dps[0], self.z_2dps[2], p_left, False)
+        p_right = self.get_linear2(self.z_2dps[1], self.z_2dps[3], p_right, False)
         p_mid = self.get_linear2(p_left, p_right, p_mid, True)
         return p_mid[2]
     
@@ -88,11 +147,11 @@ class GapAutoComp:
                 if now_pos[i] != new_pos[i]:          
                     if new_pos[i] > now_pos[i]:
                         if i == 0:
-                            self.ofts[i] = self.get_x_gap(new_pos[0], new_pos[1], new_pos[2])
+                            self.ofts[i] = self.x_table.get(new_pos[0])
                         elif i == 1:
-                            self.ofts[i] = self.get_y_gap(new_pos[0], new_pos[1], new_pos[2])
+                            self.ofts[i] = self.y_table.get(new_pos[1])
                         elif i == 2:
-                            self.ofts[i] = self.get_z_gap(new_pos[0], new_pos[1], new_pos[2])
+                            self.ofts[i] = self.z_surface.get(new_pos[0], new_pos[1])
                     elif new_pos[i] < now_pos[i]:
                         self.ofts[i] = 0
                     self.last_ofts[i] = self.ofts[i]
@@ -100,36 +159,22 @@ class GapAutoComp:
         return self.ofts
 
     def get_x_gap(self, x, y, z):
-        if self.x_1dps == None:
-            return self.x_gaps[0]
-        
-        if x <= self.x_1dps[0][0]:
-            return self.x_1dps[0][1]
-        if x >= self.x_1dps[-1][0]:
-            return self.x_1dps[-1][1]
-        for i in range(len(self.x_1dps) - 1):
-            if self.x_1dps[i][0] < x <= self.x_1dps[i + 1][0]:
-                return (self.x_1dps[i+1][1] - self.x_1dps[i][1]) * (x - self.x_1dps[i][0]) / (self.x_1dps[i + 1][0] - self.x_1dps[i][0]) + self.x_1dps[i][1]
-        return 0.
+        return self.x_table.get(x)
     
     def get_y_gap(self, x, y, z):
-        if self.y_1dps == None:
-            return self.y_gaps[0]
-        
-        if y <= self.y_1dps[0][0]:
-            return self.y_1dps[0][1]
-        if y >= self.y_1dps[-1][0]:
-            return self.y_1dps[-1][1]
-        for i in range(len(self.y_1dps) - 1):
-            if self.y_1dps[i][0] < y <= self.y_1dps[i + 1][0]:
-                return (self.y_1dps[i+1][1] - self.y_1dps[i][1]) * (y - self.y_1dps[i][0]) / (self.y_1dps[i + 1][0] - self.y_1dps[i][0]) + self.y_1dps[i][1]
-        return 0.
+        return self.y_table.get(y)
     
     def get_z_gap(self, x, y, z):
-        if self.z_2dps == None:
-            return self.z_gaps[0]
-        return self.get_best_rdy_z(x, y, )
-    pass
+        return self.z_surface.get(x, y)
+
+    def get_gaps(self, positions):
+        # Returns the [x, y, z] gaps for each of the given [x, y, ...]
+        # positions
+        x_get = self.x_table.get
+        y_get = self.y_table.get
+        z_get = self.z_surface.get
+        return [[x_get(pos[0]), y_get(pos[1]), z_get(pos[0], pos[1])]
+                for pos in positions]
 
     cmd_SET_GAP_AUTO_COMP_help = "Set the params for auto bed comp."
     def cmd_SET_GAP_AUTO_COMP(self, gcmd): 
@@ -0,0 +1,270 @@
+# Layer and position index for g-code files printed by virtual_sdcard
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, re, json, bisect, logging
+
+INDEX_VERSION = 2
+READ_SIZE = 64 * 1024
+CHECKPOINT_INTERVAL = 64 * 1024
+LAYER_KEYS = [";LAYER:", "; layer:", "; LAYER:", ";AFTER_LAYER_CHANGE",
+              ";LAYER_CHANGE"]
+LAYER_PREFIXES = tuple(LAYER_KEYS)
+STATE_AXES = {'X': 0, 'Y': 1, 'Z': 2, 'E': 3, 'F': 4}
+MODAL_COMMANDS = {"G90": (6, True), "G91": (6, False),
+                  "M82": (7, True), "M83": (7, False)}
+
+# Track the last X, Y, Z, E, F values, the part fan speed and the
+# G90/G91 and M82/M83 modes seen in a file
+class PositionTracker:
+    def __init__(self, state=None):
+        if state is None:
+            state = [0., 0., 0., 0., 0., 0., True, True]
+        self.state = list(state)
+    def _parse_axes(self, line, axes):
+        state = self.state
+        for param in line.split(';', 1)[0].split()[1:]:
+            pos = axes.get(param[:1])
+            if pos is None:
+                continue
+            try:
+                state[pos] = float(param[1:])
+            except ValueError:
+                continue
+    def process_line(self, line):
+        cmd = line[:3]
+        if cmd == "G1 " or cmd == "G0 ":
+            self._parse_axes(line, STATE_AXES)
+        elif cmd == "G92":
+            self._parse_axes(line, STATE_AXES)
+        elif cmd in MODAL_COMMANDS:
+            pos, val = MODAL_COMMANDS[cmd]
+            self.state[pos] = val
+        elif cmd == "M10":
+            if line.startswith("M107"):
+                self.state[5] = 0.
+            elif line.startswith("M106"):
+                params = line.split(';', 1)[0].split()
+                if "P1" in params or "P2" in params:
+                    return
+                for param in params:
+                    if param[:1] == 'S':
+                        try:
+                            self.state[5] = float(param[1:])
+                        except ValueError:
+                            pass
+    def get_position(self):
+        # E is only a position with absolute extrusion (M82)
+        state = self.state
+        e = state[3] if state[7] else 0.
+        return {"X": state[0], "Y": state[1], "Z": state[2], "E": e,
+                "F": state[4], "fan": state[5], "absolute_coord": state[6],
+                "absolute_extrude": state[7]}
+
+def iter_lines(f, file_position=0):
+    # Yields (position, line) using the same line splitting and
+    # position accounting as VirtualSD.work_handler
+    partial_input = ""
+    while 1:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        lines = data.split('\n')
+        lines[0] = partial_input + lines[0]
+        partial_input = lines.pop()
+        for line in lines:
+            yield file_position, line
+            file_position += len(line) + 1
+    if partial_input:
+        yield file_position, partial_input
+
+class GCodeIndex:
+    def __init__(self, data):
+        self.size = data["size"]
+        self.mtime = data["mtime"]
+        self.layer_key = data["layer_key"]
+        self.layers = data["layers"]
+        self.checkpoints = data["checkpoints"]
+        self.layer_pos = [layer[0] for layer in self.layers]
+        self.checkpoint_pos = [cp[0] for cp in self.checkpoints]
+    def get_layer_count(self):
+        return len(self.layers)
+    def get_layer(self, file_position):
+        # Number of layer changes executed before file_position
+        return bisect.bisect_left(self.layer_pos, file_position)
+    def get_next_layer_pos(self, file_position):
+        idx = bisect.bisect_left(self.layer_pos, file_position)
+        if idx >= len(self.layer_pos):
+            return None
+        return self.layer_pos[idx]
+    def get_layer_z(self, layer):
+        if layer < 1 or layer > len(self.layers):
+            return None
+        return self.layers[layer - 1][1]
+    def get_position(self, file_path, file_position):
+        # Restore the state at the closest checkpoint and then replay
+        # at most CHECKPOINT_INTERVAL bytes up to file_position
+        idx = bisect.bisect_right(self.checkpoint_pos, file_position) - 1
+        if idx < 0:
+            start_pos, state = 0, None
+        else:
+            start_pos = self.checkpoints[idx][0]
+            state = self.checkpoints[idx][1:]
+        tracker = PositionTracker(state)
+        with open(file_path, 'r', newline='') as f:
+            f.seek(start_pos)
+            for pos, line in iter_lines(f, start_pos):
+                if pos >= file_position:
+                    break
+                tracker.process_line(line)
+        return tracker.get_position()
+    def get_data(self):
+        return {"version": INDEX_VERSION, "size": self.size,
+                "mtime": self.mtime, "layer_key": self.layer_key,
+                "layers": self.layers, "checkpoints": self.checkpoints}
+    def save(self, index_path):
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(self.get_data()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, index_path)
+
+def load_index(index_path):
+    try:
+        with open(index_path, "r") as f:
+            data = json.loads(f.read())
+        if data.get("version") != INDEX_VERSION:
+            return None
+        return GCodeIndex(data)
+    except Exception:
+        logging.exception("gcode_index load %s", index_path)
+        return None
+
+def build_index(file_path, checkpoint_interval=CHECKPOINT_INTERVAL):
+    st = os.stat(file_path)
+    tracker = PositionTracker()
+    state = tracker.state
+    process_line = tracker.process_line
+    layer_key = None
+    layers = []
+    checkpoints = []
+    next_checkpoint = 0
+    pending_z = None
+    with open(file_path, 'r', newline='', errors='replace') as f:
+        for pos, line in iter_lines(f):
+            if pos >= next_checkpoint:
+                checkpoints.append([pos] + state)
+                next_checkpoint = pos + checkpoint_interval
+            if line.startswith(LAYER_PREFIXES):
+                if layer_key is None:
+                    for key in LAYER_KEYS:
+                        if line.startswith(key):
+                            layer_key = key
+                            break
+                if line.startswith(layer_key):
+                    pending_z = len(layers)
+                    layers.append([pos, None])
+                continue
+            process_line(line)
+            if (pending_z is not None and line[:3] in ("G0 ", "G1 ")
+                and " Z" in line and state[2]):
+                layers[pending_z][1] = state[2]
+                pending_z = None
+    return GCodeIndex({"size": st.st_size, "mtime": st.st_mtime,
+                       "layer_key": layer_key, "layers": layers,
+                       "checkpoints": checkpoints})
+
+######################################################################
+# Backwards search for the resume position
+######################################################################
+
+# Matching on a leading newline (instead of "^" with re.M) only tries
+# line starts and is considerably faster on large blocks
+MODAL_RE = re.compile(br"\n(G90|G91|M82|M83)(?![0-9])")
+MODAL_STATE = {b"G90": ("absolute_coord", True),
+               b"G91": ("absolute_coord", False),
+               b"M82": ("absolute_extrude", True),
+               b"M83": ("absolute_extrude", False)}
+RESUME_AXES = {b'X': 'X', b'Y': 'Y', b'Z': 'Z', b'E': 'E'}
+
+def iter_blocks_reverse(f, file_position, block_size=READ_SIZE):
+    # Yields (position, data) blocks of complete lines from a file
+    # opened in binary mode, starting at file_position and moving
+    # towards the start of the file
+    partial = b""
+    pos = file_position
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        data = f.read(read_size) + partial
+        if not pos:
+            yield 0, data
+            break
+        idx = data.find(b'\n')
+        if idx < 0:
+            partial = data
+            continue
+        partial = data[:idx]
+        yield pos + idx + 1, data[idx+1:]
+
+def iter_lines_reverse(f, file_position, block_size=READ_SIZE):
+    # Yields (position, line) for each line before file_position, last
+    # line first.  Lines are bytes - a newline byte never occurs inside
+    # a multibyte UTF-8 sequence so splitting on it is always safe.
+    for block_pos, data in iter_blocks_reverse(f, file_position, block_size):
+        end = block_pos + len(data)
+        for line in reversed(data.split(b'\n')):
+            end -= len(line)
+            yield end, line
+            end -= 1
+
+def _parse_resume_axes(line, result):
+    for param in line.split(b';', 1)[0].split()[1:]:
+        axis = RESUME_AXES.get(param[:1])
+        if axis is None or axis in result:
+            continue
+        try:
+            result[axis] = float(param[1:])
+        except ValueError:
+            continue
+
+def find_resume_position(f, file_position, block_size=READ_SIZE,
+                         pause=None):
+    # Search backwards from file_position for the last X, Y, Z and E
+    # values (a G92 that occurs after the last move sets the value) and
+    # the active G90/G91 and M82/M83 modes.  Stops as soon as all are
+    # known.  With relative extrusion (M83) the last E value is not a
+    # position and 0 is returned.  The optional pause() callback is
+    # invoked after each block.
+    axes = {}
+    modal = {}
+    for block_pos, data in iter_blocks_reverse(f, file_position, block_size):
+        if len(axes) < 4:
+            for line in reversed(data.split(b'\n')):
+                cmd = line[:3]
+                if cmd == b'G1 ' or cmd == b'G0 ' or cmd == b'G92':
+                    if len(axes) < 4:
+                        _parse_resume_axes(line, axes)
+                elif cmd in MODAL_STATE:
+                    key, val = MODAL_STATE[cmd]
+                    modal.setdefault(key, val)
+        else:
+            # Only the modes are still needed - search the whole block
+            found = {}
+            for m in MODAL_RE.finditer(b"\n" + data):
+                key, val = MODAL_STATE[m.group(1)]
+                found[key] = val
+            for key, val in found.items():
+                modal.setdefault(key, val)
+        if len(axes) == 4 and len(modal) == 2:
+            break
+        if pause is not None:
+            pause()
+    result = {"X": 0., "Y": 0., "Z": 0., "E": 0.,
+              "absolute_coord": True, "absolute_extrude": True}
+    result.update(axes)
+    result.update(modal)
+    if not result["absolute_extrude"]:
+        result["E"] = 0.
+    return result
@@ -7,6 +7,10 @@ import logging
 import math
 import os
 import json
+
+FAST_AXES = {'X': 0, 'Y': 1, 'Z': 2, 'E': 3, 'F': 4}
+FAST_NUMBER_CHARS = "0123456789.-+"
+
 class GCodeMove:
     def __init__(self, config):
         self.variable_safe_z = 0
@@ -35,6 +39,7 @@ class GCodeMove:
         self.is_printer_ready = False
         # Register g-code commands
         self.gcode = printer.lookup_object('gcode')
+        self.state_journal = printer.lookup_object('state_journal')
         gcode = printer.lookup_object('gcode')
         handlers = [
             'G1', 'G20', 'G21',
@@ -46,6 +51,9 @@ class GCodeMove:
             desc = getattr(self, 'cmd_' + cmd + '_help', None)
             gcode.register_command(cmd, func, False, desc)
         gcode.register_command('G0', self.cmd_G1)
+        self.fast_params = [None] * 5
+        gcode.register_fast_command('G1', self.fast_G1)
+        gcode.register_fast_command('G0', self.fast_G1)
         gcode.register_command('M114', self.cmd_M114, True)
         gcode.register_command('GET_POSITION', self.cmd_GET_POSITION, True,
                                desc=self.cmd_GET_POSITION_help)
@@ -205,6 +213,50 @@ class GCodeMove:
             raise gcmd.error("""{"code":"key273", "msg":"Unable to parse move '%s'", "values":["%s"]}"""
                              % (gcmd.get_commandline(),gcmd.get_commandline()))
         self.move_with_transform(self.last_position, self.speed)
+    def fast_G1(self, params):
+        # Same as cmd_G1 for lines that only contain X, Y, Z, E and F
+        # parameters with plain numeric values.  Anything else (and any
+        # line that cmd_G1 would reject) is left to cmd_G1.
+        values = self.fast_params
+        values[0] = values[1] = values[2] = values[3] = values[4] = None
+        for param in params:
+            pos = FAST_AXES.get(param[:1])
+            if pos is None:
+                return False
+            value = param[1:]
+            if not value or value.strip(FAST_NUMBER_CHARS):
+                return False
+            try:
+                values[pos] = float(value)
+            except ValueError:
+                return False
+        gcode_speed = values[4]
+        if gcode_speed is not None and gcode_speed <= 0.:
+            return False
+        last_position = self.last_position
+        for pos in (0, 1, 2):
+            v = values[pos]
+            if v is None:
+                continue
+            if pos == 2 and self.variable_z_coefficient > 0.0:
+                if self.last_z != v:
+                    v *= self.variable_z_coefficient
+                self.last_z = v
+            if not self.absolute_coord:
+                last_position[pos] += v
+            else:
+                last_position[pos] = v + self.base_position[pos]
+        v = values[3]
+        if v is not None:
+            v *= self.extrude_factor
+            if not self.absolute_coord or not self.absolute_extrude:
+                last_position[3] += v
+            else:
+                last_position[3] = v + self.base_position[3]
+        if gcode_speed is not None:
+            self.speed = gcode_speed * self.speed_factor
+        self.move_with_transform(last_position, self.speed)
+        return True
     # G-Code coordinate manipulation
     def cmd_G20(self, gcmd):
         # Set units to inches
@@ -308,8 +360,7 @@ class GCodeMove:
             for pos, delta in enumerate(move_delta):
                 self.last_position[pos] += delta
             self.move_with_transform(self.last_position, speed)
-    def recordPrintFileName(self, path, file_name, fan_state={}, filament_used=0, last_print_duration=0, pressure_advance="", slow_print=False):
-        import json, os
+    def recordPrintFileName(self, path, file_name, fan_state={}, filament_used=0, last_print_duration=0, pressure_advance="", slow_print=False, sync=False):
         fan = {}
         M204_accel = ""
         old_filament_used = 0
@@ -318,18 +369,17 @@ class GCodeMove:
         last_speed_factor = 0.0166666
         last_speed = 25
         set_gcode_offset = -5
-        if os.path.exists(path):
-            with open(path, "r") as f:
-                result = (json.loads(f.read()))
-                # fan = result.get("fan_state", "")
-                fan = result.get("fan_state", {})
-                M204_accel = result.get("M204", "")
-                old_filament_used = result.get("filament_used", 0)
-                old_last_print_duration = result.get("last_print_duration", 0)
-                old_pressure_advance = result.get("pressure_advance", "")
-                last_speed_factor = result.get("speed_factor", 0.0166666)
-                last_speed = result.get("speed", 25)
-                set_gcode_offset = result.get("SET_GCODE_OFFSET", -5)
+        result = self.state_journal.load(path)
+        if result is not None:
+            # fan = result.get("fan_state", "")
+            fan = result.get("fan_state", {})
+            M204_accel = result.get("M204", "")
+            old_filament_used = result.get("filament_used", 0)
+            old_last_print_duration = result.get("last_print_duration", 0)
+            old_pressure_advance = result.get("pressure_advance", "")
+            last_speed_factor = result.get("speed_factor", 0.0166666)
+            last_speed = result.get("speed", 25)
+            set_gcode_offset = result.get("SET_GCODE_OFFSET", -5)
         if fan_state.get("M106 S") and fan_state.get("M106 S", "") != fan.get("M106 S", ""):
             fan["M106 S"] = fan_state.get("M106 S")
         elif fan_state.get("M106 P0") and fan_state.get("M106 P0", "") != fan.get("M106 P0", ""):
@@ -366,9 +416,7 @@ class GCodeMove:
             'pressure_advance': pressure_advance,
 			'SET_GCODE_OFFSET': set_gcode_offset
         }
-        with open(path, "w") as f:
-            f.write(json.dumps(data))
-            f.flush()
+        self.state_journal.update(path, data, sync=sync)
     cmd_CX_RESTORE_GCODE_STATE_help = "Restore a previously saved G-Code state"
     def cmd_CX_RESTORE_GCODE_STATE(self, print_info, file_name_path, XYZE):
         try:
@@ -397,19 +445,24 @@ class GCodeMove:
             state["base_position"] = [0.0, 0.0, 0.0, print_info.get("base_position_e", -1)]
             base_position_e = print_info.get("base_position_e", -1)
             logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE base_position_e:%s" % base_position_e)
-            with open(file_name_path, "r") as f:
-                file_info = json.loads(f.read())
-                state["file_path"] = file_info.get("file_path", "")
-                state["absolute_extrude"] = file_info.get("absolute_extrude", True)
-                state["absolute_coord"] = file_info.get("absolute_coord", True)
-                state["fan_state"] = file_info.get("fan_state", {})
-                state["variable_z_safe_pause"] = file_info.get("variable_z_safe_pause", 0)
-                state["M204"] = file_info.get("M204", "")
-                state["speed_factor"] = file_info.get("speed_factor", 0.016666666)
-                state["extrude_factor"] = file_info.get("extrude_factor", 1.0)
-                state["speed"] = file_info.get("speed", 25)
-                state["pressure_advance"] = file_info.get("pressure_advance", "")
-                state["SET_GCODE_OFFSET"] = file_info.get("SET_GCODE_OFFSET", -5)
+            file_info = self.state_journal.load(file_name_path)
+            if file_info is None:
+                raise IOError("No such file: '%s'" % (file_name_path,))
+            state["file_path"] = file_info.get("file_path", "")
+            # The modes of the file at the resume position are preferred
+            # over those of the last journal write
+            state["absolute_extrude"] = XYZE.get(
+                "absolute_extrude", file_info.get("absolute_extrude", True))
+            state["absolute_coord"] = XYZE.get(
+                "absolute_coord", file_info.get("absolute_coord", True))
+            state["fan_state"] = file_info.get("fan_state", {})
+            state["variable_z_safe_pause"] = file_info.get("variable_z_safe_pause", 0)
+            state["M204"] = file_info.get("M204", "")
+            state["speed_factor"] = file_info.get("speed_factor", 0.016666666)
+            state["extrude_factor"] = file_info.get("extrude_factor", 1.0)
+            state["speed"] = file_info.get("speed", 25)
+            state["pressure_advance"] = file_info.get("pressure_advance", "")
+            state["SET_GCODE_OFFSET"] = file_info.get("SET_GCODE_OFFSET", -5)
             state["last_position"] = [XYZE["X"], XYZE["Y"], XYZE["Z"], XYZE["E"]+base_position_e]
             logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE state:%s" % str(state))
 
@@ -492,16 +545,16 @@ class GCodeMove:
             self.absolute_extrude = state['absolute_extrude']
             gcode.run_script_from_command("M221 S%s" % int(state['extrude_factor']*100))
             try:
-                if os.path.exists(gcode.exclude_object_info):
-                    with open(gcode.exclude_object_info, "r") as f:
-                        exclude_object_cmds = json.loads(f.read())
-                        EXCLUDE_OBJECT_DEFINE = exclude_object_cmds.get("EXCLUDE_OBJECT_DEFINE", [])
-                        EXCLUDE_OBJECT = exclude_object_cmds.get("EXCLUDE_OBJECT", [])
-                        for line in EXCLUDE_OBJECT_DEFINE:
-                            gcode.run_script_from_command(line)
-                        for line in EXCLUDE_OBJECT:
-                            gcode.run_script_from_command(line)
-                        gcode.run_script_from_command("M400")
+                exclude_object_cmds = self.state_journal.load(
+                    gcode.exclude_object_info)
+                if exclude_object_cmds is not None:
+                    EXCLUDE_OBJECT_DEFINE = exclude_object_cmds.get("EXCLUDE_OBJECT_DEFINE", [])
+                    EXCLUDE_OBJECT = exclude_object_cmds.get("EXCLUDE_OBJECT", [])
+                    for line in EXCLUDE_OBJECT_DEFINE:
+                        gcode.run_script_from_command(line)
+                    for line in EXCLUDE_OBJECT:
+                        gcode.run_script_from_command(line)
+                    gcode.run_script_from_command("M400")
             except Exception as err:
                 logging.exception("RESTORE EXCLUDE_OBJECT err:%s" % err)
             try:
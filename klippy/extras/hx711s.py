@@ -8,6 +8,46 @@ import time
 import mcu
 import math
 
+# Sliding window of the last 'size' samples (the raw params and one
+# value per channel).  Each sample is stored twice, at pos and
+# pos + capacity, so that the window is always a single contiguous
+# slice and appending is O(1).  Samples are appended from the serial
+# thread and read from the reactor without locks: the writer publishes
+# a sample by incrementing 'count' after storing it, and the 'margin'
+# extra slots keep samples that arrive while a reader copies the window
+# from overwriting it.
+class SampleRing:
+    def __init__(self, size, channels, margin=64):
+        self.size = size
+        self.capacity = capacity = size + margin
+        self.params = [None] * (2 * capacity)
+        self.vals = [[0.] * (2 * capacity) for i in range(channels)]
+        self.count = 0
+    def append(self, params, vals):
+        count = self.count
+        pos = count % self.capacity
+        mirror = pos + self.capacity
+        self.params[pos] = self.params[mirror] = params
+        for buf, val in zip(self.vals, vals):
+            buf[pos] = buf[mirror] = val
+        self.count = count + 1
+    def _window(self, count):
+        size = min(count, self.size)
+        start = (count - size) % self.capacity
+        return start, start + size
+    def __len__(self):
+        return min(self.count, self.size)
+    def get_params(self):
+        start, end = self._window(self.count)
+        return self.params[start:end]
+    def get_vals(self):
+        return self.get_count_vals()[1]
+    def get_count_vals(self):
+        # Total number of samples appended and the window ending at it
+        count = self.count
+        start, end = self._window(count)
+        return count, [buf[start:end] for buf in self.vals]
+
 class HX711S:
     def __init__(self, config):
         self.printer = config.get_printer()
@@ -17,11 +57,9 @@ class HX711S:
         self.del_dirty = False
         self.index_dirty = 0
         self.start_tick = 0
-        self.need_wait = False
         self.s_clk_pin = []
         self.s_sdo_pin = []
-        self.all_params = []
-        self.all_vals = [[], [], [], []]
+        self.samples = SampleRing(0, self.s_count)
         for i in range(self.s_count):
             self.s_clk_pin.append(config.get('sensor%d_clk_pin' % i, None if i == 0 else self.s_clk_pin[i - 1]))
             self.s_sdo_pin.append(config.get('sensor%d_sdo_pin' % i, None if i == 0 else self.s_sdo_pin[i - 1]))
@@ -81,31 +119,25 @@ class HX711S:
         pass
 
     def _handle_result_hx711s(self, params):
-        while self.need_wait:
-            self.delay_s(0.001)
-        self.start_tick = self.start_tick if len(self.all_params) != 0 else params['nt']
+        samples = self.samples
+        if not len(samples):
+            self.start_tick = params['nt']
         if self.del_dirty and (params['vd'] != 0 or params['it'] > 20) and self.index_dirty == 0:
             self.index_dirty = 1
             return
         self.index_dirty -= 1 if self.index_dirty == 1 else 0
-        self.all_params.append(params)
-        for i in range(self.s_count):
-            self.all_vals[i].append(params['v%d' % i] - self.base_avgs[i])
+        base_avgs = self.base_avgs
+        samples.append(params, [params['v%d' % i] - base_avgs[i]
+                                for i in range(self.s_count)])
         if self.show_msg:
             self.gcode.respond_info('Hx711 Val=' + str(params))
-        if len(self.all_params) > self.pi_count:
-            del self.all_params[0]
-            for i in range(self.s_count):
-                del self.all_vals[i][0]
-        pass
 
     def query_start(self, pi_count, cycle_count, del_dirty=False, show_msg=False, is_ck_con=False):
         if self.is_shutdown or self.is_timeout:
             pass
         if cycle_count != 0:
             self.pi_count = pi_count
-            self.all_params = []
-            self.all_vals = [[], [], [], []]
+            self.samples = SampleRing(pi_count, self.s_count)
             self.show_msg = show_msg
             self.del_dirty = del_dirty
             self.index_dirty = 0
@@ -114,19 +146,23 @@ class HX711S:
         pass
 
     def get_params(self):
-        self.need_wait = True
-        tmps = [x for x in self.all_params]
-        self.need_wait = False
-        return tmps, self.start_tick
+        return self.samples.get_params(), self.start_tick
 
     def get_vals(self):
-        self.need_wait = True
-        tmps = [[], [], [], []]
-        for i in range(self.s_count):
-            tmps[i] = [x for x in self.all_vals[i]]
-        self.need_wait = False
+        tmps = self.samples.get_vals()
+        tmps.extend([[] for i in range(4 - self.s_count)])
         return tmps
 
+    def get_sample_count(self):
+        return len(self.samples)
+
+    def get_count_vals(self):
+        # Like get_vals() but also returns the total number of samples
+        # received since query_start() (for the incremental filters)
+        count, tmps = self.samples.get_count_vals()
+        tmps.extend([[] for i in range(4 - self.s_count)])
+        return count, tmps
+
     def delay_s(self, delay_s):
         toolhead = self.printer.lookup_object("toolhead")
         reactor = self.printer.get_reactor()
@@ -150,7 +186,7 @@ class HX711S:
             avgs = [0, 0, 0, 0]
             self.query_start(cnt, cnt + 5, del_dirty=True, show_msg=False)
             t_last = time.time()
-            while not (self.is_shutdown or self.is_timeout) and len(self.get_vals()[0]) < cnt and (time.time() - t_last) < cnt * 0.010 * 15:
+            while not (self.is_shutdown or self.is_timeout) and self.get_sample_count() < cnt and (time.time() - t_last) < cnt * 0.010 * 15:
                 self.delay_s(0.010)
                 pass
             vals = self.get_vals()
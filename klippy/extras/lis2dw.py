@@ -1,6 +1,6 @@
 # Support for reading acceleration data from an LIS2DW chip
 
-import logging, time, collections, threading, multiprocessing, os
+import logging, time, collections, threading, os
 from . import bus, motion_report, adxl345
 
 # LIS2DW registers
@@ -61,7 +61,8 @@ class LIS2DW:
         mcu.add_config_cmd("query_lis2dw oid=%d clock=0 rest_ticks=0"
                            % (oid,), on_restart=True)
         mcu.register_config_callback(self._build_config)
-        mcu.register_response(self._handle_lis2dw_data, "lis2dw_data", oid)
+        mcu.register_response(self._handle_lis2dw_data, "lis2dw_data", oid,
+                              batch=True)
         # Clock tracking
         self.last_sequence = self.max_query_duration = 0
         self.last_limit_count = self.last_error_count = 0
@@ -102,9 +103,9 @@ class LIS2DW:
     # Measurement collection
     def is_measuring(self):
         return self.query_rate > 0
-    def _handle_lis2dw_data(self, params):
+    def _handle_lis2dw_data(self, params_list):
         with self.lock:
-            self.raw_samples.append(params)
+            self.raw_samples.extend(params_list)
     def _extract_samples(self, raw_samples):
         # Load variables to optimize inner loop below
         (x_pos, x_scale), (y_pos, y_scale), (z_pos, z_scale) = self.axes_map
@@ -17,7 +17,6 @@ import tempfile
 import zipfile
 import shutil
 import uuid
-from PIL import Image
 
 # Annotation imports
 from typing import (
@@ -46,30 +45,28 @@ def _regex_find_floats(pattern: str,
                        ) -> List[float]:
     # If strict is enabled, pattern requires a floating point
     # value, otherwise it can be an integer value
-    fptrn = r'\d+\.\d*' if strict else r'\d+\.?\d*'
-    matches = re.findall(pattern, data)
+    fptrn = STRICT_FLOAT_RE if strict else FLOAT_RE
+    matches = _compile(pattern).findall(data)
     if matches:
         # return the maximum height value found
         try:
-            return [float(h) for h in re.findall(
-                    fptrn, " ".join(matches))]
+            return [float(h) for h in fptrn.findall(" ".join(matches))]
         except Exception:
             pass
     return []
 
 def _regex_find_ints(pattern: str, data: str) -> List[int]:
-    matches = re.findall(pattern, data)
+    matches = _compile(pattern).findall(data)
     if matches:
         # return the maximum height value found
         try:
-            return [int(h) for h in re.findall(
-                    r'\d+', " ".join(matches))]
+            return [int(h) for h in INT_RE.findall(" ".join(matches))]
         except Exception:
             pass
     return []
 
 def _regex_find_first(pattern: str, data: str) -> Optional[float]:
-    match = re.search(pattern, data)
+    match = _compile(pattern).search(data)
     val: Optional[float] = None
     if match:
         try:
@@ -79,7 +76,7 @@ def _regex_find_first(pattern: str, data: str) -> Optional[float]:
     return val
 
 def _regex_find_int(pattern: str, data: str) -> Optional[int]:
-    match = re.search(pattern, data)
+    match = _compile(pattern).search(data)
     val: Optional[int] = None
     if match:
         try:
@@ -89,11 +86,122 @@ def _regex_find_int(pattern: str, data: str) -> Optional[int]:
     return val
 
 def _regex_find_string(pattern: str, data: str) -> Optional[str]:
-    match = re.search(pattern, data)
+    match = _compile(pattern).search(data)
     if match:
         return match.group(1).strip('"')
     return None
 
+_compiled_patterns: Dict[str, re.Pattern] = {}
+def _compile(pattern: str, flags: int = 0) -> re.Pattern:
+    regex = _compiled_patterns.get(pattern)
+    if regex is None:
+        regex = _compiled_patterns[pattern] = re.compile(pattern, flags)
+    return regex
+
+FLOAT_RE = re.compile(r"\d+\.?\d*")
+STRICT_FLOAT_RE = re.compile(r"\d+\.\d*")
+INT_RE = re.compile(r"\d+")
+
+# A gcode header or footer block is tokenized once into an index of
+# comment "key = value" (also "key: value" and "key,value") entries,
+# the first temperature commands, and the "G1 Z" moves.  The slicer
+# parsers then query this index instead of scanning the text again.
+# Each token starts with a newline so that only line starts are tried.
+TOKEN_RE = re.compile(
+    r"\n(?:;[ \t]*(?P<key>[^=:,\r\n]*?)[ \t]*[=:,][ \t]*"
+    r"(?P<val>[^\r\n]*?)[ \t]*\r?$"
+    r"|(?P<cmd>M109 T0|M109|M190|M191) S(?P<temp>\d+\.?\d*)"
+    r"|G1 Z(?P<z>\d+\.\d*)(?P<zrest>[^\r\n]*))", re.M)
+
+def _leading_float(value: Optional[str],
+                   strict: bool = False
+                   ) -> Optional[float]:
+    if value is None:
+        return None
+    fptrn = STRICT_FLOAT_RE if strict else FLOAT_RE
+    match = fptrn.match(value)
+    if match is None:
+        return None
+    return float(match.group())
+
+def _leading_int(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    match = INT_RE.match(value)
+    if match is None:
+        return None
+    return int(match.group())
+
+class BlockIndex:
+    def __init__(self, data: str) -> None:
+        self.data = data
+        self.values: Dict[str, List[str]] = {}
+        self.first_pos: Dict[str, int] = {}
+        self.commands: Dict[str, float] = {}
+        self.z_moves: List[Tuple[float, str]] = []
+        values = self.values
+        first_pos = self.first_pos
+        commands = self.commands
+        z_moves = self.z_moves
+        for m in TOKEN_RE.finditer("\n" + data):
+            key, val, cmd, temp, z, zrest = m.groups()
+            if key is not None:
+                vlist = values.get(key)
+                if vlist is None:
+                    values[key] = [val]
+                    first_pos[key] = m.start()
+                else:
+                    vlist.append(val)
+            elif cmd is not None:
+                if cmd not in commands:
+                    commands[cmd] = float(temp)
+            else:
+                z_moves.append((float(z), zrest))
+
+    def get(self, *keys: str) -> Optional[str]:
+        # Return the value of the first matching comment in the block
+        found = [(self.first_pos[k], k) for k in keys if k in self.values]
+        if not found:
+            return None
+        return self.values[min(found)[1]][0]
+
+    def get_all(self, key: str) -> List[str]:
+        return self.values.get(key, [])
+
+    def get_prefix(self, prefix: str) -> Optional[Tuple[str, str]]:
+        # Keys are stored in the order they first appear in the block
+        for key, vlist in self.values.items():
+            if key.startswith(prefix):
+                return key, vlist[0]
+        return None
+
+    def get_float(self, *keys: str, strict: bool = False
+                  ) -> Optional[float]:
+        return _leading_float(self.get(*keys), strict)
+
+    def get_int(self, key: str) -> Optional[int]:
+        return _leading_int(self.get(key))
+
+    def get_string(self, key: str) -> Optional[str]:
+        val = self.get(key)
+        if val is None:
+            return None
+        return val.strip('"')
+
+    def get_max_float(self, key: str) -> Optional[float]:
+        result = [_leading_float(v) for v in self.get_all(key)]
+        result = [v for v in result if v is not None]
+        if result:
+            return max(result)
+        return None
+
+    def get_z_heights(self, rest_pattern: Optional[str] = None
+                      ) -> List[float]:
+        if rest_pattern is None:
+            return [z for z, rest in self.z_moves]
+        regex = _compile(rest_pattern)
+        return [z for z, rest in self.z_moves if regex.match(rest)]
+
 def get_print_file_metadata(file_path):
     result = {}
     count = 3000
@@ -101,36 +209,31 @@ def get_print_file_metadata(file_path):
         with open(file_path, "r") as f:
             while count:
                 count -= 1
-                line = f.readline() 
-                if not line.startswith(";"):
+                line = f.readline()
+                if not line.startswith(";") or not line.endswith("\n"):
+                    continue
+                key, sep, val = line[1:].partition(":")
+                field = MODEL_INFO_FIELDS.get(key)
+                if not sep or field is None:
                     continue
-                if re.findall(r";MINX:(.*)\n", line):  
-                    result["MINX"] = float(re.findall(r";MINX:(.*)\n", line)[0].strip())
-                if re.findall(r";MINY:(.*)\n", line):  
-                    result["MINY"] = float(re.findall(r";MINY:(.*)\n", line)[0].strip()) 
-                if re.findall(r";MINZ:(.*)\n", line):  
-                    result["MINZ"] = float(re.findall(r";MINZ:(.*)\n", line)[0].strip())
-                if re.findall(r";MAXX:(.*)\n", line):  
-                    result["MAXX"] = float(re.findall(r";MAXX:(.*)\n", line)[0].strip()) 
-                if re.findall(r";MAXY:(.*)\n", line):  
-                    result["MAXY"] = float(re.findall(r";MAXY:(.*)\n", line)[0].strip())
-                if re.findall(r";MAXZ:(.*)\n", line):  
-                    result["MAXZ"] = float(re.findall(r";MAXZ:(.*)\n", line)[0].strip())
-                if re.findall(r";Machine Height:(.*)\n", line):  
-                    result["MachineHeight"] = float(re.findall(r";Machine Height:(.*)\n", line)[0].strip())
-                if re.findall(r";Machine Width:(.*)\n", line):  
-                    result["MachineWidth"] = float(re.findall(r";Machine Width:(.*)\n", line)[0].strip())
-                if re.findall(r";Machine Depth:(.*)\n", line):  
-                    result["MachineDepth"] = float(re.findall(r";Machine Depth:(.*)\n", line)[0].strip())
-                if re.findall(r";Material Name:(.*)\n", line):  
-                    result["MaterialName"] = str(re.findall(r";Material Name:(.*)\n", line)[0].strip())
-                if re.findall(r";Material Type:(.*)\n", line):  
-                    result["MaterialType"] = str(re.findall(r";Material Type:(.*)\n", line)[0].strip())
+                name, conv = field
+                result[name] = conv(val.strip())
     except Exception as err:
         print(err)
         return None
     return result
 
+MODEL_INFO_FIELDS = {
+    "MINX": ("MINX", float), "MINY": ("MINY", float),
+    "MINZ": ("MINZ", float), "MAXX": ("MAXX", float),
+    "MAXY": ("MAXY", float), "MAXZ": ("MAXZ", float),
+    "Machine Height": ("MachineHeight", float),
+    "Machine Width": ("MachineWidth", float),
+    "Machine Depth": ("MachineDepth", float),
+    "Material Name": ("MaterialName", str),
+    "Material Type": ("MaterialType", str),
+}
+
 # Slicer parsing implementations
 class BaseSlicer(object):
     def __init__(self, file_path: str) -> None:
@@ -146,6 +249,11 @@ class BaseSlicer(object):
                  fsize: int) -> None:
         self.header_data = header_data
         self.footer_data = footer_data
+        self.header = BlockIndex(header_data)
+        if footer_data is header_data:
+            self.footer = self.header
+        else:
+            self.footer = BlockIndex(footer_data)
         self.size: int = fsize
 
     def _parse_min_float(self,
@@ -174,10 +282,9 @@ class BaseSlicer(object):
                            data: str,
                            pattern: Optional[str] = None
                            ) -> bool:
-        match = re.search(
-            r"\n((DEFINE_OBJECT)|(EXCLUDE_OBJECT_DEFINE)) NAME=",
-            data
-        )
+        match = _compile(
+            r"\n((DEFINE_OBJECT)|(EXCLUDE_OBJECT_DEFINE)) NAME="
+        ).search(data)
         if match is not None:
             # Objects already processed
             fname = os.path.basename(self.path)
@@ -196,7 +303,7 @@ class BaseSlicer(object):
         if pattern is not None:
             patterns.append(pattern)
         for regex in patterns:
-            if re.search(regex, data) is not None:
+            if _compile(regex).search(data) is not None:
                 self.has_m486_objects = regex == r"\nM486"
                 return True
         return False
@@ -208,14 +315,14 @@ class BaseSlicer(object):
         return self._check_has_objects(self.header_data)
 
     def parse_gcode_start_byte(self) -> Optional[int]:
-        m = re.search(r"\n[MG]\d+\s.*\n", self.header_data)
+        m = _compile(r"\n[MG]\d+\s.*\n").search(self.header_data)
         if m is None:
             return None
         return m.start()
 
     def parse_gcode_end_byte(self) -> Optional[int]:
         rev_data = self.footer_data[::-1]
-        m = re.search(r"\n.*\s\d+[MG]\n", rev_data)
+        m = _compile(r"\n.*\s\d+[MG]\n").search(rev_data)
         if m is None:
             return None
         return self.size - m.start()
@@ -267,25 +374,24 @@ class UnknownSlicer(BaseSlicer):
         return {'slicer': "Unknown"}
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return self._parse_min_float(r"G1\sZ\d+\.\d*", self.header_data)
+        heights = self.header.get_z_heights()
+        return min(heights) if heights else None
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_object_height(self) -> Optional[float]:
-        return self._parse_max_float(r"G1\sZ\d+\.\d*", self.footer_data)
+        heights = self.footer.get_z_heights()
+        return max(heights) if heights else None
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M109 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M109")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M190 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M190")
 
     def parse_chamber_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M191 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M191")
 
 
 class PrusaSlicer(BaseSlicer):
@@ -299,7 +405,7 @@ class PrusaSlicer(BaseSlicer):
             'A3dp-Slicer': r"A3dp-Slicer\s(.*)\son",
         }
         for name, expr in aliases.items():
-            match = re.search(expr, data)
+            match = _compile(expr).search(data)
             if match:
                 return {
                     'slicer': name,
@@ -313,28 +419,30 @@ class PrusaSlicer(BaseSlicer):
 
     def parse_first_layer_height(self) -> Optional[float]:
         # Check percentage
-        pct = _regex_find_first(
-            r"; first_layer_height = (\d+)%", self.footer_data)
-        if pct is not None:
+        value = self.footer.get("first_layer_height")
+        if value is None:
+            return None
+        match = _compile(r"(\d+)%").match(value)
+        if match is not None:
             if self.layer_height is None:
                 # Failed to parse the original layer height, so it is not
                 # possible to calculate a percentage
                 return None
+            pct = float(match.group(1))
             return round(pct / 100. * self.layer_height, 6)
-        return _regex_find_first(
-            r"; first_layer_height = (\d+\.?\d*)", self.footer_data)
+        return _leading_float(value)
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        self.layer_height = _regex_find_first(
-            r"; layer_height = (\d+\.?\d*)", self.footer_data)
+        self.layer_height = self.footer.get_float("layer_height")
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
-        matches = re.findall(
-            r";BEFORE_LAYER_CHANGE\n(?:.*\n)?;(\d+\.?\d*)", self.footer_data)
+        matches = _compile(
+            r";BEFORE_LAYER_CHANGE\n(?:.*\n)?;(\d+\.?\d*)"
+        ).findall(self.footer_data)
         if matches:
             try:
                 matches = [float(m) for m in matches]
@@ -342,36 +450,33 @@ class PrusaSlicer(BaseSlicer):
                 pass
             else:
                 return max(matches)
-        return self._parse_max_float(r"G1\sZ\d+\.\d*\sF", self.footer_data)
+        heights = self.footer.get_z_heights(r"\sF")
+        return max(heights) if heights else None
 
     def parse_filament_total(self) -> Optional[float]:
-        return _regex_find_first(
-            r"filament\sused\s\[mm\]\s=\s(\d+\.\d*)", self.footer_data)
+        return self.footer.get_float("filament used [mm]", strict=True)
 
     def parse_filament_weight_total(self) -> Optional[float]:
-        return _regex_find_first(
-            r"total\sfilament\sused\s\[g\]\s=\s(\d+\.\d*)", self.footer_data)
+        return self.footer.get_float(
+            "total filament used [g]", strict=True)
 
     def parse_filament_type(self) -> Optional[str]:
-        return _regex_find_string(
-            r";\sfilament_type\s=\s(.*)", self.footer_data)
+        return self.footer.get_string("filament_type")
 
     def parse_filament_name(self) -> Optional[str]:
-        return _regex_find_string(
-            r";\sfilament_settings_id\s=\s(.*)", self.footer_data)
+        return self.footer.get_string("filament_settings_id")
 
     def parse_estimated_time(self) -> Optional[float]:
-        time_match = re.search(
-            r';\sestimated\sprinting\stime.*', self.footer_data)
-        if not time_match:
+        entry = self.footer.get_prefix("estimated printing time")
+        if entry is None:
             return None
         total_time = 0
-        time_group = time_match.group()
+        time_group = entry[1]
         time_patterns = [(r"(\d+)d", 24*60*60), (r"(\d+)h", 60*60),
                          (r"(\d+)m", 60), (r"(\d+)s", 1)]
         try:
             for pattern, multiplier in time_patterns:
-                t = re.search(pattern, time_group)
+                t = _compile(pattern).search(time_group)
                 if t:
                     total_time += int(t.group(1)) * multiplier
         except Exception:
@@ -379,28 +484,23 @@ class PrusaSlicer(BaseSlicer):
         return round(total_time, 2)
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; first_layer_temperature = (\d+\.?\d*)", self.footer_data)
+        return self.footer.get_float("first_layer_temperature")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; first_layer_bed_temperature = (\d+\.?\d*)", self.footer_data)
+        return self.footer.get_float("first_layer_bed_temperature")
 
     def parse_chamber_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; chamber_temperature = (\d+\.?\d*)", self.footer_data)
+        return self.footer.get_float("chamber_temperature")
 
     def parse_nozzle_diameter(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\snozzle_diameter\s=\s(\d+\.\d*)", self.footer_data)
+        return self.footer.get_float("nozzle_diameter", strict=True)
 
     def parse_layer_count(self) -> Optional[int]:
-        return _regex_find_int(
-            r"; total layers count = (\d+)", self.footer_data)
+        return self.footer.get_int("total layers count")
 
 class Slic3rPE(PrusaSlicer):
     def check_identity(self, data: str) -> Optional[Dict[str, str]]:
-        match = re.search(r"Slic3r\sPrusa\sEdition\s(.*)\son", data)
+        match = _compile(r"Slic3r\sPrusa\sEdition\s(.*)\son").search(data)
         if match:
             return {
                 'slicer': "Slic3r PE",
@@ -410,12 +510,12 @@ class Slic3rPE(PrusaSlicer):
 
     def parse_filament_total(self) -> Optional[float]:
         return _regex_find_first(
-            r"filament\sused\s=\s(\d+\.\d+)mm", self.footer_data)
+            r"^(\d+\.\d+)mm", self.footer.get("filament used") or "")
 
 
 class Slic3r(Slic3rPE):
     def check_identity(self, data: str) -> Optional[Dict[str, str]]:
-        match = re.search(r"Slic3r\s(\d.*)\son", data)
+        match = _compile(r"Slic3r\s(\d.*)\son").search(data)
         if match:
             return {
                 'slicer': "Slic3r",
@@ -424,22 +524,20 @@ class Slic3r(Slic3rPE):
         return None
 
     def parse_filament_total(self) -> Optional[float]:
-        filament = _regex_find_first(
-            r";\sfilament\_length\_m\s=\s(\d+\.\d*)", self.footer_data)
+        filament = self.footer.get_float("filament_length_m", strict=True)
         if filament is not None:
             filament *= 1000
         return filament
 
     def parse_filament_weight_total(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sfilament\smass\_g\s=\s(\d+\.\d*)", self.footer_data)
+        return self.footer.get_float("filament mass_g", strict=True)
 
     def parse_estimated_time(self) -> Optional[float]:
         return None
 
 class Cura(BaseSlicer):
     def check_identity(self, data: str) -> Optional[Dict[str, str]]:
-        match = re.search(r"Cura_SteamEngine\s(.*)", data)
+        match = _compile(r"Cura_SteamEngine\s(.*)").search(data)
         if match:
             return {
                 'slicer': "Cura",
@@ -452,64 +550,56 @@ class Cura(BaseSlicer):
             self.header_data, r"\n;MESH:")
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return _regex_find_first(r";MINZ:(\d+\.?\d*)", self.header_data)
+        return self.header.get_float("MINZ")
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        self.layer_height = _regex_find_first(
-            r";Layer\sheight:\s(\d+\.?\d*)", self.header_data)
+        self.layer_height = self.header.get_float("Layer height")
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
-        return _regex_find_first(r";MAXZ:(\d+\.?\d*)", self.header_data)
+        return self.header.get_float("MAXZ")
 
     def parse_filament_total(self) -> Optional[float]:
         filament = _regex_find_first(
-            r";Filament\sused:\s(\d+\.?\d*)m", self.header_data)
+            r"^(\d+\.?\d*)m", self.header.get("Filament used") or "")
         if filament is not None:
             filament *= 1000
         return filament
 
     def parse_filament_weight_total(self) -> Optional[float]:
         return _regex_find_first(
-            r";Filament\sweight\s=\s.(\d+\.\d+).", self.header_data)
+            r"^.(\d+\.\d+).", self.header.get("Filament weight") or "")
 
     def parse_filament_type(self) -> Optional[str]:
-        return _regex_find_string(
-            r";Filament\stype\s=\s(.*)", self.header_data)
+        return self.header.get_string("Filament type")
 
     def parse_filament_name(self) -> Optional[str]:
-        return _regex_find_string(
-            r";Filament\sname\s=\s(.*)", self.header_data)
+        return self.header.get_string("Filament name")
 
     def parse_estimated_time(self) -> Optional[float]:
-        return self._parse_max_float(r";TIME:.*", self.header_data)
+        return self.header.get_max_float("TIME")
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M109 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M109")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M190 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M190")
 
     def parse_chamber_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M191 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M191")
 
     def parse_layer_count(self) -> Optional[int]:
-        return _regex_find_int(
-            r";LAYER_COUNT\:(\d+)", self.header_data)
+        return self.header.get_int("LAYER_COUNT")
 
     def parse_nozzle_diameter(self) -> Optional[float]:
-        return _regex_find_first(
-            r";Nozzle\sdiameter\s=\s(\d+\.\d*)", self.header_data)
+        return self.header.get_float("Nozzle diameter", strict=True)
 
 class Simplify3D(BaseSlicer):
     def check_identity(self, data: str) -> Optional[Dict[str, str]]:
-        match = re.search(r"Simplify3D\(R\)\sVersion\s(.*)", data)
+        match = _compile(r"Simplify3D\(R\)\sVersion\s(.*)").search(data)
         if match:
             self._version = match.group(1)
             self._is_v5 = self._version.startswith("5")
@@ -520,66 +610,63 @@ class Simplify3D(BaseSlicer):
         return None
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return self._parse_min_float(r"G1\sZ\d+\.\d*", self.header_data)
+        heights = self.header.get_z_heights()
+        return min(heights) if heights else None
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        self.layer_height = _regex_find_first(
-            r";\s+layerHeight,(\d+\.?\d*)", self.header_data)
+        self.layer_height = self.header.get_float("layerHeight")
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
-        return self._parse_max_float(r"G1\sZ\d+\.\d*", self.footer_data)
+        heights = self.footer.get_z_heights()
+        return max(heights) if heights else None
 
     def parse_filament_total(self) -> Optional[float]:
         return _regex_find_first(
-            r";\s+(?:Filament\slength|Material\sLength):\s(\d+\.?\d*)\smm",
-            self.footer_data
+            r"^(\d+\.?\d*)\smm",
+            self.footer.get("Filament length", "Material Length") or ""
         )
 
     def parse_filament_weight_total(self) -> Optional[float]:
         return _regex_find_first(
-            r";\s+(?:Plastic\sweight|Material\sWeight):\s(\d+\.?\d*)\sg",
-            self.footer_data
+            r"^(\d+\.?\d*)\sg",
+            self.footer.get("Plastic weight", "Material Weight") or ""
         )
 
     def parse_filament_name(self) -> Optional[str]:
-        return _regex_find_string(
-            r";\s+printMaterial,(.*)", self.header_data)
+        return self.header.get_string("printMaterial")
 
     def parse_filament_type(self) -> Optional[str]:
-        return _regex_find_string(
-            r";\s+makerBotModelMaterial,(.*)", self.footer_data)
+        return self.footer.get_string("makerBotModelMaterial")
 
     def parse_estimated_time(self) -> Optional[float]:
-        time_match = re.search(
-            r';\s+Build (t|T)ime:.*', self.footer_data)
-        if not time_match:
+        time_group = self.footer.get("Build time", "Build Time")
+        if time_group is None:
             return None
         total_time = 0
-        time_group = time_match.group()
         time_patterns = [(r"(\d+)\shours?", 60*60), (r"(\d+)\smin", 60),
                          (r"(\d+)\ssec", 1)]
         try:
             for pattern, multiplier in time_patterns:
-                t = re.search(pattern, time_group)
+                t = _compile(pattern).search(time_group)
                 if t:
                     total_time += int(t.group(1)) * multiplier
         except Exception:
             return None
         return round(total_time, 2)
 
-    def _get_temp_items(self, pattern: str) -> List[str]:
-        match = re.search(pattern, self.header_data)
-        if match is None:
+    def _get_temp_items(self, key: str) -> List[str]:
+        value = self.header.get(key)
+        if value is None:
             return []
-        return match.group().split(",")[1:]
+        return value.split(",")
 
     def _get_first_layer_temp(self, heater: str) -> Optional[float]:
-        heaters = self._get_temp_items(r"temperatureName.*")
-        temps = self._get_temp_items(r"temperatureSetpointTemperatures.*")
+        heaters = self._get_temp_items("temperatureName")
+        temps = self._get_temp_items("temperatureSetpointTemperatures")
         for h, temp in zip(heaters, temps):
             if h == heater:
                 try:
@@ -594,7 +681,8 @@ class Simplify3D(BaseSlicer):
             r";\s+temperatureType,"f"{heater_type}"r".+?"
             r";\s+temperatureSetpoints,\d+\|(\d+)"
         )
-        match = re.search(pattern, self.header_data, re.MULTILINE | re.DOTALL)
+        match = _compile(pattern, re.MULTILINE | re.DOTALL).search(
+            self.header_data)
         if match is not None:
             try:
                 return float(match.group(1))
@@ -615,17 +703,15 @@ class Simplify3D(BaseSlicer):
             return self._get_first_layer_temp("Heated Bed")
 
     def parse_nozzle_diameter(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\s+(?:extruderDiameter|nozzleDiameter),(\d+\.\d*)",
-            self.header_data
-        )
+        return self.header.get_float(
+            "extruderDiameter", "nozzleDiameter", strict=True)
 
 class KISSlicer(BaseSlicer):
     def check_identity(self, data: str) -> Optional[Dict[str, Any]]:
-        match = re.search(r";\sKISSlicer", data)
+        match = _compile(r";\sKISSlicer").search(data)
         if match:
             ident = {'slicer': "KISSlicer"}
-            vmatch = re.search(r";\sversion\s(.*)", data)
+            vmatch = _compile(r";\sversion\s(.*)").search(data)
             if vmatch:
                 version = vmatch.group(1).replace(" ", "-")
                 ident['slicer_version'] = version
@@ -633,15 +719,13 @@ class KISSlicer(BaseSlicer):
         return None
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\s+first_layer_thickness_mm\s=\s(\d+\.?\d*)", self.header_data)
+        return self.header.get_float("first_layer_thickness_mm")
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        self.layer_height = _regex_find_first(
-            r";\s+max_layer_thickness_mm\s=\s(\d+\.?\d*)", self.header_data)
+        self.layer_height = self.header.get_float("max_layer_thickness_mm")
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
@@ -665,21 +749,18 @@ class KISSlicer(BaseSlicer):
         return None
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; first_layer_C = (\d+\.?\d*)", self.header_data)
+        return self.header.get_float("first_layer_C")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; bed_C = (\d+\.?\d*)", self.header_data)
+        return self.header.get_float("bed_C")
 
     def parse_chamber_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; chamber_C = (\d+\.?\d*)", self.header_data)
+        return self.header.get_float("chamber_C")
 
 
 class IdeaMaker(BaseSlicer):
     def check_identity(self, data: str) -> Optional[Dict[str, str]]:
-        match = re.search(r"\sideaMaker\s(.*),", data)
+        match = _compile(r"\sideaMaker\s(.*),").search(data)
         if match:
             return {
                 'slicer': "IdeaMaker",
@@ -710,10 +791,9 @@ class IdeaMaker(BaseSlicer):
         return None
 
     def parse_object_height(self) -> Optional[float]:
-        bounds = _regex_find_floats(
-            r";Bounding Box:.*", self.header_data)
+        bounds = FLOAT_RE.findall(self.header.get("Bounding Box") or "")
         if len(bounds) >= 6:
-            return bounds[5]
+            return float(bounds[5])
         return None
 
     def parse_filament_total(self) -> Optional[float]:
@@ -724,12 +804,10 @@ class IdeaMaker(BaseSlicer):
         return None
 
     def parse_filament_type(self) -> Optional[str]:
-        return _regex_find_string(
-            r";Filament\stype\s=\s(.*)", self.header_data)
+        return self.header.get_string("Filament type")
 
     def parse_filament_name(self) -> Optional[str]:
-        return _regex_find_string(
-            r";Filament\sname\s=\s(.*)", self.header_data)
+        return self.header.get_string("Filament name")
 
     def parse_filament_weight_total(self) -> Optional[float]:
         pi = 3.141592653589793
@@ -747,20 +825,16 @@ class IdeaMaker(BaseSlicer):
         return None
 
     def parse_estimated_time(self) -> Optional[float]:
-        return _regex_find_first(
-            r";Print\sTime:\s(\d+\.?\d*)", self.footer_data)
+        return self.footer.get_float("Print Time")
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M109 T0 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M109 T0")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M190 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M190")
 
     def parse_chamber_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"M191 S(\d+\.?\d*)", self.header_data)
+        return self.header.commands.get("M191")
 
     def parse_nozzle_diameter(self) -> Optional[float]:
         return _regex_find_first(
@@ -768,7 +842,7 @@ class IdeaMaker(BaseSlicer):
 
 class IceSL(BaseSlicer):
     def check_identity(self, data) -> Optional[Dict[str, Any]]:
-        match = re.search(r"<IceSL\s(.*)>", data)
+        match = _compile(r"<IceSL\s(.*)>").search(data)
         if match:
             version = match.group(1) if match.group(1)[0].isdigit() else "-"
             return {
@@ -778,62 +852,49 @@ class IceSL(BaseSlicer):
         return None
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sz_layer_height_first_layer_mm\s:\s+(\d+\.\d+)",
-            self.header_data)
+        return self.header.get_float(
+            "z_layer_height_first_layer_mm", strict=True)
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        self.layer_height = _regex_find_first(
-            r";\sz_layer_height_mm\s:\s+(\d+\.\d+)",
-            self.header_data)
+        self.layer_height = self.header.get_float(
+            "z_layer_height_mm", strict=True)
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sprint_height_mm\s:\s+(\d+\.\d+)", self.header_data)
+        return self.header.get_float("print_height_mm", strict=True)
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sextruder_temp_degree_c_0\s:\s+(\d+\.?\d*)", self.header_data)
+        return self.header.get_float("extruder_temp_degree_c_0")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sbed_temp_degree_c\s:\s+(\d+\.?\d*)", self.header_data)
+        return self.header.get_float("bed_temp_degree_c")
 
     def parse_chamber_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\schamber_temp_degree_c\s:\s+(\d+\.?\d*)", self.header_data)
+        return self.header.get_float("chamber_temp_degree_c")
 
     def parse_filament_total(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sfilament_used_mm\s:\s+(\d+\.\d+)", self.header_data)
+        return self.header.get_float("filament_used_mm", strict=True)
 
     def parse_filament_weight_total(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sfilament_used_g\s:\s+(\d+\.\d+)", self.header_data)
+        return self.header.get_float("filament_used_g", strict=True)
 
     def parse_filament_name(self) -> Optional[str]:
-        return _regex_find_string(
-            r";\sfilament_name\s:\s+(.*)", self.header_data)
+        return self.header.get_string("filament_name")
 
     def parse_filament_type(self) -> Optional[str]:
-        return _regex_find_string(
-            r";\sfilament_type\s:\s+(.*)", self.header_data)
+        return self.header.get_string("filament_type")
 
     def parse_estimated_time(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\sestimated_print_time_s\s:\s+(\d*\.*\d*)", self.header_data)
+        return self.header.get_float("estimated_print_time_s")
 
     def parse_layer_count(self) -> Optional[int]:
-        return _regex_find_int(
-            r";\slayer_count\s:\s+(\d+)", self.header_data)
+        return self.header.get_int("layer_count")
 
     def parse_nozzle_diameter(self) -> Optional[float]:
-        return _regex_find_first(
-            r";\snozzle_diameter_mm_0\s:\s+(\d+\.\d+)", self.header_data)
+        return self.header.get_float("nozzle_diameter_mm_0", strict=True)
 
 class KiriMoto(BaseSlicer):
     def check_identity(self, data) -> Optional[Dict[str, Any]]:
@@ -842,7 +903,7 @@ class KiriMoto(BaseSlicer):
             "SimplyPrint": r"; Generated by Kiri:Moto \(SimplyPrint\) (.+)"
         }
         for name, pattern in variants.items():
-            match = re.search(pattern, data)
+            match = _compile(pattern).search(data)
             if match:
                 return {
                     "slicer": name,
@@ -851,29 +912,23 @@ class KiriMoto(BaseSlicer):
         return None
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; firstSliceHeight = (\d+\.\d+)", self.header_data
-        )
+        return self.header.get_float("firstSliceHeight", strict=True)
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        self.layer_height = _regex_find_first(
-            r"; sliceHeight = (\d+\.\d+)", self.header_data
-        )
+        self.layer_height = self.header.get_float("sliceHeight", strict=True)
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
-        return self._parse_max_float(
-            r"G1 Z\d+\.\d+ (?:; z-hop end|F\d+\n)",
-            self.footer_data, strict=True
-        )
+        heights = self.footer.get_z_heights(r" (?:; z-hop end|F\d+$)")
+        return max(heights) if heights else None
 
     def parse_layer_count(self) -> Optional[int]:
-        matches = re.findall(
-            r";; --- layer (\d+) \(.+", self.footer_data
-        )
+        matches = _compile(
+            r";; --- layer (\d+) \(.+"
+        ).findall(self.footer_data)
         if not matches:
             return None
         try:
@@ -890,14 +945,10 @@ class KiriMoto(BaseSlicer):
         )
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; firstLayerNozzleTemp = (\d+\.?\d*)", self.header_data
-        )
+        return self.header.get_float("firstLayerNozzleTemp")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r"; firstLayerBedTemp = (\d+\.?\d*)", self.header_data
-        )
+        return self.header.get_float("firstLayerBedTemp")
 
 class Creality(BaseSlicer):
     def check_identity(self, data: str) -> Optional[Dict[str, str]]:
@@ -906,10 +957,10 @@ class Creality(BaseSlicer):
             'Creality': r"Creality"
         }
         pattern = r'Version : V([\d\.]+)'
-        match_version = re.search(pattern, data)
+        match_version = _compile(pattern).search(data)
         slicer_version = match_version.group(1) if match_version else "1.0"
         for name, expr in aliases.items():
-            match = re.search(expr, data)
+            match = _compile(expr).search(data)
             # ;Creality Print Version : V4.3.7.6456
             if match:
                 return {
@@ -919,68 +970,62 @@ class Creality(BaseSlicer):
         return None
 
     def parse_first_layer_height(self) -> Optional[float]:
-        return _regex_find_first(
-            r";MINZ:(\d+\.?\d*)", self.footer_data)
+        # ";MINZ:0.2" is the first layer height, while the "; MINZ = 0.00"
+        # of some Creality Print versions is the bottom of the model
+        first_layer_height = self.footer.get_float("MINZ")
+        if not first_layer_height:
+            return None
+        return first_layer_height
 
     def parse_model_info(self):
         return get_print_file_metadata(self.path)
 
     def parse_layer_height(self) -> Optional[float]:
-        pattern = r";Layer\sheight:\s(\d+\.?\d*)"
-        self.layer_height = _regex_find_first(
-            pattern, self.footer_data)
+        # Also matches ";Layer height:0.25" (without a space after the
+        # colon) as written by Creality Print
+        self.layer_height = self.footer.get_float("Layer height")
         return self.layer_height
 
     def parse_object_height(self) -> Optional[float]:
-        matches = re.findall(
-            r";MAXZ:(\d+\.?\d*)", self.footer_data)
-        if matches:
-            try:
-                matches = [float(m) for m in matches]
-            except Exception:
-                pass
-            else:
-                return max(matches)
-        return self._parse_max_float(r"G1\sZ\d+\.\d*\sF", self.footer_data)
+        object_height = self.footer.get_max_float("MAXZ")
+        if object_height is not None:
+            return object_height
+        heights = self.footer.get_z_heights(r"\sF")
+        return max(heights) if heights else None
 
     def parse_layer_count(self) -> Optional[int]:
-        return _regex_find_int(
-            r";LAYER_COUNT\:(\d+)", self.header_data)
+        return self.header.get_int("LAYER_COUNT")
 
     def parse_filament_type(self) -> Optional[str]:
         return _regex_find_string(
-            r";Material Type:(\S+)", self.header_data)
+            r"^(\S+)", self.header.get("Material Type") or "")
 
     def parse_filament_name(self) -> Optional[str]:
-        return _regex_find_string(
-            r";Material Name:(.+)", self.header_data)
+        return self.header.get_string("Material Name") or None
 
     def parse_filament_total(self) -> Optional[float]:
         filament_total = _regex_find_first(
-            r";Filament used:(\d+\.?\d*)m", self.footer_data)
-        filament_total = filament_total * 1000
+            r"^(\d+\.?\d*)m", self.footer.get("Filament used") or "")
+        if filament_total is not None:
+            filament_total *= 1000
         return filament_total
 
     def parse_filament_weight_total(self) -> Optional[float]:
-        filament_total = _regex_find_first(
-            r";Filament Weight:(\d+\.?\d*)", self.footer_data)
-        filament_weight_total = filament_total
-        return filament_weight_total
+        return self.footer.get_float("Filament Weight")
 
     def parse_estimated_time(self) -> Optional[float]:
-        total_time = _regex_find_first(
-            r";TIME:(\d+)", self.footer_data)
-        return total_time
+        total_time = self.footer.get_int("TIME")
+        if total_time is not None:
+            return float(total_time)
+        return None
 
     def parse_first_layer_extr_temp(self) -> Optional[float]:
         # return _regex_find_first(
         #     r"; first_layer_temperature = (\d+\.?\d*)", self.footer_data)
-        return _regex_find_first(
-            r";Print Temperature:(\d+\.?\d*)", self.footer_data)
+        return self.footer.get_float("Print Temperature")
 
     def parse_first_layer_bed_temp(self) -> Optional[float]:
-        return _regex_find_first(
-            r";Bed Temperature:(\d+\.?\d*)", self.footer_data)
+        return self.footer.get_float("Bed Temperature")
 
 
 READ_SIZE = 512 * 1024
@@ -1142,6 +1187,16 @@ def extract_ufp(ufp_path: str, dest_path: str) -> None:
     except Exception:
         log_to_stderr(f"Error removing ufp file: {ufp_path}")
 
+def get_file_metadata(file_path: str,
+                      check_objects: bool = False
+                      ) -> Dict[str, Any]:
+    # In-process entry point, returns the same structure that the
+    # command line utility writes to stdout
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"File Not Found: {file_path}")
+    metadata = extract_metadata(file_path, check_objects)
+    return {'file': os.path.basename(file_path), 'metadata': metadata}
+
 def main(path: str,
          filename: str,
          ufp: Optional[str],
@@ -1150,18 +1205,18 @@ def main(path: str,
     file_path = os.path.join(path, filename)
     if ufp is not None:
         extract_ufp(ufp, file_path)
-    metadata: Dict[str, Any] = {}
+    result: Dict[str, Any] = {}
     if not os.path.isfile(file_path):
         log_to_stderr(f"File Not Found: {file_path}")
         sys.exit(-1)
     try:
-        metadata = extract_metadata(file_path, check_objects)
+        result = get_file_metadata(file_path, check_objects)
     except Exception:
         log_to_stderr(traceback.format_exc())
         sys.exit(-1)
+    result['file'] = filename
     fd = sys.stdout.fileno()
-    data = json.dumps(
-        {'file': filename, 'metadata': metadata}).encode()
+    data = json.dumps(result).encode()
     while data:
         try:
             ret = os.write(fd, data)
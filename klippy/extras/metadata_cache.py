@@ -0,0 +1,235 @@
+# Persistent slicer metadata cache for the virtual sdcard
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, re, logging, threading, queue, json, math, hashlib
+from . import gcode_index
+
+CACHE_VERSION = 1
+VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
+# Only files with these names are removed from index_dir
+INDEX_FILE_R = re.compile(r'^[0-9a-f]{32}\.json(\.tmp)?$')
+
+# Metadata for each gcode file is extracted in-process (see metadata.py)
+# and stored keyed by (path, size, mtime).  A background thread
+# periodically scans the gcode directory (except while printing) so that
+# newly uploaded files are already parsed by the time a print is started.  The same thread
+# also writes a layer/position index (see gcode_index.py) for each file
+# to a sidecar file in index_dir.
+class MetadataCache:
+    def __init__(self, printer, gcode_dir, cache_path, index_dir,
+                 scan_time=10.):
+        self.printer = printer
+        self.gcode_dir = gcode_dir
+        self.cache_path = cache_path
+        self.index_dir = index_dir
+        self.scan_time = scan_time
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.indexes = {}
+        self.is_dirty = False
+        self.extract_func = None
+        self.print_stats = None
+        self._load()
+        # Background thread
+        self.bg_queue = queue.Queue()
+        self.bg_thread = None
+        printer.register_event_handler("klippy:ready", self._handle_ready)
+        printer.register_event_handler("klippy:disconnect",
+                                       self._handle_disconnect)
+    def _handle_ready(self):
+        self.print_stats = self.printer.lookup_object('print_stats', None)
+        if self.bg_thread is not None:
+            return
+        self.bg_thread = threading.Thread(target=self._bg_thread)
+        self.bg_thread.daemon = True
+        self.bg_thread.start()
+    def _handle_disconnect(self):
+        if self.bg_thread is None:
+            return
+        self.bg_queue.put_nowait(None)
+        self.bg_thread.join()
+        self.bg_thread = None
+    # Persistent storage
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.loads(f.read())
+            if data.get("version") != CACHE_VERSION:
+                return
+            for path, (size, mtime, result) in data["files"].items():
+                self.entries[path] = (size, mtime, result)
+        except Exception:
+            logging.exception("metadata_cache load")
+            self.entries = {}
+    def _save(self):
+        with self.lock:
+            if not self.is_dirty:
+                return
+            self.is_dirty = False
+            data = {"version": CACHE_VERSION,
+                    "files": {path: list(entry)
+                              for path, entry in self.entries.items()}}
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.cache_path)
+        except Exception:
+            logging.exception("metadata_cache save")
+    # Metadata extraction
+    def _extract(self, file_path):
+        if self.extract_func is None:
+            # Deferred so that the slicer parsers are only loaded on use
+            from . import metadata
+            self.extract_func = metadata.get_file_metadata
+        return self.extract_func(file_path)
+    def _update(self, file_path, size, mtime):
+        try:
+            result = self._extract(file_path)
+        except Exception:
+            logging.exception("metadata_cache extract %s", file_path)
+            result = {}
+        with self.lock:
+            self.entries[file_path] = (size, mtime, result)
+            self.is_dirty = True
+        return result
+    def _scan(self):
+        found = {}
+        for root, dirs, files in os.walk(self.gcode_dir, followlinks=True):
+            for name in files:
+                ext = name[name.rfind('.')+1:]
+                if ext not in VALID_GCODE_EXTS:
+                    continue
+                full_path = os.path.join(root, name)
+                try:
+                    st = os.stat(full_path)
+                except os.error:
+                    continue
+                found[full_path] = (st.st_size, st.st_mtime)
+        with self.lock:
+            stale = [path for path in self.entries if path not in found]
+            for path in stale:
+                del self.entries[path]
+                self.is_dirty = True
+            missing = [(path, size, mtime)
+                       for path, (size, mtime) in found.items()
+                       if self.entries.get(path, (None, None))[:2]
+                       != (size, mtime)]
+        for path, size, mtime in missing:
+            self._update(path, size, mtime)
+        self._update_indexes(found)
+    # Layer/position index sidecar files
+    def _get_index_path(self, file_path, size, mtime):
+        # Sidecars of an older index format get a different name, so
+        # they are replaced rather than reused
+        key = "%s:%d:%s:%d" % (file_path, size, mtime,
+                               gcode_index.INDEX_VERSION)
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return os.path.join(self.index_dir, digest + ".json")
+    def _update_indexes(self, found):
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir)
+        expected = {}
+        for path, (size, mtime) in found.items():
+            expected[self._get_index_path(path, size, mtime)] = path
+        for fname in os.listdir(self.index_dir):
+            index_path = os.path.join(self.index_dir, fname)
+            if index_path not in expected and INDEX_FILE_R.match(fname):
+                os.remove(index_path)
+        for index_path, path in expected.items():
+            if os.path.exists(index_path):
+                continue
+            if self.is_printing():
+                # Reading a whole file competes with the print for the
+                # cpu - the remaining files are indexed after the print
+                break
+            try:
+                gcode_index.build_index(path).save(index_path)
+            except Exception:
+                logging.exception("metadata_cache index %s", path)
+    def _bg_thread(self):
+        while 1:
+            # No periodic scans while printing - virtual_sdcard requests
+            # a scan when the print stops
+            timeout = self.scan_time
+            if self.is_printing():
+                timeout = None
+            try:
+                msg = self.bg_queue.get(True, timeout)
+            except queue.Empty:
+                msg = "scan"
+            if msg is None:
+                break
+            if self.is_printing():
+                continue
+            try:
+                self._scan()
+            except Exception:
+                logging.exception("metadata_cache scan")
+            self._save()
+    # External interface
+    def is_printing(self):
+        # Called from the background thread
+        print_stats = self.print_stats
+        return print_stats is not None and print_stats.state == "printing"
+    def request_scan(self):
+        self.bg_queue.put_nowait("scan")
+    def get_metadata(self, file_path):
+        # Returns the same dictionary as "metadata.py -f <file>" would
+        file_path = os.path.normpath(file_path)
+        try:
+            st = os.stat(file_path)
+        except os.error:
+            return {}
+        with self.lock:
+            entry = self.entries.get(file_path)
+        if entry is not None and entry[:2] == (st.st_size, st.st_mtime):
+            return entry[2]
+        # Not yet parsed by the background thread - parse it now
+        result = self._update(file_path, st.st_size, st.st_mtime)
+        self.request_scan()
+        return result
+    def get_layer_count(self, file_path):
+        metadata = self.get_metadata(file_path).get("metadata", {})
+        layer_count = calc_layer_count(metadata)
+        if not layer_count:
+            index = self.get_index(file_path)
+            if index is not None:
+                layer_count = index.get_layer_count()
+        return layer_count
+    def get_index(self, file_path):
+        # Returns the GCodeIndex for the file, or None if the background
+        # thread has not indexed the current version of the file yet
+        file_path = os.path.normpath(file_path)
+        try:
+            st = os.stat(file_path)
+        except os.error:
+            return None
+        index = self.indexes.get(file_path)
+        if (index is not None and index.size == st.st_size
+            and index.mtime == st.st_mtime):
+            return index
+        index_path = self._get_index_path(file_path, st.st_size, st.st_mtime)
+        if not os.path.exists(index_path):
+            self.request_scan()
+            return None
+        index = gcode_index.load_index(index_path)
+        if index is not None:
+            self.indexes[file_path] = index
+        return index
+
+def calc_layer_count(metadata):
+    layer_count = metadata.get("layer_count", 0)
+    if layer_count:
+        return layer_count
+    first_layer_height = metadata.get("first_layer_height", 0)
+    object_height = metadata.get("object_height", 0)
+    layer_height = metadata.get("layer_height", 0)
+    if object_height > 0 and layer_height > 0:
+        return math.ceil((object_height - first_layer_height)
+                         / layer_height + 1)
+    return 0
@@ -10,6 +10,7 @@ class PauseResume:
     def __init__(self, config):
         self.printer = config.get_printer()
         self.gcode = self.printer.lookup_object('gcode')
+        self.state_journal = self.printer.lookup_object('state_journal')
         self.recover_velocity = config.getfloat('recover_velocity', 50.)
         self.v_sd = None
         self.is_paused = False
@@ -70,15 +71,14 @@ class PauseResume:
     def _check_power_loss_state_request(self, web_request): 
         from subprocess import call
         response = {"file_state": False, "eeprom_state": False}
-        if os.path.exists(self.v_sd.print_file_name_path):
+        if self.state_journal.exists(self.v_sd.print_file_name_path):
             try:
-                with open(self.v_sd.print_file_name_path, "r") as f:
-                    data = f.read()
-                    if len(data) == 0:
-                        logging.error("%s f.read()==None read fail!!!" % self.v_sd.print_file_name_path)
-                    response["file_state"] = True if json.loads(data) else False
+                data = self.state_journal.load(self.v_sd.print_file_name_path)
+                if data is None:
+                    logging.error("%s f.read()==None read fail!!!" % self.v_sd.print_file_name_path)
+                response["file_state"] = True if data else False
             except Exception as err:
-                os.remove(self.v_sd.print_file_name_path)
+                self.state_journal.remove(self.v_sd.print_file_name_path)
                 bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects else None
                 if bl24c16f:
                     self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
@@ -99,17 +99,15 @@ class PauseResume:
             response["file_state"] = False
             response["eeprom_state"] = False
             logging.info("current printer state:%s" % print_stats.state)
-        if os.path.exists(self.gcode.exclude_object_info) and (response["file_state"]==False or response["eeprom_state"]==False):
-            os.remove(self.gcode.exclude_object_info)
+        if response["file_state"]==False or response["eeprom_state"]==False:
+            self.state_journal.remove(self.gcode.exclude_object_info)
         web_request.send(response)
         return response
     
     def _handle_cancel_continue_print_request(self, web_request):
         from subprocess import call
-        if os.path.exists(self.v_sd.print_file_name_path):
-            os.remove(self.v_sd.print_file_name_path)
-        if os.path.exists(self.gcode.exclude_object_info):
-            os.remove(self.gcode.exclude_object_info)
+        self.state_journal.remove(self.v_sd.print_file_name_path)
+        self.state_journal.remove(self.gcode.exclude_object_info)
         call("sync", shell=True)
         bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects else None
         power_loss_switch = False
@@ -179,13 +177,10 @@ class PauseResume:
         self.send_resume_command()
         self.is_paused = False
         result = {}
-        if os.path.exists(self.v_sd.print_file_name_path):
-            with open(self.v_sd.print_file_name_path, "r") as f:
-                result = (json.loads(f.read()))
-                result["variable_z_safe_pause"] = 0
-            with open(self.v_sd.print_file_name_path, "w") as f:
-                f.write(json.dumps(result))
-                f.flush()
+        result = self.state_journal.load(self.v_sd.print_file_name_path)
+        if result is not None:
+            result["variable_z_safe_pause"] = 0
+            self.state_journal.update(self.v_sd.print_file_name_path, result)
         reportInformation("key602")
     cmd_CLEAR_PAUSE_help = (
         "Clears the current paused state without resuming the print")
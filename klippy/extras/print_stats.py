@@ -12,6 +12,7 @@ class PrintStats:
         self.reset()
         # Register commands
         self.gcode = printer.lookup_object('gcode')
+        self.state_journal = printer.lookup_object('state_journal')
         self.gcode.register_command(
             "SET_PRINT_STATS_INFO", self.cmd_SET_PRINT_STATS_INFO,
             desc=self.cmd_SET_PRINT_STATS_INFO_help)
@@ -50,11 +51,10 @@ class PrintStats:
         # Reset last e-position
         gc_status = self.gcode_move.get_status(curtime)
         ret = {}
-        if info_path and os.path.exists(info_path):
+        if info_path and self.state_journal.exists(info_path):
             try:
-                with open(info_path, "r") as f:
-                    ret = json.loads(f.read())
-                    self.filament_used = ret.get("filament_used", 0)
+                ret = self.state_journal.load(info_path, {})
+                self.filament_used = ret.get("filament_used", 0)
             except Exception as err:
                 pass
         if self.print_start_time is None:
@@ -297,18 +297,15 @@ class PrinterProbe:
     cmd_Z_OFFSET_APPLY_PROBE_help = "Adjust the probe's z_offset"
 
     def record_gcode_offset_when_printing(self):
-        import os, json
         try:
             configfile = self.printer.lookup_object('configfile')
             print_stats = self.printer.load_object(configfile, 'print_stats')
             v_sd = self.printer.lookup_object('virtual_sdcard')
-            if print_stats and print_stats.state == "printing" and os.path.exists(v_sd.print_file_name_path) and self.z_offset_change_flag:
-                with open(v_sd.print_file_name_path, "r") as f:
-                    result = (json.loads(f.read()))
-                    result["SET_GCODE_OFFSET"] = -(self.z_offset_calibrate)
-                with open(v_sd.print_file_name_path, "w") as f:
-                    f.write(json.dumps(result))
-                    f.flush()
+            state_journal = self.printer.lookup_object('state_journal')
+            if print_stats and print_stats.state == "printing" and state_journal.exists(v_sd.print_file_name_path) and self.z_offset_change_flag:
+                result = state_journal.load(v_sd.print_file_name_path, {})
+                result["SET_GCODE_OFFSET"] = -(self.z_offset_calibrate)
+                state_journal.update(v_sd.print_file_name_path, result)
         except Exception as err:
             logging.error("record_gcode_offset_when_printing error: %s" % err)
 
@@ -625,15 +625,17 @@ class PRTouchEndstopWrapper:
         self.obj.hx711s.delay_s(0.015)
         self.pnt_msg('*********************************************************')
         self.pnt_msg('PROBE_BY_STEP x=%.2f y=%.2f z=%.2f speed_mm=%.2f step_us=%d step_cnt=%d' % (rdy_pos[0], rdy_pos[1], rdy_pos[2], speed_mm, step_us, step_cnt))
+        unfit_stream = self.obj.filter.get_offset_stream(self.obj.hx711s.s_count, self.obj.filter.lft_k1_oft, self.cfg.pi_count)
+        fit_stream = self.obj.filter.get_filter_stream(self.obj.hx711s.s_count, self.obj.filter.hft_hz, self.obj.filter.lft_k1, self.cfg.pi_count)
         while self.ck_sys_sta():
             self.obj.hx711s.send_heart_beat()
             self.obj.dirzctl.send_heart_beat()
-            all_valss = self.obj.hx711s.get_vals()
-            if all_valss is None or len(all_valss[0]) == 0:
+            count, all_valss = self.obj.hx711s.get_count_vals()
+            if len(all_valss[0]) == 0:
                 self.obj.hx711s.delay_s(0.005)
                 continue
-            unfit_vals, tmp_unfit_vals = self.obj.filter.cal_offset_by_vals(self.obj.hx711s.s_count, all_valss, self.obj.filter.lft_k1_oft, self.cfg.pi_count)
-            fit_vals, tmp_fit_vals = self.obj.filter.cal_filter_by_vals(self.obj.hx711s.s_count, all_valss, self.obj.filter.hft_hz, self.obj.filter.lft_k1, self.cfg.pi_count)
+            unfit_vals, tmp_unfit_vals = unfit_stream.update(count, all_valss)
+            fit_vals, tmp_fit_vals = fit_stream.update(count, all_valss)
             
             for i in range(self.obj.hx711s.s_count):
                 if not self._check_trigger(i, tmp_fit_vals[i], tmp_unfit_vals[i], min_hold, max_hold):
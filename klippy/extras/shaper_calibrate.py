@@ -3,9 +3,8 @@
 # Copyright (C) 2020  Dmitry Butyugin <dmbutyugin@google.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import collections, importlib, logging, math, multiprocessing, traceback, os
+import collections, importlib, logging, math, traceback, os
 import time, subprocess, shlex
-from multiprocessing import shared_memory
 shaper_defs = importlib.import_module('.shaper_defs', 'extras')
 
 MIN_FREQ = 5.
@@ -106,7 +105,8 @@ class ShaperCalibrate:
     def background_process_exec(self, method, args):
         if self.printer is None:
             return method(*args)
-        import queuelogger
+        # Deferred so that multiprocessing is only loaded on use
+        import queuelogger, multiprocessing
         parent_conn, child_conn = multiprocessing.Pipe()
         def wrapper():
             try:
@@ -227,6 +227,7 @@ class ShaperCalibrate:
         if self.printer is None:
             return None
 
+        import multiprocessing
         ctx = multiprocessing.get_context('spawn')
         parent_conn, child_conn = multiprocessing.Pipe()
 
@@ -256,6 +257,7 @@ class ShaperCalibrate:
 
     def read_results_from_shared_memory(self, name):
         gcode = self.printer.lookup_object("gcode")
+        from multiprocessing import shared_memory
         try:
             shm = shared_memory.SharedMemory(name)
         except:
@@ -0,0 +1,144 @@
+# Write-behind storage for the print state json files
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, logging, threading, queue, json, copy
+
+FLUSH_TIME = 2.
+MAX_PENDING_BYTES = 16 * 1024
+
+# The print state files (temperatures, excluded objects, current layer,
+# power loss resume info) are updated from the g-code hot path.  Their
+# contents are kept in memory and a background thread writes the latest
+# version of each modified file (atomically, with fsync) at most every
+# FLUSH_TIME seconds, or sooner when MAX_PENDING_BYTES are queued.
+class StateJournal:
+    def __init__(self, printer, flush_time=FLUSH_TIME,
+                 max_pending_bytes=MAX_PENDING_BYTES):
+        self.printer = printer
+        self.flush_time = flush_time
+        self.max_pending_bytes = max_pending_bytes
+        # path -> data (None if the file is known not to exist)
+        self.records = {}
+        # path -> json text waiting to be written
+        self.pending = {}
+        self.pending_bytes = 0
+        self.lock = threading.Lock()
+        # Held while a file is written or removed
+        self.io_lock = threading.Lock()
+        self.bg_queue = queue.Queue()
+        self.bg_thread = threading.Thread(target=self._bg_thread)
+        self.bg_thread.daemon = True
+        self.bg_thread.start()
+        printer.register_event_handler("klippy:shutdown",
+                                       self._handle_shutdown)
+        printer.register_event_handler("klippy:disconnect",
+                                       self._handle_disconnect)
+    def _handle_shutdown(self):
+        self.flush()
+    def _handle_disconnect(self):
+        if self.bg_thread is None:
+            return
+        self.bg_queue.put_nowait(None)
+        self.bg_thread.join()
+        self.bg_thread = None
+        self._flush_pending()
+    # Background writes
+    def _write(self, path, text):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+    def _flush_pending(self):
+        # io_lock is held from taking the pending updates until they are
+        # written, so a newer synchronous update can not be overwritten
+        with self.io_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = {}
+                self.pending_bytes = 0
+            for path, text in pending.items():
+                with self.lock:
+                    if self.records.get(path) is None:
+                        # Removed after the update was queued
+                        continue
+                try:
+                    self._write(path, text)
+                except Exception:
+                    logging.exception("state_journal write %s", path)
+    def _bg_thread(self):
+        while 1:
+            try:
+                msg = self.bg_queue.get(True, self.flush_time)
+            except queue.Empty:
+                msg = "flush"
+            if msg is None:
+                break
+            self._flush_pending()
+    # External interface
+    def exists(self, path):
+        with self.lock:
+            if path in self.records:
+                return self.records[path] is not None
+        return os.path.exists(path)
+    def load(self, path, default=None):
+        # Returns a copy of the current contents of the file.  Raises
+        # ValueError if the file on disk does not contain valid json.
+        with self.lock:
+            if path in self.records:
+                data = self.records[path]
+                if data is None:
+                    return default
+                return copy.deepcopy(data)
+        if not os.path.exists(path):
+            return default
+        with open(path, "r") as f:
+            text = f.read()
+        if not text:
+            return default
+        data = json.loads(text)
+        with self.lock:
+            self.records.setdefault(path, data)
+        return copy.deepcopy(data)
+    def update(self, path, data, sync=False):
+        # With sync the file is written before returning
+        text = json.dumps(data)
+        with self.lock:
+            self.records[path] = copy.deepcopy(data)
+            old_text = self.pending.get(path)
+            if old_text is not None:
+                self.pending_bytes -= len(old_text)
+            self.pending[path] = text
+            self.pending_bytes += len(text)
+            need_flush = self.pending_bytes >= self.max_pending_bytes
+        if sync:
+            with self.io_lock:
+                with self.lock:
+                    text = self.pending.pop(path, None)
+                    if text is not None:
+                        self.pending_bytes -= len(text)
+                if text is not None:
+                    try:
+                        self._write(path, text)
+                    except Exception:
+                        logging.exception("state_journal write %s", path)
+        elif need_flush:
+            self.flush()
+    def remove(self, path):
+        # Removal is done immediately so that stale resume information
+        # can not survive a power loss
+        with self.io_lock:
+            with self.lock:
+                self.records[path] = None
+                text = self.pending.pop(path, None)
+                if text is not None:
+                    self.pending_bytes -= len(text)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except os.error:
+                logging.exception("state_journal remove %s", path)
+    def flush(self):
+        if self.bg_thread is not None:
+            self.bg_queue.put_nowait("flush")
@@ -4,10 +4,12 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import os, time, logging
+from . import tool
 
 class PrinterSysStats:
     def __init__(self, config):
         printer = config.get_printer()
+        self.reactor = printer.get_reactor()
         self.last_process_time = self.total_process_time = 0.
         self.last_load_avg = 0.
         self.last_mem_avail = 0
@@ -43,11 +45,20 @@ class PrinterSysStats:
                         break
             except:
                 pass
+        # Cloud report pipe writer
+        reports = tool.get_report_stats()
+        if reports['queued']:
+            msg = ("%s reports=%d reports_written=%d reports_coalesced=%d"
+                   " reports_dropped=%d" % (
+                       msg, reports['queued'], reports['written'],
+                       reports['coalesced'], reports['dropped']))
         return (False, msg)
     def get_status(self, eventtime):
         return {'sysload': self.last_load_avg,
                 'cputime': self.total_process_time,
-                'memavail': self.last_mem_avail}
+                'memavail': self.last_mem_avail,
+                'reports': tool.get_report_stats(),
+                'reactor': self.reactor.get_latency_stats()}
 
 class PrinterStats:
     def __init__(self, config):
@@ -59,6 +70,7 @@ class PrinterStats:
     def handle_ready(self):
         self.stats_cb = [o.stats for n, o in self.printer.lookup_objects()
                          if hasattr(o, 'stats')]
+        self.stats_cb.append(self.printer.get_reactor().stats)
         if self.printer.get_start_args().get('debugoutput') is None:
             reactor = self.printer.get_reactor()
             reactor.update_timer(self.stats_timer, reactor.NOW)
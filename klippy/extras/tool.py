@@ -1,37 +1,97 @@
-import re, os, logging, threading
-from subprocess import call
-import json, random, time
+import re, os, logging, threading, collections
+import json, time
 
-def send(msg, data={}):
-    pipeFilePath = "/usr/data/creality/userdata/config/pipe.json"
-    try:
-        if not os.path.exists(pipeFilePath):
-            call("touch %s" % pipeFilePath, shell=True)
-            os.chmod(pipeFilePath, 0o700)
-        # net_state = call("ping -c 2 -w 2 api.crealitycloud.com > /dev/null 2>&1", shell=True)
-        # if net_state:
-        #     return
-        ret = re.findall('key(\d+)', msg)
-        if ret:
-            msg = "key%s" % ret[0]
-            if os.path.getsize(pipeFilePath) > 0:
-                random_float = random.uniform(0.1, 1)
-                time.sleep(random_float)
+PIPE_FILE_PATH = "/usr/data/creality/userdata/config/pipe.json"
+# Maximum number of distinct key codes waiting to be written
+MAX_PENDING_REPORTS = 16
+MIN_BACKOFF = 0.1
+MAX_BACKOFF = 2.
 
-            result = compress_key701(msg, data)
-            if result:
-                data = result
-            if os.path.getsize(pipeFilePath) == 0:
-                send_data = {"reqId": str(int(time.time()*1000)), "dn": "00000000000000", "code": msg, "data": data}
-                with open(pipeFilePath, "w") as f:
-                    f.write(json.dumps(send_data))
-                    f.flush()
-    except Exception as err:
-        logging.error("reportInformation err:%s" % err)
+# A single background thread writes the reports to the pipe file.  A
+# report is only written once the previous one has been consumed (the
+# file is empty).  Until then newer reports with the same key code
+# replace the waiting one, and the oldest report is dropped if more
+# than MAX_PENDING_REPORTS key codes are waiting.
+class Reporter:
+    def __init__(self, pipe_file_path=PIPE_FILE_PATH,
+                 max_pending=MAX_PENDING_REPORTS):
+        self.pipe_file_path = pipe_file_path
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        # key code -> data
+        self.pending = collections.OrderedDict()
+        self.counts = {'queued': 0, 'coalesced': 0, 'dropped': 0,
+                       'written': 0, 'errors': 0}
+        self.bg_thread = None
+    def report(self, msg, data):
+        ret = re.findall(r'key(\d+)', msg)
+        if not ret:
+            return
+        code = "key%s" % ret[0]
+        with self.lock:
+            self.counts['queued'] += 1
+            if code in self.pending:
+                self.counts['coalesced'] += 1
+            elif len(self.pending) >= self.max_pending:
+                self.pending.popitem(last=False)
+                self.counts['dropped'] += 1
+            self.pending[code] = data
+            if self.bg_thread is None:
+                self.bg_thread = threading.Thread(target=self._bg_thread)
+                self.bg_thread.daemon = True
+                self.bg_thread.start()
+            self.cond.notify()
+    def get_stats(self):
+        with self.lock:
+            return dict(self.counts)
+    def _is_busy(self):
+        try:
+            return os.path.getsize(self.pipe_file_path) > 0
+        except os.error:
+            return False
+    def _write(self, code, data):
+        result = compress_key701(code, data)
+        if result:
+            data = result
+        send_data = {"reqId": str(int(time.time()*1000)),
+                     "dn": "00000000000000", "code": code, "data": data}
+        tmp_path = self.pipe_file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(send_data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o700)
+        os.rename(tmp_path, self.pipe_file_path)
+    def _bg_thread(self):
+        while 1:
+            with self.lock:
+                while not self.pending:
+                    self.cond.wait()
+            # Wait (without dropping anything) for the reader
+            backoff = MIN_BACKOFF
+            while self._is_busy():
+                time.sleep(backoff)
+                backoff = min(backoff * 2., MAX_BACKOFF)
+            with self.lock:
+                code, data = self.pending.popitem(last=False)
+            try:
+                self._write(code, data)
+            except Exception as err:
+                logging.error("reportInformation err:%s" % err)
+                with self.lock:
+                    self.counts['errors'] += 1
+                continue
+            with self.lock:
+                self.counts['written'] += 1
+
+reporter = Reporter()
 
 def reportInformation(msg, data={}):
-    t = threading.Thread(target=send, args=(msg, data))
-    t.start()
+    reporter.report(msg, data)
+
+def get_report_stats():
+    return reporter.get_stats()
 
 def compress_key701(code, data):
     if code == "key701":
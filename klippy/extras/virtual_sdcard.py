@@ -3,11 +3,18 @@
 # Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, logging, io, json, time
+import os, logging, io, json, time, threading
 from .tool import reportInformation
+from . import metadata_cache, gcode_index
 
 VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
-LAYER_KEYS = [";LAYER:", "; layer:", "; LAYER:", ";AFTER_LAYER_CHANGE", ";LAYER_CHANGE"]
+DEFAULT_PRINT_SETTINGS = {
+    "delay_photography_switch": 1, "location": 0, "frame": 15, "interval": 1,
+    "power_loss_switch": False}
+# Used until the print start prefetch completes
+PENDING_PRINT_SETTINGS = dict(DEFAULT_PRINT_SETTINGS,
+                              delay_photography_switch=0)
+LAYER_KEYS = gcode_index.LAYER_KEYS
 
 class VirtualSD:
     def __init__(self, config):
@@ -17,6 +24,15 @@ class VirtualSD:
         # sdcard state
         sd = config.get('path')
         self.sdcard_dirname = os.path.normpath(os.path.expanduser(sd))
+        cache_path = config.get('metadata_cache_path', os.path.join(
+            self.sdcard_dirname, '.metadata_cache.json'))
+        index_path = config.get('index_path', os.path.join(
+            self.sdcard_dirname, '.index'))
+        self.metadata_cache = metadata_cache.MetadataCache(
+            self.printer, self.sdcard_dirname,
+            os.path.normpath(os.path.expanduser(cache_path)),
+            os.path.normpath(os.path.expanduser(index_path)))
+        self.file_index = None
         self.current_file = None
         self.file_position = self.file_size = 0
         # Print Stat Tracking
@@ -24,6 +40,8 @@ class VirtualSD:
         # Work timer
         self.reactor = self.printer.get_reactor()
         self.must_pause_work = self.cmd_from_sd = False
+        # Line of the file being run by work_handler
+        self.dispatch_line = None
         self.next_file_position = 0
         self.work_timer = None
         # Error handling
@@ -32,6 +50,8 @@ class VirtualSD:
             config, 'on_error_gcode', '')
         # Register commands
         self.gcode = self.printer.lookup_object('gcode')
+        self.state_journal = self.printer.lookup_object('state_journal')
+        self.gcode.register_post_command_hook('M106', self.record_fan_state)
         for cmd in ['M20', 'M21', 'M23', 'M24', 'M25', 'M26', 'M27']:
             self.gcode.register_command(cmd, getattr(self, 'cmd_' + cmd))
         for cmd in ['M28', 'M29', 'M30']:
@@ -45,7 +65,6 @@ class VirtualSD:
         self.count_G1 = 0 
         self.count_line = 0
         self.do_resume_status = False
-        self.eepromWriteCount = 1
         self.fan_state = {}
         self.gcode_layer_path = "/usr/data/creality/userdata/config/gcode_layer.json"
         self.user_print_refer_path = "/usr/data/creality/userdata/config/user_print_refer.json"
@@ -66,6 +85,10 @@ class VirtualSD:
         self.cur_print_data = {}
         self.layer_key = ""
         self.end_print_state = False
+        # Print start prefetch (see _start_prefetch())
+        self.prefetch = None
+        self.print_settings = DEFAULT_PRINT_SETTINGS
+        self.print_start_time = None
     def handle_shutdown(self):
         if self.work_timer is not None:
             self.must_pause_work = True
@@ -164,10 +187,8 @@ class VirtualSD:
             self.print_stats.note_cancel()
         self.file_position = self.file_size = 0.
         from subprocess import call
-        if os.path.exists(self.print_file_name_path):
-            os.remove(self.print_file_name_path)
-        if os.path.exists(self.gcode.exclude_object_info):
-            os.remove(self.gcode.exclude_object_info)
+        self.state_journal.remove(self.print_file_name_path)
+        self.state_journal.remove(self.gcode.exclude_object_info)
         call("sync", shell=True)
         try:
             power_loss_switch = False
@@ -181,6 +202,9 @@ class VirtualSD:
                 # self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
         except Exception as err:
             pass
+        # The print history of a print cancelled right after its start
+        # is only recorded once the prefetch completes
+        self._check_prefetch(wait=True)
         self.update_print_history_info(only_update_status=True, state="cancelled")
         if self.print_id and self.cur_print_data:
             reportInformation("key701", data=self.cur_print_data)
@@ -194,6 +218,7 @@ class VirtualSD:
             self.do_pause()
             self.current_file.close()
             self.current_file = None
+        self.file_index = None
         self.file_position = self.file_size = 0.
         self.print_stats.reset()
         self.printer.send_event("virtual_sdcard:reset_file")
@@ -224,16 +249,76 @@ class VirtualSD:
         if filename[0] == '/':
             filename = filename[1:]
         self._load_file(gcmd, filename, check_subdirs=True)
-        self.record_print_history(str(self.current_file.name))
+        self.print_start_time = self.reactor.monotonic()
+        self._start_prefetch()
         self.do_resume()
 
-    def record_print_history(self, file_path=""):
+    # Print start prefetch - the print settings and the slicer metadata
+    # (for the print history) are loaded in a background thread while
+    # the first lines of the file are already being processed
+    def _load_print_settings(self):
+        settings = dict(DEFAULT_PRINT_SETTINGS)
+        try:
+            if os.path.exists(self.user_print_refer_path):
+                with open(self.user_print_refer_path, "r") as f:
+                    data = json.loads(f.read())
+                delay_image = data.get("delay_image", {})
+                settings["delay_photography_switch"] = delay_image.get(
+                    "switch", 1)
+                settings["location"] = delay_image.get("location", 0)
+                settings["frame"] = delay_image.get("frame", 15)
+                settings["interval"] = delay_image.get("interval", 1)
+                settings["power_loss_switch"] = data.get(
+                    "power_loss", {}).get("switch", False)
+        except Exception as err:
+            logging.error("load print settings err:%s" % err)
+        return settings
+    def _prefetch(self, completion, file_path, need_metadata):
+        result = {"file_path": file_path, "metadata": None,
+                  "settings": self._load_print_settings()}
+        if need_metadata:
+            try:
+                result["metadata"] = self.get_print_file_metadata(
+                    os.path.basename(file_path), os.path.dirname(file_path))
+            except Exception:
+                logging.exception("virtual_sdcard prefetch")
+        self.reactor.async_complete(completion, result)
+    def _start_prefetch(self, need_metadata=True):
+        completion = self.reactor.completion()
+        t = threading.Thread(target=self._prefetch, args=(
+            completion, self.current_file.name, need_metadata))
+        t.daemon = True
+        t.start()
+        self.prefetch = completion
+    def _check_prefetch(self, wait=False):
+        # Returns the print settings once the prefetch has completed
+        prefetch = self.prefetch
+        if prefetch is None:
+            return self.print_settings
+        if not wait and not prefetch.test():
+            return None
+        result = prefetch.wait()
+        self.prefetch = None
+        if result["metadata"] is not None:
+            self.record_print_history(result["file_path"], result["metadata"])
+        self.print_settings = settings = result["settings"]
+        logging.info("delay_photography status: delay_photography_switch:%s, location:%s, frame:%s, interval:%s" % (
+            settings["delay_photography_switch"], settings["location"],
+            settings["frame"], settings["interval"]))
+        return settings
+    def _get_power_loss_eeprom(self, power_loss_switch):
+        if power_loss_switch and "bl24c16f" in self.printer.objects:
+            return self.printer.lookup_object('bl24c16f')
+        return None
+
+    def record_print_history(self, file_path="", metadata_info=None):
         try:
             if os.path.exists(file_path):
                 dir_path = os.path.dirname(file_path)
                 file_name = os.path.basename(file_path)
-                metadata_info = self.get_print_file_metadata(filename=file_name, filepath=dir_path)
-                self.layer_count = self.get_file_layer_count(self.current_file.name, metadata_info=metadata_info)
+                if metadata_info is None:
+                    metadata_info = self.get_print_file_metadata(filename=file_name, filepath=dir_path)
+                self.layer_count = self.get_file_layer_count(file_path, metadata_info=metadata_info)
                 start_time = time.time()
                 self.print_id = str(start_time)
                 metadata = metadata_info.get("metadata", {})
@@ -285,7 +370,8 @@ class VirtualSD:
                 logging.error(err)
 
     def rm_power_loss_info(self):
-        if not self.is_continue_print and os.path.exists(self.print_file_name_path):
+        if not self.is_continue_print and self.state_journal.exists(
+                self.print_file_name_path):
             try:
                 power_loss_switch = False
                 with open(self.user_print_refer_path, "r") as f:
@@ -293,9 +379,8 @@ class VirtualSD:
                     power_loss_switch = data.get("power_loss", {}).get("switch", False)
                 bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects and power_loss_switch else None
                 if power_loss_switch and bl24c16f:
-                    os.remove(self.print_file_name_path)
-                    if os.path.exists(self.gcode.exclude_object_info):
-                        os.remove(self.gcode.exclude_object_info)
+                    self.state_journal.remove(self.print_file_name_path)
+                    self.state_journal.remove(self.gcode.exclude_object_info)
                     self.gcode.run_script_from_command("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
                     logging.info("rm power_loss info success")
             except Exception as err:
@@ -338,6 +423,7 @@ class VirtualSD:
         gcmd.respond_raw("File opened:%s Size:%d" % (filename, fsize))
         gcmd.respond_raw("File selected")
         self.current_file = f
+        self.file_index = self.metadata_cache.get_index(fname)
         self.file_position = 0
         self.file_size = fsize
         self.print_stats.set_current_file(filename)
@@ -366,146 +452,101 @@ class VirtualSD:
         self.next_file_position = pos
     def is_cmd_from_sd(self):
         return self.cmd_from_sd
-    def tail_read(self, f):
-        cur_pos = f.tell()
-        buf = ''
-        while True:
-            try:
-                b = str(f.read(1))
-            except UnicodeDecodeError as err:
-                logging.error("UnicodeDecodeError err:%s" % str(err))
-                cur_pos -= 1
-                if cur_pos < 0: break
-                f.seek(cur_pos)
-                continue
-            buf = b + buf
-            cur_pos -= 1
-            if cur_pos < 0: break
-            f.seek(cur_pos)
-            if b.startswith("\n") or b.startswith("\r"):
-                buf = '\n'
-            if (buf.startswith("G1") or buf.startswith("G0")) and buf.endswith("\n"):
-                if ";" in buf:
-                    buf = buf.split(";")[0]+"\n"
-                break
-        return buf
     def getXYZE(self, file_path, file_position):
+        # Also returns the G90/G91 and M82/M83 modes of the file at
+        # file_position, when they could be determined
         result = {"X": 0, "Y": 0, "Z": 0, "E": 0}
+        keys = ["X", "Y", "Z", "E", "absolute_coord", "absolute_extrude"]
+        index = self.metadata_cache.get_index(file_path)
+        if index is not None:
+            try:
+                pos = index.get_position(file_path, file_position)
+                for key in keys:
+                    result[key] = pos[key]
+                logging.info("power_loss get XYZE from index:%s" % str(result))
+                return result
+            except Exception:
+                logging.exception("power_loss getXYZE index")
         try:
-            import io
-            with io.open(file_path, "r", encoding="utf-8") as f:
-                f.seek(file_position)
-                while True:
-                    cur_pos = f.tell()
-                    if cur_pos<=0:
-                        break
-                    line = self.tail_read(f)
-                    line_list = line.split(" ")
-                    if not result["E"] and "E" in line:
-                        for obj in line_list:
-                            if obj.startswith("E"):
-                                ret = obj[1:].split("\r")[0]
-                                ret = ret.split("\n")[0]
-                                if ret.startswith("."):
-                                    result["E"] = float(("0"+ret.strip(" ")))
-                                else:
-                                    result["E"] = float(ret.strip(" "))
-                    if not result["X"] and not result["Y"]:
-                        for obj in line_list:
-                            if obj.startswith("X"):
-                                logging.info("power_loss getXYZE X:%s" % obj)
-                                result["X"] = float(obj.split("\r")[0][1:])
-                            if obj.startswith("Y"):
-                                logging.info("power_loss getXYZE Y:%s" % obj)
-                                result["Y"] = float(obj.split("\r")[0][1:])
-                    if not result["Z"] and "Z" in line:
-                        for obj in line_list:
-                            if obj.startswith("Z"):
-                                logging.info("power_loss getXYZE Z:%s" % obj)
-                                result["Z"] = float(obj.split("\r")[0][1:])
-                    if result["X"] and result["Y"] and result["Z"] and result["E"]:
-                        logging.info("get XYZE:%s" % str(result))
-                        logging.info("power_loss get XYZE:%s" % str(result))
-                        break
-                    self.reactor.pause(self.reactor.monotonic() + .001)
-        except UnicodeDecodeError as err:
-            logging.exception(err)
-            # UnicodeDecodeError 'utf-8' codec can't decode byte 0xff in postion 5278: invalid start byte
-            err_msg = '{"code": "key572", "msg": "File UnicodeDecodeError"}'
-            self.gcode.respond_info(err_msg)
-            raise self.printer.command_error(err_msg)
+            with open(file_path, "rb") as f:
+                pos = gcode_index.find_resume_position(
+                    f, file_position,
+                    pause=lambda: self.reactor.pause(self.reactor.NOW))
+            for key in keys:
+                result[key] = pos[key]
+            logging.info("power_loss get XYZE:%s" % str(result))
         except Exception as err:
             logging.exception(err)
         return result
     def get_print_temperature(self, file_path):
         bed = 0
         extruder = 202.0
-        if os.path.exists(self.gcode.last_temperature_info):
-            try:
-                with open(self.gcode.last_temperature_info, "r") as f:
-                    result = f.read()
-                    if len(result) > 0:
-                        result = json.loads(result)
-                        bed = float(result.get("bed", 0))
-                        extruder = float(result.get("extruder", 201.0))
-            except Exception as err:
-                logging.error("get_print_temperature: %s" % err)
+        try:
+            result = self.state_journal.load(self.gcode.last_temperature_info)
+            if result is not None:
+                bed = float(result.get("bed", 0))
+                extruder = float(result.get("extruder", 201.0))
+        except Exception as err:
+            logging.error("get_print_temperature: %s" % err)
         logging.info("power_loss get_print_temperature: bed:%s, extruder:%s" % (bed, extruder))
         return bed, extruder
 
+    def record_fan_state(self, gcmd):
+        # Track the fan commands of the file being printed so that they
+        # can be restored after a power loss (not those run by macros or
+        # sent by other clients while the file is printing)
+        M106_line = gcmd.get_commandline()
+        if M106_line != self.dispatch_line:
+            return
+        for key in ["M106 S", "M106 P0", "M106 P1", "M106 P2"]:
+            if M106_line.startswith(key):
+                self.fan_state[key] = M106_line
+                break
     def record_layer(self, layer):
         """
         record current print file layer
         """
-        with open(self.gcode_layer_path, "w") as f:
-            f.write(json.dumps({"layer": layer}))
-            f.flush()
+        self.state_journal.update(self.gcode_layer_path, {"layer": layer})
             
-    def get_layer(self):
+    def get_layer(self, file_position=None):
         """
         get last print file layer
         """
+        if self.file_index is not None and file_position is not None:
+            return self.file_index.get_layer(file_position)
         layer = 0
-        if os.path.exists(self.gcode_layer_path):
-            try:
-                with open(self.gcode_layer_path, "r") as f:
-                    layer = int(json.loads(f.read()).get("layer"))
-            except Exception as err:
-                logging.error(err)
-                os.remove(self.gcode_layer_path)
-        return layer
-
-    def get_print_file_metadata(self, filename, filepath="/usr/data/printer_data/gcodes"):
-        from subprocess import check_output
-        result = {}
-        python_env = "/usr/share/klippy-env/bin/python3"
-        # -f gcode filename  -p gcode file dir
-        cmd = "%s /usr/share/klipper/klippy/extras/metadata.py -f '%s' -p %s" % (python_env, filename, filepath)
         try:
-            result = json.loads(check_output(cmd, shell=True).decode("utf-8"))
+            result = self.state_journal.load(self.gcode_layer_path)
+            if result is not None:
+                layer = int(result.get("layer"))
         except Exception as err:
             logging.error(err)
-        return result
-    
+            self.state_journal.remove(self.gcode_layer_path)
+        return layer
+
+    def get_print_file_metadata(self, filename, filepath=None):
+        if filepath is None:
+            filepath = self.sdcard_dirname
+        return self.metadata_cache.get_metadata(
+            os.path.join(filepath, filename))
+
     def get_file_layer_count(self, filename, metadata_info=None):
-        filename = filename.split("/")[-1]
-        import math
         layer_count = 0
         if metadata_info:
             result = metadata_info
         else:
-            result = self.get_print_file_metadata(filename, get_layer_count=True)
+            if not os.path.isabs(filename):
+                filename = os.path.join(self.sdcard_dirname, filename)
+            result = self.metadata_cache.get_metadata(filename)
         if not result:
             return layer_count
         try:
-            layer_count = result.get("metadata").get("layer_count", 0)
-            first_layer_height = result.get("metadata").get("first_layer_height", 0)
-            object_height = result.get("metadata").get("object_height", 0)
-            layer_height = result.get("metadata").get("layer_height", 0)
-            if not layer_count and object_height > 0 and layer_height > 0:
-                layer_count = math.ceil((object_height - first_layer_height) / layer_height + 1)
+            layer_count = metadata_cache.calc_layer_count(
+                result.get("metadata", {}))
         except Exception as err:
             logging.error(err)
+        if not layer_count and self.file_index is not None:
+            layer_count = self.file_index.get_layer_count()
         return layer_count
         
     def resume_print_speed(self):
@@ -561,42 +602,38 @@ class VirtualSD:
         from subprocess import check_output
         self.count_line = 0
         self.count_G1 = 0 
-        self.eepromWriteCount = 1
         gcode_move = self.printer.lookup_object('gcode_move', None)
-        try:
-            if os.path.exists(self.user_print_refer_path):
-                with open(self.user_print_refer_path, "r") as f:
-                    data = json.loads(f.read())
-                    delay_photography_switch = data.get("delay_image", {}).get("switch", 1)
-                    location = data.get("delay_image", {}).get("location", 0)
-                    frame = data.get("delay_image", {}).get("frame", 15)
-                    interval = data.get("delay_image", {}).get("interval", 1)
-                    power_loss_switch = data.get("power_loss", {}).get("switch", False)
-        except Exception as err:
-            delay_photography_switch = 1
-            location = 0
-            frame = 15
-            interval = 1
-            power_loss_switch = False
-        logging.info("delay_photography status: delay_photography_switch:%s, location:%s, frame:%s, interval:%s" % (
-            delay_photography_switch, location, frame, interval
-        ))
-        bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects and power_loss_switch else None
+        if self.prefetch is None:
+            # Resuming a paused print - reload the settings
+            self._start_prefetch(need_metadata=False)
+        # Power loss recovery needs the settings before the first line,
+        # otherwise the print starts while they are being loaded
+        settings = self._check_prefetch(wait=self.is_continue_print)
+        if settings is None:
+            settings = PENDING_PRINT_SETTINGS
+        delay_photography_switch = settings["delay_photography_switch"]
+        location = settings["location"]
+        frame = settings["frame"]
+        interval = settings["interval"]
+        power_loss_switch = settings["power_loss_switch"]
+        bl24c16f = self._get_power_loss_eeprom(power_loss_switch)
+        if bl24c16f is not None:
+            # The first checkpoint of this print starts a new record slot
+            bl24c16f.reset_checkpoints()
         eepromState = True
         try:
             sameFileName = False
-            if self.is_continue_print and os.path.exists(self.print_file_name_path):
-                with open(self.print_file_name_path, "r") as f:
-                    result = (json.loads(f.read()))
-                    if result.get("file_path", "") == self.current_file.name:
-                        sameFileName = True
-                    else:
-                        # clear power_loss info
-                        os.remove(self.print_file_name_path)
-                        if os.path.exists(self.gcode.exclude_object_info):
-                            os.remove(self.gcode.exclude_object_info)
-                        if power_loss_switch and bl24c16f:
-                            bl24c16f.setEepromDisable()
+            if self.is_continue_print and self.state_journal.exists(
+                    self.print_file_name_path):
+                result = self.state_journal.load(self.print_file_name_path, {})
+                if result.get("file_path", "") == self.current_file.name:
+                    sameFileName = True
+                else:
+                    # clear power_loss info
+                    self.state_journal.remove(self.print_file_name_path)
+                    self.state_journal.remove(self.gcode.exclude_object_info)
+                    if power_loss_switch and bl24c16f:
+                        bl24c16f.setEepromDisable()
             if power_loss_switch and self.is_continue_print and not self.do_resume_status and sameFileName and bl24c16f:
                 eepromState = bl24c16f.checkEepromFirstEnable() if power_loss_switch and bl24c16f else True
                 if not eepromState:
@@ -612,7 +649,7 @@ class VirtualSD:
                             logging.info("power_loss print_info:%s" % str(print_info))
                             self.file_position = int(print_info.get("file_position", 0))
                             logging.info("power_loss file_position:%s" % self.file_position)
-                            self.layer = self.get_layer()
+                            self.layer = self.get_layer(self.file_position)
                             gcode = self.printer.lookup_object('gcode')
                             temperature = self.get_print_temperature(self.current_file.name)
                             gcode.run_script_from_command("M140 S%s" % temperature[0])
@@ -622,10 +659,8 @@ class VirtualSD:
                             if XYZE.get("Z") == 0:
                                 logging.error("power_loss gcode Z == 0 err")
                                 from subprocess import call
-                                if os.path.exists(self.print_file_name_path):
-                                    os.remove(self.print_file_name_path)
-                                if os.path.exists(self.gcode.exclude_object_info):
-                                    os.remove(self.gcode.exclude_object_info)
+                                self.state_journal.remove(self.print_file_name_path)
+                                self.state_journal.remove(self.gcode.exclude_object_info)
                                 call("sync", shell=True)
                                 try:
                                     power_loss_switch = False
@@ -661,7 +696,8 @@ class VirtualSD:
             self.print_stats.power_loss = 0
             logging.exception("work_handler RESTORE_GCODE_STATE error: %s" % err)
         if power_loss_switch and bl24c16f and self.current_file:
-            gcode_move.recordPrintFileName(self.print_file_name_path, self.current_file.name, slow_print=self.slow_print)
+            # Written before the eeprom checkpoints can refer to it
+            gcode_move.recordPrintFileName(self.print_file_name_path, self.current_file.name, slow_print=self.slow_print, sync=True)
         logging.info("Starting SD card print (position %d)", self.file_position)
         self.reactor.unregister_timer(self.work_timer)
         try:
@@ -671,6 +707,9 @@ class VirtualSD:
             self.work_timer = None
             return self.reactor.NEVER
         self.print_stats.note_start()
+        file_index = self.file_index
+        if file_index is not None:
+            next_layer_pos = file_index.get_next_layer_pos(self.file_position)
         gcode_mutex = self.gcode.get_mutex()
         partial_input = ""
         lines = []
@@ -695,16 +734,17 @@ class VirtualSD:
                     break
                 if not data:
                     # End of file
+                    if self.prefetch is not None:
+                        # Needed for the print history
+                        self._check_prefetch(wait=True)
                     self.current_file.close()
                     self.current_file = None
                     logging.info("Finished SD card print")
                     self.gcode.respond_raw("Done printing file")
-                    if os.path.exists(self.print_file_name_path):
-                        os.remove(self.print_file_name_path)
-                    if os.path.exists(self.gcode.exclude_object_info):
-                        os.remove(self.gcode.exclude_object_info)
+                    self.state_journal.remove(self.print_file_name_path)
+                    self.state_journal.remove(self.gcode.exclude_object_info)
                     if power_loss_switch and bl24c16f:
-                        self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
+                        bl24c16f.setEepromDisable()
                     self.first_layer_stop = False
                     self.print_first_layer = False
                     self.count_M204 = 0
@@ -714,7 +754,6 @@ class VirtualSD:
                     self.update_print_history_info(only_update_status=True, state="completed")
                     if self.print_id and not self.end_print_state and os.path.exists("/tmp/camera_main"):
                         reportInformation("key608", data={"print_id": self.print_id})
-                    time.sleep(0.3)
                     reportInformation("key701", data=self.cur_print_data)
                     self.cur_print_data = {}
                     self.print_id = ""
@@ -729,6 +768,19 @@ class VirtualSD:
             if gcode_mutex.test():
                 self.reactor.pause(self.reactor.monotonic() + 0.100)
                 continue
+            if self.prefetch is not None:
+                settings = self._check_prefetch()
+                if settings is not None:
+                    delay_photography_switch = settings[
+                        "delay_photography_switch"]
+                    location = settings["location"]
+                    frame = settings["frame"]
+                    interval = settings["interval"]
+                    power_loss_switch = settings["power_loss_switch"]
+                    bl24c16f = self._get_power_loss_eeprom(power_loss_switch)
+                    if bl24c16f is not None and self.current_file:
+                        bl24c16f.reset_checkpoints()
+                        gcode_move.recordPrintFileName(self.print_file_name_path, self.current_file.name, slow_print=self.slow_print, sync=True)
             # Dispatch command
             self.cmd_from_sd = True
             line = lines.pop()
@@ -743,29 +795,8 @@ class VirtualSD:
                     if power_loss_switch and bl24c16f and (self.layer > 2 or (self.count_G1 > 18 and gcode_move.last_position[2] > 0.6)) and end_time-start_time>5 and self.file_position>0:
                         start_time = end_time
                         base_position_e = round(list(gcode_move.base_position)[-1], 2)
-                        pos = bl24c16f.eepromReadHeader()
-                        if eepromState:
-                            # eeprom first enable
-                            self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=1")
-                            self.gcode.run_script("EEPROM_WRITE_INT ADDR=%s VAL=%s" % (pos*8, int(self.file_position)))
-                            self.gcode.run_script("EEPROM_WRITE_FLOAT ADDR=%s VAL=%s" % (pos*8+4, base_position_e))
-                            self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=0 VAL=%d" % pos)
-                            eepromState = False
-                        else:
-                            # pos = bl24c16f.eepromReadHeader()
-                            if self.eepromWriteCount < 256:
-                                self.gcode.run_script("EEPROM_WRITE_INT ADDR=%s VAL=%s" % (pos*8, int(self.file_position)))
-                                self.gcode.run_script("EEPROM_WRITE_FLOAT ADDR=%s VAL=%s" % (pos*8+4, base_position_e))
-                            else:
-                                self.eepromWriteCount = 1
-                                pos += 1
-                                if pos == 256:
-                                    pos = 1
-                                self.gcode.run_script("EEPROM_WRITE_INT ADDR=%s VAL=%s" % (pos*8, int(self.file_position)))
-                                self.gcode.run_script("EEPROM_WRITE_FLOAT ADDR=%s VAL=%s" % (pos*8+4, base_position_e))
-                                self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=0 VAL=%d" % pos)
-                            # logging.info("eepromWriteCount:%d, pos:%d" % (self.eepromWriteCount, pos))
-                        self.eepromWriteCount += 1
+                        bl24c16f.write_checkpoint(self.file_position,
+                                                  base_position_e)
                 except Exception as err:
                     logging.error("EEPROM_WRITE ERROR:%s" % str(err))
                 
@@ -775,41 +806,40 @@ class VirtualSD:
                 if power_loss_switch and bl24c16f and (self.layer > 2 or gcode_move.last_position[2] > 3) and self.current_file and interval_end_time-interval_start_time > 30:
                     interval_start_time = interval_end_time
                     gcode_move.recordPrintFileName(self.print_file_name_path, self.current_file.name, fan_state=self.fan_state, filament_used=self.print_stats.filament_used, last_print_duration=self.print_stats.print_duration, slow_print=self.slow_print)
+                # Checked here rather than in post command hooks: a G1
+                # hook disables the gcode_move fast path, and END_PRINT
+                # must be handled before its macro runs
                 if line.startswith("G1") and "E" in line:
-                    try:
-                        E_str = line.split(" ")[-1]
-                        if E_str.startswith("E"):
-                            lastE = float(E_str.strip("\r").strip("\n")[1:])
-                    except Exception as err:
-                        pass
-                elif line.startswith("M106"):
-                    M106_line = line.strip("\r").strip("\n")
-                    if M106_line.startswith("M106 S"):
-                        self.fan_state["M106 S"] = M106_line
-                    elif M106_line.startswith("M106 P0"):
-                        self.fan_state["M106 P0"] = M106_line
-                    elif M106_line.startswith("M106 P1"):
-                        self.fan_state["M106 P1"] = M106_line
-                    elif M106_line.startswith("M106 P2"):
-                        self.fan_state["M106 P2"] = M106_line
+                    E_str = line.rsplit(" ", 1)[-1]
+                    if E_str.startswith("E"):
+                        try:
+                            lastE = float(E_str[1:])
+                        except ValueError:
+                            pass
                 elif line.startswith("END_PRINT"):
                     self.end_print_state = True
                     if self.print_id and os.path.exists("/tmp/camera_main"):
                         reportInformation("key608", data={"print_id": self.print_id})
-                    if os.path.exists(self.print_file_name_path):
-                        os.remove(self.print_file_name_path)
-                    if os.path.exists(self.gcode.exclude_object_info):
-                        os.remove(self.gcode.exclude_object_info)
+                    self.state_journal.remove(self.print_file_name_path)
+                    self.state_journal.remove(self.gcode.exclude_object_info)
                     if power_loss_switch and bl24c16f:
-                        self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
-                for layer_key in LAYER_KEYS:
-                    if line.startswith(layer_key):
-                        if not self.layer_key:
-                            self.layer_key = layer_key
-                        if line.startswith(self.layer_key):
-                            self.layer += 1
-                            self.record_layer(self.layer)
-                        break
+                        bl24c16f.setEepromDisable()
+                if file_index is not None:
+                    # Layer start offsets are known from the file index
+                    if self.file_position == next_layer_pos:
+                        self.layer += 1
+                        self.record_layer(self.layer)
+                        next_layer_pos = file_index.get_next_layer_pos(
+                            next_file_position)
+                else:
+                    for layer_key in LAYER_KEYS:
+                        if line.startswith(layer_key):
+                            if not self.layer_key:
+                                self.layer_key = layer_key
+                            if line.startswith(self.layer_key):
+                                self.layer += 1
+                                self.record_layer(self.layer)
+                            break
                 if self.print_first_layer and self.count_G1 >= 20:
                     for layer_key in LAYER_KEYS:
                         if line.startswith(layer_key):
@@ -890,7 +920,15 @@ class VirtualSD:
                             logging.error(err)
                         time.sleep(interval_time)
                         start_time = start_time - interval_time
+                if self.print_start_time is not None and line.startswith(
+                        ("G0", "G1")):
+                    logging.info("virtual_sdcard: time to first move %.3fs"
+                                 % (self.reactor.monotonic()
+                                    - self.print_start_time,))
+                    self.print_start_time = None
+                self.dispatch_line = line.strip()
                 self.gcode.run_script(line)
+                self.dispatch_line = None
                 self.count_line += 1
                 if self.count_G1 < 20 and line.startswith("G1"):
                     self.count_G1 += 1
@@ -918,23 +956,31 @@ class VirtualSD:
                     self.current_file.seek(self.file_position)
                 except:
                     logging.exception("virtual_sdcard seek")
+                    self._check_prefetch(wait=True)
                     self.work_timer = None
                     return self.reactor.NEVER
                 lines = []
                 partial_input = ""
+                if file_index is not None:
+                    next_layer_pos = file_index.get_next_layer_pos(
+                        self.file_position)
         logging.info("Exiting SD card print (position %d)", self.file_position)
+        # Do not leave the prefetch of this file to a later print
+        self._check_prefetch(wait=True)
         self.count_line = 0
         self.count_G1 = 0
         self.do_resume_status = False
-        self.eepromWriteCount = 1
         self.work_timer = None
         self.cmd_from_sd = False
+        self.dispatch_line = None
         if error_message is not None:
             self.print_stats.note_error(error_message)
         elif self.current_file is not None:
             self.print_stats.note_pause()
         else:
             self.print_stats.note_complete()
+        # Resume the background scans paused during the print
+        self.metadata_cache.request_scan()
         return self.reactor.NEVER
 
 def load_config(config):
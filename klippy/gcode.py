@@ -5,6 +5,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import os, re, logging, collections, shlex
 from extras.tool import reportInformation
+from extras import state_journal
 
 class CommandError(Exception):
     pass
@@ -107,6 +108,8 @@ class GCodeDispatch:
         self.ready_gcode_handlers = {}
         self.mux_commands = {}
         self.gcode_help = {}
+        self.post_command_hooks = {}
+        self.fast_commands = {}
         # Register commands needed before config file is loaded
         handlers = ['M110', 'M112', 'M115',
                     'RESTART', 'FIRMWARE_RESTART', 'ECHO', 'STATUS', 'HELP']
@@ -116,6 +119,13 @@ class GCodeDispatch:
             self.register_command(cmd, func, True, desc)
         self.last_temperature_info = "/usr/data/creality/userdata/config/temperature_info.json"
         self.exclude_object_info = "/usr/data/creality/userdata/config/exclude_object_info.json"
+        self.state_journal = printer.lookup_object('state_journal')
+        for cmd in ['M104', 'M109']:
+            self.register_post_command_hook(cmd, self._hook_extruder_temp)
+        for cmd in ['M140', 'M190']:
+            self.register_post_command_hook(cmd, self._hook_bed_temp)
+        for cmd in ['EXCLUDE_OBJECT_DEFINE', 'EXCLUDE_OBJECT']:
+            self.register_post_command_hook(cmd, self._hook_exclude_object)
     def is_traditional_gcode(self, cmd):
         # A "traditional" g-code command is a letter and followed by a number
         try:
@@ -184,6 +194,11 @@ class GCodeDispatch:
             cpos = line.find(';')
             if cpos >= 0:
                 line = line[:cpos]
+            # Plain moves may be handled without building a GCodeCommand
+            fast = self.fast_commands.get(line[:3])
+            if fast is not None and self._run_fast_command(
+                    fast, line, need_ack):
+                continue
             # Break line into parts and determine command
             parts = self.args_r.split(line.upper())
             numparts = len(parts)
@@ -202,32 +217,69 @@ class GCodeDispatch:
             try:
                 handler(gcmd)
             except self.error as e:
-                self._respond_error(str(e))
-                self.printer.send_event("gcode:command_error")
-                if not need_ack:
-                    raise
+                self._handle_command_error(e, need_ack)
             except:
-                msg = """{"code":"key60", "msg":"Internal error on command:%s", "values": ["%s"]}""" % (cmd, cmd)
-                logging.exception(msg)
-                self.printer.invoke_shutdown(msg)
-                self._respond_error(msg)
-                if not need_ack:
-                    raise
+                self._handle_internal_error(cmd, need_ack)
             gcmd.ack()
-            if line.startswith("G1") or line.startswith("G0"):
-                pass
-            elif line.startswith("M104"):
-                self.set_temperature("extruder", line)
-            elif line.startswith("M140"):
-                self.set_temperature("bed", line)
-            elif line.startswith("M109"):
-                self.set_temperature("extruder", line)
-            elif line.startswith("M190"):
-                self.set_temperature("bed", line)
-            elif line.startswith("EXCLUDE_OBJECT_DEFINE") or line.startswith("EXCLUDE_OBJECT NAME"):
-                self.record_exclude_object_info(line)
+            hooks = self.post_command_hooks.get(cmd)
+            if hooks is not None:
+                for hook in hooks:
+                    hook(gcmd)
+    def _handle_command_error(self, e, need_ack):
+        self._respond_error(str(e))
+        self.printer.send_event("gcode:command_error")
+        if not need_ack:
+            raise
+    def _handle_internal_error(self, cmd, need_ack):
+        msg = """{"code":"key60", "msg":"Internal error on command:%s", "values": ["%s"]}""" % (cmd, cmd)
+        logging.exception(msg)
+        self.printer.invoke_shutdown(msg)
+        self._respond_error(msg)
+        if not need_ack:
+            raise
+    # Fast command handling
+    def register_fast_command(self, cmd, fast_handler):
+        # fast_handler(params) is called with the whitespace separated
+        # parameters of lines starting with "<cmd> " (cmd must be a two
+        # character command such as G1) as long as the
+        # handler registered for 'cmd' at this point is still in place
+        # and there are no post command hooks for it.  It must return
+        # False, without changing any state, if the line has to be
+        # processed by the regular handler instead.
+        handler = self.ready_gcode_handlers.get(cmd)
+        self.fast_commands[cmd + ' '] = (cmd, handler, fast_handler)
+    def _run_fast_command(self, fast, line, need_ack):
+        cmd, handler, fast_handler = fast
+        if (self.gcode_handlers.get(cmd) is not handler
+            or cmd in self.post_command_hooks):
+            return False
+        try:
+            if not fast_handler(line[3:].split()):
+                return False
+        except self.error as e:
+            self._handle_command_error(e, need_ack)
+        except:
+            self._handle_internal_error(cmd, need_ack)
+        if need_ack:
+            self.respond_raw("ok")
+        return True
+    # Post command hooks
+    def register_post_command_hook(self, cmd, callback):
+        # The callback is invoked with the GCodeCommand after the
+        # handler of each 'cmd' command has been run
+        self.post_command_hooks.setdefault(cmd, []).append(callback)
+    def _get_hook_line(self, gcmd):
+        return gcmd.get_commandline().split(';', 1)[0]
+    def _hook_extruder_temp(self, gcmd):
+        self.set_temperature("extruder", self._get_hook_line(gcmd))
+    def _hook_bed_temp(self, gcmd):
+        self.set_temperature("bed", self._get_hook_line(gcmd))
+    def _hook_exclude_object(self, gcmd):
+        line = self._get_hook_line(gcmd)
+        if (line.startswith("EXCLUDE_OBJECT_DEFINE")
+            or line.startswith("EXCLUDE_OBJECT NAME")):
+            self.record_exclude_object_info(line)
     def set_temperature(self, key, value):
-        import json
         try:
             # configfile = self.printer.lookup_object('configfile')
             # print_stats = self.printer.load_object(configfile, 'print_stats')
@@ -241,46 +293,27 @@ class GCodeDispatch:
             #         logging.info("Fan On SET M106 P1 S255")
             if key == "extruder" and temp_value < 170:
                 return
-            if not os.path.exists(self.last_temperature_info):
-                from subprocess import call
-                call("touch %s" % self.last_temperature_info, shell=True)
-            with open(self.last_temperature_info, "r") as f:
-                ret = f.read()
-                if len(ret) > 0:
-                    ret = json.loads(ret)
-                else:
-                    ret = {}
+            ret = self.state_journal.load(self.last_temperature_info, {})
+            if ret.get(key) == temp_value:
+                return
             ret[key] = temp_value
-            with open(self.last_temperature_info, "w") as f:
-                f.write(json.dumps(ret))
-                f.flush()
+            self.state_journal.update(self.last_temperature_info, ret)
         except Exception as err:
             logging.error("set_temperature error: %s" % err)
     def record_exclude_object_info(self, line):
-        import json
         try:
-            if not os.path.exists(self.exclude_object_info):
-                with open(self.exclude_object_info, "w") as f:
-                    data = {}
-                    data["EXCLUDE_OBJECT_DEFINE"] = []
-                    data["EXCLUDE_OBJECT"] = []
-                    f.write(json.dumps(data))
-                    f.flush()
-            with open(self.exclude_object_info, "r") as f:
-                ret = f.read()
-                if len(ret) > 0:
-                    ret = eval(ret)
-                else:
-                    ret = {}
+            ret = self.state_journal.load(self.exclude_object_info)
+            if ret is None:
+                ret = {"EXCLUDE_OBJECT_DEFINE": [], "EXCLUDE_OBJECT": []}
             if line.startswith("EXCLUDE_OBJECT_DEFINE"):
-                if line not in ret["EXCLUDE_OBJECT_DEFINE"]:
-                    ret["EXCLUDE_OBJECT_DEFINE"].append(line)
+                if line in ret["EXCLUDE_OBJECT_DEFINE"]:
+                    return
+                ret["EXCLUDE_OBJECT_DEFINE"].append(line)
             elif line.startswith("EXCLUDE_OBJECT NAME"):
-                if line not in ret["EXCLUDE_OBJECT"]:
-                    ret["EXCLUDE_OBJECT"].append(line)
-            with open(self.exclude_object_info, "w") as f:
-                f.write(json.dumps(ret))
-                f.flush()
+                if line in ret["EXCLUDE_OBJECT"]:
+                    return
+                ret["EXCLUDE_OBJECT"].append(line)
+            self.state_journal.update(self.exclude_object_info, ret)
         except Exception as err:
             logging.error("record_exclude_object_info error: %s" % err)
     def run_script_from_command(self, script):
@@ -302,15 +335,12 @@ class GCodeDispatch:
         lines = [l.strip() for l in msg.strip().split('\n')]
         self.respond_raw("// " + "\n// ".join(lines))
     def _respond_error(self, msg):
-        import time
-        from extras.tool import reportInformation
         try:
             v_sd = self.printer.lookup_object('virtual_sdcard')
             if v_sd.print_id and "key" in msg and re.findall('key(\d+)', msg) and v_sd.cur_print_data:
                 v_sd.update_print_history_info(only_update_status=True, state="error", error_msg=eval(msg))
                 if os.path.exists("/tmp/camera_main"):
                     reportInformation("key608", data={"print_id": v_sd.print_id})
-                    time.sleep(0.2)
                 v_sd.print_id = ""
                 reportInformation("key701", data=v_sd.cur_print_data)
                 v_sd.cur_print_data = {}
@@ -558,5 +588,6 @@ class GCodeIO:
         return False, "gcodein=%d" % (self.bytes_read,)
 
 def add_early_printer_objects(printer):
+    printer.add_object('state_journal', state_journal.StateJournal(printer))
     printer.add_object('gcode', GCodeDispatch(printer))
     printer.add_object('gcode_io', GCodeIO(printer))
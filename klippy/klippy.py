@@ -56,6 +56,11 @@ class Printer:
         self.run_result = None
         self.event_handlers = {}
         self.objects = collections.OrderedDict()
+        # Startup profiling (see _log_startup_times)
+        self.start_time = main_reactor.monotonic()
+        self.startup_times = []
+        self.load_times = {}
+        self.load_nested = []
         # Init printer components that must be setup prior to config
         for m in [gcode, webhooks]:
             m.add_early_printer_objects(self)
@@ -114,7 +119,9 @@ class Printer:
             if default is not configfile.sentinel:
                 return default
             raise self.config_error("""{"code":"key124", "msg": "Unable to load module '%s'", "values": ["%s"]}""" % (section, section))
+        start_time = self.reactor.monotonic()
         mod = importlib.import_module('extras.' + module_name)
+        import_time = self.reactor.monotonic() - start_time
         init_func = 'load_config'
         if len(module_parts) > 1:
             init_func = 'load_config_prefix'
@@ -123,7 +130,17 @@ class Printer:
             if default is not configfile.sentinel:
                 return default
             raise self.config_error("Unable to load module '%s'" % (section,))
-        self.objects[section] = init_func(config.getsection(section))
+        # Time spent loading other objects from init_func is not counted
+        self.load_nested.append(0.)
+        try:
+            self.objects[section] = init_func(config.getsection(section))
+        finally:
+            nested_time = self.load_nested.pop()
+        total_time = self.reactor.monotonic() - start_time
+        if self.load_nested:
+            self.load_nested[-1] += total_time
+        self.load_times[section] = (import_time,
+                                    total_time - import_time - nested_time)
         return self.objects[section]
     def reload_object(self, config, section, default=configfile.sentinel):
         module_parts = section.split()
@@ -147,11 +164,28 @@ class Printer:
             raise self.config_error("Unable to load module '%s'" % (section,))
         self.objects[section] = init_func(config.getsection(section))
         return self.objects[section]
+    def _note_startup_time(self, phase, start_time):
+        curtime = self.reactor.monotonic()
+        self.startup_times.append((phase, curtime - start_time))
+        return curtime
+    def _log_startup_times(self):
+        total_time = self.reactor.monotonic() - self.start_time
+        logging.info("Startup (%s) took %.3fs: %s",
+                     self.start_args.get('start_reason'), total_time,
+                     " ".join(["%s=%.3f" % (phase, duration)
+                               for phase, duration in self.startup_times]))
+        slowest = sorted(self.load_times.items(),
+                         key=lambda i: -(i[1][0] + i[1][1]))[:10]
+        logging.info("Slowest config sections (import/init): %s",
+                     ", ".join(["%s=%.3f/%.3f" % (section, imp, init)
+                                for section, (imp, init) in slowest]))
     def _read_config(self):
+        start_time = self.reactor.monotonic()
         self.objects['configfile'] = pconfig = configfile.PrinterConfig(self)
         config = pconfig.read_main_config()
         if self.bglogger is not None:
             pconfig.log_config(config)
+        start_time = self._note_startup_time('config', start_time)
         # Create printer components
         for m in [pins, mcu]:
             m.add_printer_objects(config)
@@ -161,6 +195,7 @@ class Printer:
             m.add_printer_objects(config)
         # Validate that there are no undefined parameters in the config file
         pconfig.check_unused_options(config)
+        self._note_startup_time('objects', start_time)
     def _build_protocol_error_message(self, e):
         host_version = self.start_args['software_version']
         msg_update = []
@@ -191,11 +226,14 @@ class Printer:
     def _connect(self, eventtime):
         try:
             self._read_config()
+            start_time = self.reactor.monotonic()
             self.send_event("klippy:mcu_identify")
+            start_time = self._note_startup_time('mcu_identify', start_time)
             for cb in self.event_handlers.get("klippy:connect", []):
                 if self.state_message is not message_startup:
                     return
                 cb()
+            self._note_startup_time('connect', start_time)
         except (self.config_error, pins.error) as e:
             # logging.exception("Config error")^M
             logging.error(e)
@@ -250,11 +288,14 @@ class Printer:
                             % (str(e), message_restart,))
             return
         try:
+            start_time = self.reactor.monotonic()
             self._set_state(message_ready)
             for cb in self.event_handlers.get("klippy:ready", []):
                 if self.state_message is not message_ready:
                     return
                 cb()
+            self._note_startup_time('ready', start_time)
+            self._log_startup_times()
         except Exception as e:
             logging.exception("Unhandled exception during ready callback")
             self.invoke_shutdown("Internal error during ready callback: %s"
@@ -311,6 +352,13 @@ class Printer:
                 logging.exception("Exception during shutdown handler")
         logging.info("Reactor garbage collection: %s",
                      self.reactor.get_gc_stats())
+        profile = self.reactor.get_profile()
+        if profile is not None:
+            worst = sorted(profile.items(), key=lambda i: -i[1]['max'])[:10]
+            logging.info("Reactor profile (slowest callbacks): %s",
+                         ", ".join(["%s %d/%.3f/%.6f" % (
+                             key, p['count'], p['time'], p['max'])
+                                    for key, p in worst]))
     def invoke_async_shutdown(self, msg):
         self.reactor.register_async_callback(
             (lambda e: self.invoke_shutdown(msg)))
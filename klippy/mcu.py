@@ -873,8 +873,8 @@ class MCU:
         return self._printer
     def get_name(self):
         return self._name
-    def register_response(self, cb, msg, oid=None):
-        self._serial.register_response(cb, msg, oid)
+    def register_response(self, cb, msg, oid=None, batch=False):
+        self._serial.register_response(cb, msg, oid, batch)
     def alloc_command_queue(self):
         return self._serial.alloc_command_queue()
     def lookup_command(self, msgformat, cq=None):
@@ -26,12 +26,19 @@ MESSAGE_SYNC = 0x7e
 class error(Exception):
     pass
 
+def _crc16_table():
+    out = []
+    for data in range(256):
+        data ^= (data & 0x0f) << 4
+        out.append(((data << 8) ^ (data >> 4) ^ (data << 3)) & 0xffff)
+    return out
+CRC16_TABLE = _crc16_table()
+
 def crc16_ccitt(buf):
     crc = 0xffff
+    table = CRC16_TABLE
     for data in buf:
-        data ^= crc & 0xff
-        data ^= (data & 0x0f) << 4
-        crc = ((data << 8) | (crc >> 8)) ^ (data >> 4) ^ (data << 3)
+        crc = (crc >> 8) ^ table[(crc ^ data) & 0xff]
     return [crc >> 8, crc & 0xff]
 
 class PT_uint32:
@@ -159,6 +166,59 @@ def convert_msg_format(msgformat):
         msgformat = msgformat.replace(c, '%s')
     return msgformat
 
+# Generate the source of a parse() function specialized for a message
+# format.  Integers and strings are decoded inline, enumerations are
+# handed to the parse() method of the field type.
+def _parse_source(param_names):
+    out = ["def parse(s, pos):", "    pos += 1"]
+    fields = []
+    for i, (name, t) in enumerate(param_names):
+        if isinstance(t, PT_string):
+            out += ["    l = s[pos]",
+                    "    f%d = bytes(bytearray(s[pos+1:pos+l+1]))" % (i,),
+                    "    pos += l + 1"]
+        elif t.is_int:
+            out += ["    c = s[pos]",
+                    "    pos += 1",
+                    "    if c < 0x60:",
+                    "        f%d = c" % (i,),
+                    "    else:",
+                    "        v = c & 0x7f",
+                    "        if (c & 0x60) == 0x60:",
+                    "            v |= -0x20",
+                    "        while c & 0x80:",
+                    "            c = s[pos]",
+                    "            pos += 1",
+                    "            v = (v<<7) | (c & 0x7f)"]
+            if t.signed:
+                out.append("        f%d = v" % (i,))
+            else:
+                out.append("        f%d = v & 0xffffffff" % (i,))
+        else:
+            out.append("    f%d, pos = p%d(s, pos)" % (i, i))
+        fields.append("%s: f%d" % (repr(name), i))
+    out.append("    return {%s}, pos" % (", ".join(fields),))
+    return "\n".join(out)
+
+# Generate the source of an encode() function specialized for a message
+# format.  The 'getters' are the expressions used to access each value.
+def _encode_source(funcname, args, param_names, getters):
+    out = ["def %s(%s):" % (funcname, args), "    out = [msgid]"]
+    for i, (name, t) in enumerate(param_names):
+        out.append("    v = %s" % (getters[i],))
+        if isinstance(t, PT_string):
+            out += ["    out.append(len(v))",
+                    "    out.extend(bytearray(v))"]
+        elif t.is_int:
+            out += ["    if -0x20 <= v < 0x60:",
+                    "        out.append(v & 0x7f)",
+                    "    else:",
+                    "        e%d(out, v)" % (i,)]
+        else:
+            out.append("    e%d(out, v)" % (i,))
+    out.append("    return out")
+    return "\n".join(out)
+
 class MessageFormat:
     def __init__(self, msgid, msgformat, enumerations={}):
         self.msgid = msgid
@@ -168,6 +228,27 @@ class MessageFormat:
         self.param_names = lookup_params(msgformat, enumerations)
         self.param_types = [t for name, t in self.param_names]
         self.name_to_type = dict(self.param_names)
+        self._compile()
+    def _compile(self):
+        # Replace parse(), encode() and encode_by_name() with functions
+        # generated for this message format (the methods below are the
+        # reference implementation)
+        env = {'msgid': self.msgid}
+        for i, t in enumerate(self.param_types):
+            env['p%d' % (i,)] = t.parse
+            env['e%d' % (i,)] = t.encode
+        names = [name for name, t in self.param_names]
+        src = [_parse_source(self.param_names),
+               _encode_source("encode", "params", self.param_names,
+                              ["params[%d]" % (i,)
+                               for i in range(len(names))]),
+               _encode_source("encode_by_name", "**params", self.param_names,
+                              ["params[%s]" % (repr(name),)
+                               for name in names])]
+        exec("\n".join(src), env)
+        self.parse = env['parse']
+        self.encode = env['encode']
+        self.encode_by_name = env['encode_by_name']
     def encode(self, params):
         out = []
         out.append(self.msgid)
@@ -225,6 +306,11 @@ class UnknownFormat:
     def format_params(self, params):
         return "#unknown %s" % (repr(params['#msg']),)
 
+# Message formats built from recently seen data dictionaries, so that a
+# restart of the host software need not rebuild them
+identify_cache = {}
+IDENTIFY_CACHE_SIZE = 8
+
 class MessageParser:
     error = error
     def __init__(self, warn_prefix=""):
@@ -387,7 +473,16 @@ class MessageParser:
         try:
             if decompress:
                 data = zlib.decompress(data)
+            is_new = not self.raw_identify_data
             self.raw_identify_data = data
+            cached = None
+            if is_new:
+                cached = identify_cache.pop(data, None)
+            if cached is not None:
+                # Most recently used entries are kept at the end
+                identify_cache[data] = cached
+                self._load_identify(cached)
+                return
             data = json.loads(data)
             self.fill_enumerations(data.get('enumerations', {}))
             commands = data.get('commands')
@@ -401,11 +496,29 @@ class MessageParser:
             self.config.update(data.get('config', {}))
             self.version = data.get('version', '')
             self.build_versions = data.get('build_versions', '')
+            if is_new:
+                identify_cache[self.raw_identify_data] = self._dump_identify()
+                while len(identify_cache) > IDENTIFY_CACHE_SIZE:
+                    del identify_cache[next(iter(identify_cache))]
         except error as e:
             raise
         except Exception as e:
             logging.exception("process_identify error")
             self._error("Error during identify: %s", str(e))
+    def _dump_identify(self):
+        # The message formats are not modified after creation and are
+        # shared by all parsers using the same data dictionary
+        return (list(self.messages), dict(self.messages_by_id),
+                dict(self.messages_by_name), dict(self.enumerations),
+                dict(self.config), self.version, self.build_versions)
+    def _load_identify(self, cached):
+        (messages, messages_by_id, messages_by_name, enumerations,
+         config, self.version, self.build_versions) = cached
+        self.messages = list(messages)
+        self.messages_by_id = dict(messages_by_id)
+        self.messages_by_name = dict(messages_by_name)
+        self.enumerations = dict(enumerations)
+        self.config = dict(config)
     def get_raw_data_dictionary(self):
         return self.raw_identify_data
     def get_version_info(self):
@@ -3,17 +3,22 @@
 # Copyright (C) 2016-2020  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, gc, select, math, time, logging, queue
+import os, gc, select, math, time, logging, queue, heapq, bisect
 import greenlet
 import chelper, util
 
 _NOW = 0.
 _NEVER = 9999999999999999.
 
+# Upper bounds (in seconds) of the timer latency histogram buckets
+LATENCY_BUCKETS = (.001, .005, .010, .050, .100, .500)
+
 class ReactorTimer:
     def __init__(self, callback, waketime):
         self.callback = callback
         self.waketime = waketime
+        # Current [waketime, seq, timer] entry in the reactor's timer heap
+        self.heap_entry = None
 
 class ReactorCompletion:
     class sentinel: pass
@@ -102,8 +107,16 @@ class SelectReactor:
         self._check_gc = gc_checking
         self._last_gc_times = [0., 0., 0.]
         # Timers
-        self._timers = []
+        self._timers = set()
+        self._timer_heap = []
+        self._timer_seq = 0
+        self._timers_due = []
         self._next_timer = self.NEVER
+        self._latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_max = 0.
+        # Callback profiling (see set_profiling())
+        self._profile = None
+        self._profile_current = None
         # Callbacks
         self._pipe_fds = None
         self._async_queue = queue.Queue()
@@ -116,22 +129,127 @@ class SelectReactor:
         self._all_greenlets = []
     def get_gc_stats(self):
         return tuple(self._last_gc_times)
+    def get_latency_stats(self):
+        return {'timers': len(self._timers),
+                'buckets': list(LATENCY_BUCKETS),
+                'counts': list(self._latency_counts),
+                'max': self._latency_max}
+    def stats(self, eventtime):
+        # Timer latency histogram (the max is reset on each report)
+        counts = "/".join([str(c) for c in self._latency_counts])
+        msg = "reactor_timers=%d reactor_latency=%s max_latency=%.6f" % (
+            len(self._timers), counts, self._latency_max)
+        self._latency_max = 0.
+        if self._profile is not None:
+            top = sorted(self._profile.items(), key=lambda i: -i[1][1])[:5]
+            msg = "%s reactor_profile=%s" % (msg, ",".join([
+                "%s:%d/%.3f/%.6f" % (key, count, total, worst)
+                for key, (count, total, worst) in top]))
+        return (False, msg)
+    # Callback profiling
+    def set_profiling(self, enable):
+        # Record the wall time of timer callbacks, fd callbacks and
+        # greenlet resumes.  Enabling it (when off) starts new statistics.
+        if not enable:
+            self._profile = self._profile_current = None
+        elif self._profile is None:
+            self._profile = {}
+    def get_profile(self, reset=False):
+        profile = self._profile
+        if profile is None:
+            return None
+        if reset:
+            self._profile = {}
+        return {key: {'count': count, 'time': total, 'max': worst}
+                for key, (count, total, worst) in profile.items()}
+    def _profile_key(self, callback):
+        obj = getattr(callback, '__self__', None)
+        if isinstance(obj, ReactorCallback):
+            return self._profile_key(obj.callback)
+        if isinstance(obj, greenlet.greenlet):
+            # Resuming a paused greenlet - report the code that paused
+            frame = obj.gr_frame
+            while frame is not None and frame.f_code.co_filename == __file__:
+                frame = frame.f_back
+            if frame is None:
+                return "resume"
+            return "resume@%s:%s" % (os.path.basename(
+                frame.f_code.co_filename), frame.f_code.co_name)
+        if obj is not None:
+            return "%s.%s" % (type(obj).__name__, callback.__name__)
+        return getattr(callback, '__qualname__', repr(callback))
+    def _profile_call(self, callback, eventtime):
+        entry = [self._profile_key(callback), self.monotonic()]
+        self._profile_current = entry
+        try:
+            return callback(eventtime)
+        finally:
+            # A callback that pauses ends its entry in pause()
+            if self._profile_current is entry:
+                self._profile_end()
+    def _profile_end(self):
+        key, start = self._profile_current
+        self._profile_current = None
+        duration = self.monotonic() - start
+        profile = self._profile
+        if profile is None:
+            return
+        stats = profile.get(key)
+        if stats is None:
+            stats = profile[key] = [0, 0., 0.]
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]:
+            stats[2] = duration
     # Timers
-    def update_timer(self, timer_handler, waketime):
+    def _schedule_timer(self, timer_handler, waketime):
+        # Timers are kept in a heap of [waketime, seq, timer] entries.
+        # Entries are not removed when a timer is updated, an entry is
+        # only valid while it is the timer's heap_entry.
         timer_handler.waketime = waketime
+        entry = timer_handler.heap_entry
+        if entry is not None:
+            if entry[0] == waketime:
+                return
+            timer_handler.heap_entry = None
+        if waketime >= self.NEVER or timer_handler not in self._timers:
+            return
+        self._timer_seq += 1
+        entry = [waketime, self._timer_seq, timer_handler]
+        timer_handler.heap_entry = entry
+        heap = self._timer_heap
+        heapq.heappush(heap, entry)
+        if len(heap) > 2 * len(self._timers) + 64:
+            # Drop stale entries
+            heap[:] = [e for e in heap if e[2].heap_entry is e]
+            heapq.heapify(heap)
+    def update_timer(self, timer_handler, waketime):
+        self._schedule_timer(timer_handler, waketime)
         self._next_timer = min(self._next_timer, waketime)
     def register_timer(self, callback, waketime=NEVER):
         timer_handler = ReactorTimer(callback, waketime)
-        timers = list(self._timers)
-        timers.append(timer_handler)
-        self._timers = timers
-        self._next_timer = min(self._next_timer, waketime)
+        self._timers.add(timer_handler)
+        self.update_timer(timer_handler, waketime)
         return timer_handler
     def unregister_timer(self, timer_handler):
+        self._timers.remove(timer_handler)
         timer_handler.waketime = self.NEVER
-        timers = list(self._timers)
-        timers.pop(timers.index(timer_handler))
-        self._timers = timers
+        timer_handler.heap_entry = None
+    def _update_next_timer(self):
+        heap = self._timer_heap
+        while heap and heap[0][2].heap_entry is not heap[0]:
+            heapq.heappop(heap)
+        if heap:
+            self._next_timer = heap[0][0]
+        else:
+            self._next_timer = self.NEVER
+    def _requeue_timers_due(self):
+        # Return the entries not yet run in the current pass to the heap
+        heap = self._timer_heap
+        for entry in self._timers_due:
+            if entry[2].heap_entry is entry:
+                heapq.heappush(heap, entry)
+        del self._timers_due[:]
     def _check_timers(self, eventtime, busy):
         if eventtime < self._next_timer:
             if busy:
@@ -149,18 +267,44 @@ class SelectReactor:
                     gc.collect(gc_level)
                     return 0.
             return min(1., max(.001, self._next_timer - eventtime))
-        self._next_timer = self.NEVER
         g_dispatch = self._g_dispatch
-        for t in self._timers:
-            waketime = t.waketime
-            if eventtime >= waketime:
-                t.waketime = self.NEVER
-                t.waketime = waketime = t.callback(eventtime)
-                if g_dispatch is not self._g_dispatch:
-                    self._next_timer = min(self._next_timer, waketime)
-                    self._end_greenlet(g_dispatch)
-                    return 0.
-            self._next_timer = min(self._next_timer, waketime)
+        heap = self._timer_heap
+        latency_counts = self._latency_counts
+        # Take the entries due at the start of the pass so that each timer
+        # runs at most once per pass (a timer rescheduled to NOW by a
+        # callback runs on the next pass, after the fds are polled)
+        self._timers_due = due = []
+        while heap and heap[0][0] <= eventtime:
+            entry = heapq.heappop(heap)
+            if entry[2].heap_entry is entry:
+                due.append(entry)
+        due.reverse()
+        while due:
+            entry = due.pop()
+            t = entry[2]
+            if t.heap_entry is not entry:
+                # Updated by an earlier callback of this pass
+                continue
+            waketime = entry[0]
+            if waketime > self.NOW:
+                latency = eventtime - waketime
+                latency_counts[bisect.bisect_left(LATENCY_BUCKETS,
+                                                  latency)] += 1
+                if latency > self._latency_max:
+                    self._latency_max = latency
+            t.heap_entry = None
+            t.waketime = self.NEVER
+            if self._profile is None:
+                waketime = t.callback(eventtime)
+            else:
+                waketime = self._profile_call(t.callback, eventtime)
+            self._schedule_timer(t, waketime)
+            if g_dispatch is not self._g_dispatch:
+                # The rest of this pass was requeued by pause()
+                self._update_next_timer()
+                self._end_greenlet(g_dispatch)
+                return 0.
+        self._update_next_timer()
         return 0.
     # Callbacks and Completions
     def completion(self):
@@ -206,6 +350,8 @@ class SelectReactor:
             time.sleep(delay)
         return self.monotonic()
     def pause(self, waketime):
+        if self._profile_current is not None:
+            self._profile_end()
         g = greenlet.getcurrent()
         if g is not self._g_dispatch:
             if self._g_dispatch is None:
@@ -219,6 +365,8 @@ class SelectReactor:
             g_next = ReactorGreenlet(run=self._dispatch_loop)
             self._all_greenlets.append(g_next)
         g_next.parent = g.parent
+        # The new dispatch greenlet runs the rest of the current pass
+        self._requeue_timers_due()
         g.timer = self.register_timer(g.switch, waketime)
         self._next_timer = self.NOW
         # Switch to _dispatch_loop (via _end_greenlet or direct)
@@ -270,14 +418,20 @@ class SelectReactor:
             eventtime = self.monotonic()
             for fd in res[0]:
                 busy = True
-                fd.read_callback(eventtime)
+                if self._profile is None:
+                    fd.read_callback(eventtime)
+                else:
+                    self._profile_call(fd.read_callback, eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._end_greenlet(g_dispatch)
                     eventtime = self.monotonic()
                     break
             for fd in res[1]:
                 busy = True
-                fd.write_callback(eventtime)
+                if self._profile is None:
+                    fd.write_callback(eventtime)
+                else:
+                    self._profile_call(fd.write_callback, eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._end_greenlet(g_dispatch)
                     eventtime = self.monotonic()
@@ -350,13 +504,21 @@ class PollReactor(SelectReactor):
             for fd, event in res:
                 busy = True
                 if event & (select.POLLIN | select.POLLHUP):
-                    self._fds[fd].read_callback(eventtime)
+                    if self._profile is None:
+                        self._fds[fd].read_callback(eventtime)
+                    else:
+                        self._profile_call(self._fds[fd].read_callback,
+                                           eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
                         break
                 if event & select.POLLOUT:
-                    self._fds[fd].write_callback(eventtime)
+                    if self._profile is None:
+                        self._fds[fd].write_callback(eventtime)
+                    else:
+                        self._profile_call(self._fds[fd].write_callback,
+                                           eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
@@ -401,13 +563,21 @@ class EPollReactor(SelectReactor):
             for fd, event in res:
                 busy = True
                 if event & (select.EPOLLIN | select.EPOLLHUP):
-                    self._fds[fd].read_callback(eventtime)
+                    if self._profile is None:
+                        self._fds[fd].read_callback(eventtime)
+                    else:
+                        self._profile_call(self._fds[fd].read_callback,
+                                           eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
                         break
                 if event & select.EPOLLOUT:
-                    self._fds[fd].write_callback(eventtime)
+                    if self._profile is None:
+                        self._fds[fd].write_callback(eventtime)
+                    else:
+                        self._profile_call(self._fds[fd].write_callback,
+                                           eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
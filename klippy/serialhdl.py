@@ -11,6 +11,9 @@ import msgproto, chelper, util
 class error(Exception):
     pass
 
+# Maximum number of messages obtained from the serialqueue per call
+PULL_BATCH = 64
+
 class SerialReader:
     def __init__(self, reactor, warn_prefix=""):
         self.reactor = reactor
@@ -28,41 +31,75 @@ class SerialReader:
         self.background_thread = None
         # Message handlers
         self.handlers = {}
+        self.batch_handlers = {}
         self.register_response(self._handle_unknown_init, '#unknown')
         self.register_response(self.handle_output, '#output')
         # Sent message notification tracking
         self.last_notify_id = 0
         self.pending_notifications = {}
     def _bg_thread(self):
-        response = self.ffi_main.new('struct pull_queue_message *')
+        responses = self.ffi_main.new('struct pull_queue_message[%d]'
+                                      % (PULL_BATCH,))
         try:
             val = os.nice(-20)
             logging.info("%scurrent nice = %d" ,self.warn_prefix, val)
         except:
             logging.info("%snice process failed", self.warn_prefix)
             pass
+        pull_batch = self.ffi_lib.serialqueue_pull_batch
+        ffi_buffer = self.ffi_main.buffer
         while 1:
-            self.ffi_lib.serialqueue_pull(self.serialqueue, response)
-            count = response.len
+            count = pull_batch(self.serialqueue, responses, PULL_BATCH)
             if count < 0:
                 break
-            if response.notify_id:
-                params = {'#sent_time': response.sent_time,
-                          '#receive_time': response.receive_time}
-                completion = self.pending_notifications.pop(response.notify_id)
-                self.reactor.async_complete(completion, params)
-                continue
-            params = self.msgparser.parse(response.msg[0:count])
-            params['#sent_time'] = response.sent_time
-            params['#receive_time'] = response.receive_time
-            hdl = (params['#name'], params.get('oid'))
-            try:
-                with self.lock:
-                    hdl = self.handlers.get(hdl, self.handle_default)
-                    hdl(params)
-            except:
-                logging.exception("%sException in serial callback",
-                                  self.warn_prefix)
+            msgs = []
+            for i in range(count):
+                response = responses[i]
+                if response.notify_id:
+                    # Responses received before the ack are handled first
+                    if msgs:
+                        self._dispatch(msgs)
+                        msgs = []
+                    params = {'#sent_time': response.sent_time,
+                              '#receive_time': response.receive_time}
+                    completion = self.pending_notifications.pop(
+                        response.notify_id)
+                    self.reactor.async_complete(completion, params)
+                    continue
+                params = self.msgparser.parse(
+                    ffi_buffer(response.msg, response.len)[:])
+                params['#sent_time'] = response.sent_time
+                params['#receive_time'] = response.receive_time
+                msgs.append(params)
+            if msgs:
+                self._dispatch(msgs)
+    def _dispatch(self, msgs):
+        # Messages are delivered in order to regular handlers.  Batch
+        # handlers get all their messages of a pull in one call after the
+        # regular handlers have run.
+        batches = {}
+        with self.lock:
+            handlers = self.handlers
+            batch_handlers = self.batch_handlers
+            for params in msgs:
+                hdl = (params['#name'], params.get('oid'))
+                if hdl in batch_handlers:
+                    batch = batches.get(hdl)
+                    if batch is None:
+                        batch = batches[hdl] = []
+                    batch.append(params)
+                    continue
+                try:
+                    handlers.get(hdl, self.handle_default)(params)
+                except:
+                    logging.exception("%sException in serial callback",
+                                      self.warn_prefix)
+            for hdl, batch in batches.items():
+                try:
+                    batch_handlers[hdl](batch)
+                except:
+                    logging.exception("%sException in serial callback",
+                                      self.warn_prefix)
     def _error(self, msg, *params):
         raise error(self.warn_prefix + (msg % params))
     def _get_identify_data(self, eventtime):
@@ -242,11 +279,18 @@ class SerialReader:
     def get_default_command_queue(self):
         return self.default_cmd_queue
     # Serial response callbacks
-    def register_response(self, callback, name, oid=None):
+    def register_response(self, callback, name, oid=None, batch=False):
+        # A batch handler is called with a list of params (in receive
+        # order) instead of once per message
         with self.lock:
             if callback is None:
-                del self.handlers[name, oid]
+                if self.batch_handlers.pop((name, oid), None) is None:
+                    del self.handlers[name, oid]
+            elif batch:
+                self.handlers.pop((name, oid), None)
+                self.batch_handlers[name, oid] = callback
             else:
+                self.batch_handlers.pop((name, oid), None)
                 self.handlers[name, oid] = callback
     # Command sending
     def raw_send(self, cmd, minclock, reqclock, cmd_queue):
@@ -21,8 +21,13 @@ class Move:
         self.timing_callbacks = []
         velocity = min(speed, toolhead.max_velocity)
         self.is_kinematic_move = True
-        self.axes_d = axes_d = [end_pos[i] - start_pos[i] for i in (0, 1, 2, 3)]
-        self.move_d = move_d = math.sqrt(sum([d*d for d in axes_d[:3]]))
+        self.axes_d = axes_d = [end_pos[0] - start_pos[0],
+                                end_pos[1] - start_pos[1],
+                                end_pos[2] - start_pos[2],
+                                end_pos[3] - start_pos[3]]
+        self.move_d = move_d = math.sqrt(axes_d[0]*axes_d[0]
+                                         + axes_d[1]*axes_d[1]
+                                         + axes_d[2]*axes_d[2])
         if move_d < .000000001:
             # Extrude only move
             self.end_pos = (start_pos[0], start_pos[1], start_pos[2],
@@ -37,7 +42,8 @@ class Move:
             self.is_kinematic_move = False
         else:
             inv_move_d = 1. / move_d
-        self.axes_r = [d * inv_move_d for d in axes_d]
+        self.axes_r = [axes_d[0] * inv_move_d, axes_d[1] * inv_move_d,
+                       axes_d[2] * inv_move_d, axes_d[3] * inv_move_d]
         self.min_move_t = move_d / velocity
         # Junction speeds are tracked in velocity squared.  The
         # delta_v2 is the maximum amount of this squared-velocity that
@@ -295,7 +301,11 @@ class ToolHead:
                    "manual_probe", "tuning_tower"]
         for module_name in modules:
             self.printer.load_object(config, module_name)
+        self.gcode = gcode
+        # Set by gap_auto_comp once homing starts
         self.gap_auto_comp = None
+        self.gap_now_pos = [0., 0., 0., 0.]
+        self.gap_new_pos = [0., 0., 0., 0.]
 
         self.z_pos_filepath = "/usr/data/creality/userdata/config/z_pos.json"
         self.z_pos = self.get_z_pos()
@@ -456,18 +466,22 @@ class ToolHead:
                     logging.info("record_z_pos:%s" % commanded_pos_z)
             except Exception as err:
                 logging.error(err)
+    def _apply_gap_offsets(self, newpos):
+        # Returns newpos with the gap_auto_comp backlash offsets added
+        now_pos = self.gap_now_pos
+        now_pos[:] = self.commanded_pos
+        gap_ofts = self.gap_auto_comp.deal_move(self, now_pos, newpos)
+        if self.gap_auto_comp.show_msg:
+            self.gcode.respond_info('gap_auto_comp:X=%.3f, Y=%.3f, Z=%.3f' % (gap_ofts[0], gap_ofts[1], gap_ofts[2]))
+        gap_pos = self.gap_new_pos
+        gap_pos[0] = gap_ofts[0] + newpos[0]
+        gap_pos[1] = gap_ofts[1] + newpos[1]
+        gap_pos[2] = gap_ofts[2] + newpos[2]
+        gap_pos[3] = gap_ofts[3] + newpos[3]
+        return gap_pos
     def move(self, newpos, speed):
-        gap_ofts = [0., 0., 0., 0.]
-        bed_ofts = [0., 0., 0., 0.]
-        now_pos = self.get_position()
-        self.gcode = self.printer.lookup_object('gcode')
-        if self.gap_auto_comp != None:
-            gap_ofts = self.gap_auto_comp.deal_move(self, now_pos, newpos)
-            if self.gap_auto_comp.show_msg:
-                self.gcode.respond_info('gap_auto_comp:X=%.3f, Y=%.3f, Z=%.3f' % (gap_ofts[0], gap_ofts[1], gap_ofts[2]))
-
-        newpos = [sum(gb) for gb in zip(gap_ofts, bed_ofts, list(newpos))]
-
+        if self.gap_auto_comp is not None:
+            newpos = self._apply_gap_offsets(newpos)
         # self.record_z_pos(newpos[2])
         move = Move(self, self.commanded_pos, newpos, speed)
         if not move.move_d:
@@ -695,14 +709,12 @@ class ToolHead:
         self._calc_junction_deviation()
         v_sd = self.printer.lookup_object('virtual_sdcard', None)
         print_stats = self.printer.lookup_object('print_stats', None)
-        if print_stats and print_stats.state == "printing" and v_sd and v_sd.count_M204 < 3 and os.path.exists(v_sd.print_file_name_path):
+        state_journal = self.printer.lookup_object('state_journal')
+        if print_stats and print_stats.state == "printing" and v_sd and v_sd.count_M204 < 3 and state_journal.exists(v_sd.print_file_name_path):
             v_sd.count_M204 += 1
-            with open(v_sd.print_file_name_path, "r") as f:
-                result = (json.loads(f.read()))
-                result["M204"] = cmd
-            with open(v_sd.print_file_name_path, "w") as f:
-                f.write(json.dumps(result))
-                f.flush()
+            result = state_journal.load(v_sd.print_file_name_path, {})
+            result["M204"] = cmd
+            state_journal.update(v_sd.print_file_name_path, result)
             logging.info("Record cmd_M204")
 
 def add_printer_objects(config):
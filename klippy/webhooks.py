@@ -3,10 +3,14 @@
 # Copyright (C) 2020 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license
-import logging, socket, os, sys, errno, json, collections
+import logging, socket, os, sys, errno, json, collections, time, re
+import importlib
 import gcode
 
 REQUEST_LOG_SIZE = 20
+RECV_SIZE = 64 * 1024
+# Maximum number of buffers passed to a single sendmsg() call (IOV_MAX)
+SEND_IOV_MAX = 1024
 
 # Json decodes strings as unicode types in Python 2.x.  This doesn't
 # play well with some parts of Klipper (particuarly displays), so we
@@ -26,6 +30,100 @@ if sys.version_info.major < 3:
                     for k, v in data.items()}
         return data
 
+# JSON codecs for the API socket.  The faster orjson and ujson modules
+# are used to encode when available, but the wire format must remain
+# identical to the json module.  Messages the faster module could encode
+# differently (exponent and small floats, non-ascii or DEL characters,
+# NaN) are handled by the json module.  Requests are always decoded by
+# the json module (see scripts/bench_webhooks_json.py).
+JSON_CODECS = ['orjson', 'ujson', 'json']
+
+class JsonCodec:
+    name = "json"
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+    def dumps(self, data):
+        return self.encoder.encode(data).encode()
+    def loads(self, data):
+        return json.loads(data, object_hook=json_loads_byteify)
+
+# Subclasses provide fast_dumps(data) and check_output(out), which
+# returns True if the output may differ from the json module
+class FastJsonCodec(JsonCodec):
+    def __init__(self, module):
+        JsonCodec.__init__(self)
+        self.name = module.__name__
+    def dumps(self, data):
+        try:
+            out = self.fast_dumps(data)
+        except Exception:
+            return self.encoder.encode(data).encode()
+        if self.check_output(out):
+            return self.encoder.encode(data).encode()
+        return out
+
+class UJsonCodec(FastJsonCodec):
+    def __init__(self, module):
+        FastJsonCodec.__init__(self, module)
+        self.ujson_dumps = module.dumps
+    def fast_dumps(self, data):
+        return self.ujson_dumps(data, ensure_ascii=True,
+                                escape_forward_slashes=False).encode()
+    def check_output(self, out):
+        return (b'e-' in out or b'e+' in out or b'0.0000' in out
+                or b'\x7f' in out)
+
+class OrJsonCodec(FastJsonCodec):
+    # orjson writes utf-8, encodes NaN as null and omits the "+" of
+    # exponents
+    exponent_check = re.compile(br'e[0-9]')
+    def __init__(self, module):
+        FastJsonCodec.__init__(self, module)
+        self.fast_dumps = module.dumps
+    def check_output(self, out):
+        return (not out.isascii() or b'null' in out or b'e-' in out
+                or b'0.0000' in out or b'\x7f' in out
+                or self.exponent_check.search(out) is not None)
+
+FAST_JSON_CODECS = {'orjson': OrJsonCodec, 'ujson': UJsonCodec}
+
+JSON_CHECK_DATA = [
+    {"id": 1, "result": {"status": {"toolhead": {
+        "position": [1.5, -0.0, 1e-05, 3e-07, 1e+16, 1.2345e+22, 0.0001],
+        "homed_axes": "xyz", "estimated_print_time": 12345.678901}},
+        "eventtime": 3052153.382083195}},
+    {"params": {"a": None, "b": True, "c": (1, 2), "d": 2**70,
+                "e": float('nan'), "f": float('inf'), 7: "int key"}},
+    ["caf\u00e9", "/path/\"quoted\"", "\x00\x01\t\n\x1f\x7f", "\u2028",
+     "\U0001F600"]]
+
+def check_json_codec(codec, reference):
+    # Verify the codec against the json module
+    for data in JSON_CHECK_DATA:
+        out = reference.dumps(data)
+        if codec.dumps(data) != out:
+            return False
+    return True
+
+def lookup_json_codec(names=JSON_CODECS):
+    reference = JsonCodec()
+    if json_loads_byteify is not None:
+        return reference
+    for name in names:
+        codec_class = FAST_JSON_CODECS.get(name)
+        if codec_class is None:
+            break
+        try:
+            module = importlib.import_module(name)
+            codec = codec_class(module)
+            if check_json_codec(codec, reference):
+                return codec
+        except Exception:
+            continue
+        logging.info("webhooks: %s output differs from json, not used"
+                     % (name,))
+    return reference
+
 class WebRequestError(gcode.CommandError):
     def __init__(self, message,):
         Exception.__init__(self, message)
@@ -40,9 +138,12 @@ class Sentinel:
 
 class WebRequest:
     error = WebRequestError
-    def __init__(self, client_conn, request):
+    def __init__(self, client_conn, request, json_codec=None):
         self.client_conn = client_conn
-        base_request = json.loads(request, object_hook=json_loads_byteify)
+        if json_codec is None:
+            base_request = json.loads(request, object_hook=json_loads_byteify)
+        else:
+            base_request = json_codec.loads(request)
         if type(base_request) != dict:
             raise ValueError("Not a top-level dictionary")
         self.id = base_request.get('id', None)
@@ -108,12 +209,14 @@ class ServerSocket:
         self.reactor = printer.get_reactor()
         self.sock = self.fd_handle = None
         self.clients = {}
+        self.json_codec = lookup_json_codec()
         start_args = printer.get_start_args()
         server_address = start_args.get('apiserver')
         is_fileinput = (start_args.get('debuginput') is not None)
         if not server_address or is_fileinput:
             # Do not enable server
             return
+        logging.info("webhooks: using %s json codec" % (self.json_codec.name,))
         self._remove_socket_file(server_address)
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.sock.setblocking(0)
@@ -180,9 +283,17 @@ class ClientConnection:
         self.server = server
         self.uid = id(self)
         self.sock = sock
+        self.json_codec = server.json_codec
         self.fd_handle = self.reactor.register_fd(
             self.sock.fileno(), self.process_received, self._do_send)
-        self.partial_data = self.send_buffer = b""
+        self.partial_data = b""
+        # Decoded requests are processed in order from a single timer
+        self.pending_requests = collections.deque()
+        self.request_timer = self.reactor.register_timer(
+            self._process_requests)
+        # Encoded messages not yet written (the first may be a partially
+        # sent memoryview), written together once the socket is writable
+        self.send_buffers = []
         self.is_blocking = False
         self.blocking_count = 0
         self.set_client_info("?", "New connection")
@@ -213,6 +324,9 @@ class ClientConnection:
         self.set_client_info(None, "Disconnected")
         self.reactor.unregister_fd(self.fd_handle)
         self.fd_handle = None
+        self.reactor.unregister_timer(self.request_timer)
+        self.pending_requests.clear()
+        self.send_buffers = []
         try:
             self.sock.close()
         except socket.error:
@@ -224,7 +338,7 @@ class ClientConnection:
 
     def process_received(self, eventtime):
         try:
-            data = self.sock.recv(4096)
+            data = self.sock.recv(RECV_SIZE)
         except socket.error as e:
             # If bad file descriptor allow connection to be
             # closed by the data check
@@ -243,16 +357,28 @@ class ClientConnection:
         requests = data.split(b'\x03')
         requests[0] = self.partial_data + requests[0]
         self.partial_data = requests.pop()
+        pending_requests = self.pending_requests
         for req in requests:
             self.request_log.append((eventtime, req))
             try:
-                web_request = WebRequest(self, req)
+                web_request = WebRequest(self, req, self.json_codec)
             except Exception:
                 logging.exception("webhooks: Error decoding Server Request %s"
                                   % (req))
                 continue
-            self.reactor.register_callback(
-                lambda e, s=self, wr=web_request: s._process_request(wr))
+            pending_requests.append(web_request)
+        if pending_requests:
+            self.reactor.update_timer(self.request_timer, self.reactor.NOW)
+
+    def _process_requests(self, eventtime):
+        pending_requests = self.pending_requests
+        while pending_requests:
+            web_request = pending_requests.popleft()
+            # Should this request pause, the remaining requests are
+            # processed from a new invocation of this timer
+            self.reactor.update_timer(self.request_timer, self.reactor.NOW)
+            self._process_request(web_request)
+        return self.reactor.NEVER
 
     def _process_request(self, web_request):
         try:
@@ -272,23 +398,38 @@ class ClientConnection:
         self.send(result)
 
     def send(self, data):
-        jmsg = json.dumps(data, separators=(',', ':'))
-        self.send_buffer += jmsg.encode() + b"\x03"
+        if self.fd_handle is None:
+            return
+        jmsg = self.json_codec.dumps(data)
+        self.send_buffers.append(jmsg + b"\x03")
+        # Write immediately so that a reply sent just before a restart
+        # or close is not lost; replies only queue up while blocked
         if not self.is_blocking:
             self._do_send()
 
     def _do_send(self, eventtime=None):
-        if self.fd_handle is None:
+        if self.fd_handle is None or not self.send_buffers:
             return
+        buffers = self.send_buffers
         try:
-            sent = self.sock.send(self.send_buffer)
+            sent = self.sock.sendmsg(buffers[:SEND_IOV_MAX])
         except socket.error as e:
             if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
                 logging.info("webhooks: socket write error %d" % (self.uid,))
                 self.close()
                 return
             sent = 0
-        if sent < len(self.send_buffer):
+        # Drop the written data without copying the remainder
+        count = 0
+        for buf in buffers:
+            if sent < len(buf):
+                break
+            sent -= len(buf)
+            count += 1
+        del buffers[:count]
+        if buffers and sent:
+            buffers[0] = memoryview(buffers[0])[sent:]
+        if buffers:
             if not self.is_blocking:
                 self.reactor.set_fd_wake(self.fd_handle, False, True)
                 self.is_blocking = True
@@ -296,7 +437,6 @@ class ClientConnection:
         elif self.is_blocking:
             self.reactor.set_fd_wake(self.fd_handle, True, False)
             self.is_blocking = False
-        self.send_buffer = self.send_buffer[sent:]
 
 class WebHooks:
     def __init__(self, printer):
@@ -309,6 +449,8 @@ class WebHooks:
         self.register_endpoint("emergency_stop", self._handle_estop_request)
         self.register_endpoint("register_remote_method",
                                self._handle_rpc_registration)
+        self.register_endpoint("reactor/profile",
+                               self._handle_reactor_profile)
         self.sconn = ServerSocket(self, printer)
 
     def register_endpoint(self, path, callback):
@@ -377,6 +519,16 @@ class WebHooks:
     def _handle_estop_request(self, web_request):
         self.printer.invoke_shutdown("Shutdown due to webhooks request")
 
+    def _handle_reactor_profile(self, web_request):
+        reactor = self.printer.get_reactor()
+        enable = web_request.get('enable', None, types=(bool,))
+        if enable is not None:
+            reactor.set_profiling(enable)
+        reset = web_request.get('reset', False, types=(bool,))
+        callbacks = reactor.get_profile(reset)
+        web_request.send({'enabled': callbacks is not None,
+                          'callbacks': callbacks or {}})
+
     def _handle_rpc_registration(self, web_request):
         template = web_request.get_dict('response_template')
         method = web_request.get_str('remote_method')
@@ -463,6 +615,27 @@ class GCodeHelper:
 
 SUBSCRIPTION_REFRESH_TIME = .25
 
+# Optional limit on how often a subscriber is sent updates.  Changes
+# seen in between are merged and sent together.
+class SubscriptionRate:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.next_time = 0.
+        self.pending = {}
+    def check(self, eventtime, cquery):
+        pending = self.pending
+        for obj_name, cres in cquery.items():
+            pending.setdefault(obj_name, {}).update(cres)
+        if eventtime < self.next_time or not pending:
+            return None
+        self.next_time = eventtime + self.min_interval
+        self.pending = {}
+        return pending
+
+# Printer objects may implement get_status_version(), returning a value
+# that changes whenever their get_status() result changes.  Objects that
+# report the same version as on the previous query are neither queried
+# nor compared again.
 class QueryStatusHelper:
     def __init__(self, printer):
         self.printer = printer
@@ -470,23 +643,43 @@ class QueryStatusHelper:
         self.pending_queries = []
         self.query_timer = None
         self.last_query = {}
+        self.last_versions = {}
+        # obj_name -> [queries, unchanged queries, time spent]
+        self.query_stats = {}
         # Register webhooks
         webhooks = printer.lookup_object('webhooks')
         webhooks.register_endpoint("objects/list", self._handle_list)
         webhooks.register_endpoint("objects/query", self._handle_query)
         webhooks.register_endpoint("objects/subscribe", self._handle_subscribe)
+        webhooks.register_endpoint("objects/query_stats",
+                                   self._handle_query_stats)
     def _handle_list(self, web_request):
         objects = [n for n, o in self.printer.lookup_objects()
                    if hasattr(o, 'get_status')]
         web_request.send({'objects': objects})
+    def _get_status(self, obj_name, eventtime, last_query, versions):
+        # Returns (status, is_unchanged)
+        po = self.printer.lookup_object(obj_name, None)
+        if po is None or not hasattr(po, 'get_status'):
+            return {}, False
+        get_version = getattr(po, 'get_status_version', None)
+        if get_version is not None:
+            version = versions[obj_name] = get_version()
+            if (version == self.last_versions.get(obj_name)
+                and obj_name in last_query):
+                return last_query[obj_name], True
+        return po.get_status(eventtime), False
     def _do_query(self, eventtime):
         last_query = self.last_query
         query = self.last_query = {}
+        versions = {}
+        unchanged = set()
+        query_stats = self.query_stats
         msglist = self.pending_queries
         self.pending_queries = []
         msglist.extend(self.clients.values())
         # Generate get_status() info for each client
-        for cconn, subscription, send_func, template in msglist:
+        for cconn, subscription, send_func, template, rate in msglist:
             is_query = cconn is None
             if not is_query and cconn.is_closed():
                 del self.clients[cconn]
@@ -494,30 +687,47 @@ class QueryStatusHelper:
             # Query each requested printer object
             cquery = {}
             for obj_name, req_items in subscription.items():
+                start_time = time.perf_counter()
+                stats = query_stats.get(obj_name)
+                if stats is None:
+                    stats = query_stats[obj_name] = [0, 0, 0.]
                 res = query.get(obj_name, None)
                 if res is None:
-                    po = self.printer.lookup_object(obj_name, None)
-                    if po is None or not hasattr(po, 'get_status'):
-                        res = query[obj_name] = {}
-                    else:
-                        res = query[obj_name] = po.get_status(eventtime)
+                    res, is_unchanged = self._get_status(
+                        obj_name, eventtime, last_query, versions)
+                    query[obj_name] = res
+                    stats[0] += 1
+                    if is_unchanged:
+                        unchanged.add(obj_name)
+                        stats[1] += 1
                 if req_items is None:
                     req_items = list(res.keys())
                     if req_items:
                         subscription[obj_name] = req_items
-                lres = last_query.get(obj_name, {})
-                cres = {}
-                for ri in req_items:
-                    rd = res.get(ri, None)
-                    if is_query or rd != lres.get(ri):
-                        cres[ri] = rd
-                if cres or is_query:
-                    cquery[obj_name] = cres
+                if is_query:
+                    cquery[obj_name] = {ri: res.get(ri, None)
+                                        for ri in req_items}
+                elif obj_name not in unchanged:
+                    lres = last_query.get(obj_name, {})
+                    cres = {}
+                    for ri in req_items:
+                        rd = res.get(ri, None)
+                        lrd = lres.get(ri)
+                        if rd is not lrd and rd != lrd:
+                            cres[ri] = rd
+                    if cres:
+                        cquery[obj_name] = cres
+                stats[2] += time.perf_counter() - start_time
             # Send data
+            if rate is not None:
+                cquery = rate.check(eventtime, cquery)
+                if cquery is None:
+                    continue
             if cquery or is_query:
                 tmp = dict(template)
                 tmp['params'] = {'eventtime': eventtime, 'status': cquery}
                 send_func(tmp)
+        self.last_versions = versions
         if not query:
             # Unregister timer if there are no longer any subscriptions
             reactor = self.printer.get_reactor()
@@ -536,6 +746,13 @@ class QueryStatusHelper:
                 for ri in v:
                     if type(ri) != str:
                         raise web_request.error("""{"code":"key187", "msg": "Invalid argument", "values": []}""")
+        rate = None
+        if is_subscribe:
+            min_interval = web_request.get_float('min_interval', 0.)
+            if min_interval < 0.:
+                raise web_request.error("""{"code":"key187", "msg": "Invalid argument", "values": []}""")
+            if min_interval > SUBSCRIPTION_REFRESH_TIME:
+                rate = SubscriptionRate(min_interval)
         # Add to pending queries
         cconn = web_request.get_client_connection()
         template = web_request.get_dict('response_template', {})
@@ -543,7 +760,8 @@ class QueryStatusHelper:
             del self.clients[cconn]
         reactor = self.printer.get_reactor()
         complete = reactor.completion()
-        self.pending_queries.append((None, objects, complete.complete, {}))
+        self.pending_queries.append((None, objects, complete.complete, {},
+                                     None))
         # Start timer if needed
         if self.query_timer is None:
             qt = reactor.register_timer(self._do_query, reactor.NOW)
@@ -554,9 +772,18 @@ class QueryStatusHelper:
         logging.info("_handle_query after complete.wait:%s" % str(msg['params'])) if handle_subscribe else None
         web_request.send(msg['params'])
         if is_subscribe:
-            self.clients[cconn] = (cconn, objects, cconn.send, template)
+            self.clients[cconn] = (cconn, objects, cconn.send, template, rate)
     def _handle_subscribe(self, web_request):
         self._handle_query(web_request, is_subscribe=True, handle_subscribe=True)
+    def _handle_query_stats(self, web_request):
+        objects = {}
+        for obj_name, (count, unchanged, qtime) in self.query_stats.items():
+            objects[obj_name] = {'queries': count, 'unchanged': unchanged,
+                                 'time': qtime}
+        if web_request.get('reset', False, types=(bool,)):
+            self.query_stats = {}
+        web_request.send({'objects': objects,
+                          'subscriptions': len(self.clients)})
 
 def add_early_printer_objects(printer):
     printer.add_object('webhooks', WebHooks(printer))
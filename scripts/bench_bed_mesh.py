@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Benchmark the time needed to build interpolated bed meshes
+# (ZMesh.build_mesh) for a range of probe counts and mesh_pps values
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_bed_mesh.py -k <old tree>/klippy
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging
+
+class StubGCode:
+    def __init__(self):
+        self.ready_gcode_handlers = {}
+    def register_command(self, cmd, func, desc=None):
+        self.ready_gcode_handlers[cmd] = func
+
+class StubPrinter:
+    def __init__(self):
+        self.gcode = StubGCode()
+    def lookup_object(self, name, default=None):
+        return self.gcode
+
+def time_build(bed_mesh, count, algo, pps, runs):
+    rnd = random.Random(count)
+    params = {'min_x': 10., 'max_x': 210., 'min_y': 10., 'max_y': 210.,
+              'x_count': count, 'y_count': count, 'mesh_x_pps': pps,
+              'mesh_y_pps': pps, 'algo': algo, 'tension': .2}
+    z_matrix = [[rnd.uniform(-.3, .3) for i in range(count)]
+                for j in range(count)]
+    best = None
+    for i in range(runs):
+        # A new ZMesh is created for every calibration and profile load
+        start = time.perf_counter()
+        zmesh = bed_mesh.ZMesh(params, StubPrinter())
+        zmesh.build_mesh(z_matrix)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best * 1000.
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing extras/bed_mesh.py")
+    opts.add_option("-s", "--sizes", type="string", dest="sizes",
+                    default="5,7,9,11,13,15",
+                    help="comma separated probe counts (per axis)")
+    opts.add_option("-p", "--pps", type="string", dest="pps",
+                    default="2,4,8",
+                    help="comma separated mesh_pps values")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    opts.add_option("--no-numpy", action="store_true", dest="no_numpy",
+                    help="use the pure python interpolation")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    from extras import bed_mesh
+    logging.disable(logging.CRITICAL)
+    if options.no_numpy and hasattr(bed_mesh, 'get_numpy'):
+        bed_mesh.get_numpy = lambda: None
+    print("%8s %4s %10s %14s %14s" % (
+        "probes", "pps", "mesh", "lagrange (ms)", "bicubic (ms)"))
+    for count in [int(v) for v in options.sizes.split(',')]:
+        for pps in [int(v) for v in options.pps.split(',')]:
+            mesh_cnt = (count - 1) * pps + count
+            # Lagrange interpolation is limited to 6 probe points
+            lagrange = "-"
+            if count <= 6:
+                lagrange = "%.2f" % time_build(
+                    bed_mesh, count, 'lagrange', pps, options.count)
+            bicubic = "%.2f" % time_build(
+                bed_mesh, count, 'bicubic', pps, options.count)
+            print("%8s %4d %10s %14s %14s" % (
+                "%dx%d" % (count, count), pps,
+                "%dx%d" % (mesh_cnt, mesh_cnt), lagrange, bicubic))
+
+if __name__ == '__main__':
+    main()
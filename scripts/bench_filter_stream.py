@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Check that the incremental load cell filters (filter.py FilterStream,
+# as used by prtouch probe_by_step) give results identical to the batch
+# Filter.cal_offset_by_vals() and Filter.cal_filter_by_vals(), and
+# compare the time per update.
+#
+# Random hx711 sample streams are fed as prtouch does: a window of the
+# last 2 * pi_count samples (see hx711s.py SampleRing), polled after 0
+# to 3 new samples have arrived.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_filter_stream.py -k <old tree>/klippy
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging
+
+class StubConfig:
+    def getfloat(self, option, default=None, minval=None, maxval=None):
+        return default
+
+def make_polls(rnd, s_count, pi_count, samples):
+    # Returns a list of (count, window) as seen by each poll
+    bufs = [[] for i in range(s_count)]
+    level = [rnd.uniform(-50000., 50000.) for i in range(s_count)]
+    polls = []
+    count = 0
+    while count < samples:
+        for i in range(rnd.randint(0, 3)):
+            count += 1
+            for ch in range(s_count):
+                # Slow drift, noise, a spike now and then and a press
+                # towards the end of the stream
+                level[ch] += rnd.uniform(-20., 20.)
+                val = level[ch] + rnd.gauss(0., 30.)
+                if rnd.random() < .02:
+                    val += rnd.choice([-1, 1]) * rnd.uniform(500., 5000.)
+                if count > samples * 3 // 4:
+                    val += (count - samples * 3 // 4) * 150.
+                bufs[ch].append(int(val))
+        if not count:
+            continue
+        window = [buf[-2 * pi_count:] for buf in bufs]
+        window.extend([[] for i in range(4 - s_count)])
+        polls.append((count, window))
+    return polls
+
+def timed_updates(func, polls, window_size, times):
+    # Adds the time of each update to times[0] while the window is being
+    # filled and to times[1] once it is full (and slides)
+    res = []
+    perf_counter = time.perf_counter
+    for count, window in polls:
+        start = perf_counter()
+        res.append(func(count, window))
+        times[count > window_size] += perf_counter() - start
+    return res
+
+def best_time(func, runs):
+    best = None
+    for i in range(runs):
+        times = [0., 0.]
+        res = func(times)
+        if best is None or sum(times) < sum(best):
+            best = times
+    return best, res
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing extras/filter.py")
+    opts.add_option("-s", "--streams", type="int", dest="streams",
+                    default=20, help="number of random sample streams")
+    opts.add_option("-m", "--samples", type="int", dest="samples",
+                    default=400, help="samples per stream")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    from extras import filter
+    logging.disable(logging.CRITICAL)
+    flt = filter.Filter(StubConfig())
+    has_stream = hasattr(flt, 'get_filter_stream')
+    rnd = random.Random(options.samples)
+    batch_time = [0., 0.]
+    stream_time = [0., 0.]
+    updates = [0, 0]
+    mismatches = 0
+    for i in range(options.streams):
+        s_count = rnd.randint(1, 4)
+        pi_count = rnd.choice([16, 32, 64, 128])
+        hft_hz = rnd.uniform(.1, 10.)
+        lft_k1 = rnd.uniform(0., 1.)
+        polls = make_polls(rnd, s_count, pi_count, options.samples)
+        window_size = 2 * pi_count
+        for count, window in polls:
+            updates[count > window_size] += 2
+        def batch(times):
+            return (timed_updates(lambda c, w: flt.cal_offset_by_vals(
+                        s_count, w, lft_k1, pi_count),
+                                  polls, window_size, times),
+                    timed_updates(lambda c, w: flt.cal_filter_by_vals(
+                        s_count, w, hft_hz, lft_k1, pi_count),
+                                  polls, window_size, times))
+        duration, ref = best_time(batch, options.count)
+        batch_time = [t + d for t, d in zip(batch_time, duration)]
+        if not has_stream:
+            continue
+        def stream(times):
+            return (timed_updates(flt.get_offset_stream(
+                        s_count, lft_k1, pi_count).update,
+                                  polls, window_size, times),
+                    timed_updates(flt.get_filter_stream(
+                        s_count, hft_hz, lft_k1, pi_count).update,
+                                  polls, window_size, times))
+        duration, res = best_time(stream, options.count)
+        stream_time = [t + d for t, d in zip(stream_time, duration)]
+        for ref_list, res_list in zip(ref, res):
+            for ref_result, result in zip(ref_list, res_list):
+                if ref_result != result:
+                    mismatches += 1
+    print("%d updates (%s)" % (sum(updates),
+                               os.path.realpath(options.klippy)))
+    print("%10s %14s %14s" % ("", "filling (us)", "full (us)"))
+    results = [("batch", batch_time)]
+    if has_stream:
+        results.append(("stream", stream_time))
+    for name, times in results:
+        print("%10s %14.2f %14.2f" % (name, times[0] / updates[0] * 1000000.,
+                                      times[1] / updates[1] * 1000000.))
+    if has_stream:
+        print("%10s %8d" % ("mismatches", mismatches))
+
+if __name__ == '__main__':
+    main()
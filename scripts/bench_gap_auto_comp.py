@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Check the gap_auto_comp.py lookup tables (GapTable, GapSurface and
+# GapAutoComp.get_gaps) against the reference interpolation on random
+# calibrations, and compare the time per lookup.
+#
+# The X and Y gaps must be identical to the original linear scan over
+# the x_1dps/y_1dps breakpoints (included below), also at the exact
+# breakpoint positions and outside the mesh.  The Z gaps of the four
+# corner mode must match get_best_rdy_z() (interpolation with
+# get_linear2() along the mesh edges) within --tolerance.
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging
+
+class StubBedMeshConfig:
+    def __init__(self, mesh_min, mesh_max):
+        self.mesh_min = mesh_min
+        self.mesh_max = mesh_max
+
+class StubBedMesh:
+    def __init__(self, mesh_min, mesh_max):
+        self.bmc = StubBedMeshConfig(mesh_min, mesh_max)
+
+class StubPrinter:
+    def __init__(self, bed_mesh):
+        self.bed_mesh = bed_mesh
+    def lookup_object(self, name, default=None):
+        return self.bed_mesh
+
+# Original linear scan of get_x_gap()/get_y_gap()
+def ref_1d_gap(dps, gaps, v):
+    if dps == None:
+        return gaps[0]
+    if v <= dps[0][0]:
+        return dps[0][1]
+    if v >= dps[-1][0]:
+        return dps[-1][1]
+    for i in range(len(dps) - 1):
+        if dps[i][0] < v <= dps[i + 1][0]:
+            return ((dps[i+1][1] - dps[i][1]) * (v - dps[i][0])
+                    / (dps[i + 1][0] - dps[i][0]) + dps[i][1])
+    return 0.
+
+def ref_z_gap(gac, x, y):
+    if gac.z_2dps == None:
+        return gac.z_gaps[0]
+    return gac.get_best_rdy_z(x, y)
+
+def make_comp(gap_auto_comp, rnd):
+    mesh_min = (rnd.uniform(0., 50.), rnd.uniform(0., 50.))
+    mesh_max = (mesh_min[0] + rnd.uniform(100., 300.),
+                mesh_min[1] + rnd.uniform(100., 300.))
+    gac = gap_auto_comp.GapAutoComp.__new__(gap_auto_comp.GapAutoComp)
+    gac.printer = StubPrinter(StubBedMesh(mesh_min, mesh_max))
+    gac.show_msg = False
+    gac.x_gaps = [rnd.uniform(-.2, .2) for i in range(rnd.choice([1, 2, 3,
+                                                                    7, 11]))]
+    gac.y_gaps = [rnd.uniform(-.2, .2) for i in range(rnd.choice([1, 2, 3,
+                                                                    7, 11]))]
+    gac.z_gaps = [rnd.uniform(-.2, .2) for i in range(rnd.choice([1, 4]))]
+    gac.x_1dps = gac.y_1dps = gac.z_2dps = None
+    gac.updata_gaps()
+    return gac, mesh_min, mesh_max
+
+def make_positions(rnd, gac, mesh_min, mesh_max, count):
+    positions = []
+    # Exact breakpoints and mesh corners
+    for dps, axis in [(gac.x_1dps, 0), (gac.y_1dps, 1)]:
+        for p, gap in (dps or []):
+            pos = [rnd.uniform(mesh_min[0], mesh_max[0]),
+                   rnd.uniform(mesh_min[1], mesh_max[1])]
+            pos[axis] = p
+            positions.append(pos)
+    for x in mesh_min[0], mesh_max[0]:
+        for y in mesh_min[1], mesh_max[1]:
+            positions.append([x, y])
+    # Random positions, some of them outside the mesh
+    while len(positions) < count:
+        positions.append([rnd.uniform(mesh_min[0] - 20., mesh_max[0] + 20.),
+                          rnd.uniform(mesh_min[1] - 20., mesh_max[1] + 20.)])
+    return positions
+
+def best_time(func, runs):
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing extras/gap_auto_comp.py")
+    opts.add_option("-c", "--calibrations", type="int", dest="calibrations",
+                    default=200, help="number of random calibrations")
+    opts.add_option("-p", "--positions", type="int", dest="positions",
+                    default=500, help="positions per calibration")
+    opts.add_option("-t", "--tolerance", type="float", dest="tolerance",
+                    default=1e-12, help="allowed difference of the Z gaps")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    from extras import gap_auto_comp
+    logging.disable(logging.CRITICAL)
+    rnd = random.Random(options.calibrations)
+    lookups = xy_mismatches = z_mismatches = 0
+    z_max_diff = ref_time = table_time = 0.
+    for i in range(options.calibrations):
+        gac, mesh_min, mesh_max = make_comp(gap_auto_comp, rnd)
+        positions = make_positions(rnd, gac, mesh_min, mesh_max,
+                                   options.positions)
+        lookups += len(positions)
+        def reference():
+            return [[ref_1d_gap(gac.x_1dps, gac.x_gaps, pos[0]),
+                     ref_1d_gap(gac.y_1dps, gac.y_gaps, pos[1]),
+                     ref_z_gap(gac, pos[0], pos[1])] for pos in positions]
+        ref = reference()
+        res = gac.get_gaps(positions)
+        ref_time += best_time(reference, options.count)
+        table_time += best_time(lambda: gac.get_gaps(positions),
+                                options.count)
+        for pos, (rx, ry, rz), (x, y, z) in zip(positions, ref, res):
+            # The deal_move() and get_x/y/z_gap() lookups use the same
+            # tables as get_gaps()
+            if (rx != x or ry != y or gac.get_x_gap(pos[0], pos[1], 0.) != x
+                or gac.get_y_gap(pos[0], pos[1], 0.) != y):
+                xy_mismatches += 1
+            diff = abs(rz - z)
+            z_max_diff = max(z_max_diff, diff)
+            if (diff > options.tolerance
+                or gac.get_z_gap(pos[0], pos[1], 0.) != z):
+                z_mismatches += 1
+    print("%d calibrations, %d lookups (%s)" % (
+        options.calibrations, lookups, os.path.realpath(options.klippy)))
+    print("%16s %8.2f us/lookup" % ("reference",
+                                    ref_time / lookups * 1000000.))
+    print("%16s %8.2f us/lookup" % ("get_gaps",
+                                    table_time / lookups * 1000000.))
+    print("%16s %8d" % ("xy mismatches", xy_mismatches))
+    print("%16s %8d (max difference %.3g)" % ("z mismatches", z_mismatches,
+                                              z_max_diff))
+
+if __name__ == '__main__':
+    main()
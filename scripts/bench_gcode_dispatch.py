@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Benchmark the number of g-code lines per second processed by
+# GCodeDispatch._process_commands.  G0/G1 moves are processed by
+# GCodeMove (with a no-op toolhead move), other commands by no-op
+# handlers.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_gcode_dispatch.py -k <old tree>/klippy file.gcode
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging
+
+class StubMutex:
+    def test(self):
+        return False
+    def __enter__(self):
+        pass
+    def __exit__(self, type=None, value=None, tb=None):
+        pass
+
+class StubReactor:
+    def mutex(self):
+        return StubMutex()
+
+class StubStateJournal:
+    def exists(self, path):
+        return False
+    def load(self, path, default=None):
+        return default
+    def update(self, path, data):
+        pass
+    def remove(self, path):
+        pass
+
+class StubConfig:
+    def __init__(self, printer):
+        self.printer = printer
+    def get_printer(self):
+        return self.printer
+    def has_section(self, section):
+        return False
+
+class StubPrinter:
+    def __init__(self):
+        self.objects = {'state_journal': StubStateJournal()}
+    def get_start_args(self):
+        return {}
+    def get_reactor(self):
+        return StubReactor()
+    def register_event_handler(self, event, callback):
+        pass
+    def send_event(self, event, *params):
+        pass
+    def invoke_shutdown(self, msg):
+        raise Exception(msg)
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+
+def write_gcode(path, lines):
+    # Synthesize a sliced file: mostly extrusion moves with some travel,
+    # retraction, fan, temperature and layer change lines
+    rnd = random.Random(lines)
+    out = [";FLAVOR:Marlin\nM140 S60\nM104 S210\nM190 S60\nM109 S210\n",
+           "G28\nG92 E0\n"]
+    e = 0.
+    for i in range(lines):
+        if not i % 2000:
+            out.append(";LAYER:%d\nG0 F6000 Z%.2f\n;TYPE:WALL-OUTER\n"
+                       % (i // 2000, 0.2 * (i // 2000 + 1)))
+            out.append("M106 S%d\n" % (rnd.randint(0, 255),))
+        elif not i % 50:
+            out.append("G1 F2400 E%.5f\nG0 F6000 X%.3f Y%.3f\n" % (
+                e - 0.8, rnd.uniform(0., 220.), rnd.uniform(0., 220.)))
+        e += rnd.random()
+        out.append("G1 X%.3f Y%.3f E%.5f\n" % (
+            rnd.uniform(0., 220.), rnd.uniform(0., 220.), e))
+    with open(path, 'w') as f:
+        f.write("".join(out))
+
+def main():
+    usage = "%prog [options] [gcode file]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing gcode.py to test")
+    opts.add_option("-l", "--lines", type="int", dest="lines",
+                    default=200000, help="number of synthetic moves")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    import gcode
+    logging.disable(logging.CRITICAL)
+    if args:
+        fname = args[0]
+    else:
+        fname = "/tmp/bench_gcode_dispatch.gcode"
+        write_gcode(fname, options.lines)
+    with open(fname, 'r') as f:
+        lines = f.read().split('\n')
+    from extras import gcode_move
+    printer = StubPrinter()
+    dispatch = printer.objects['gcode'] = gcode.GCodeDispatch(printer)
+    dispatch._respond_error = lambda msg: None
+    gm = gcode_move.GCodeMove(StubConfig(printer))
+    gm.move_with_transform = lambda newpos, speed: None
+    dispatch._handle_ready()
+    noop = lambda gcmd: None
+    for line in lines:
+        cmd = line.split(';', 1)[0].strip().split(' ', 1)[0].upper()
+        if cmd and cmd not in dispatch.ready_gcode_handlers:
+            dispatch.register_command(cmd, noop)
+    best = None
+    for i in range(options.count):
+        start = time.perf_counter()
+        for line in lines:
+            dispatch._process_commands([line], need_ack=False)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    print("%d lines in %.3fs: %.0f lines/sec (%s)" % (
+        len(lines), best, len(lines) / best,
+        os.path.realpath(options.klippy)))
+    if not args:
+        os.remove(fname)
+
+if __name__ == '__main__':
+    main()
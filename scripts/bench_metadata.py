@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Benchmark slicer metadata extraction against g-code file size
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import importlib, optparse, os, sys, time, tempfile, random
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+metadata = importlib.import_module('.metadata', 'extras')
+
+HEADER = """; generated by PrusaSlicer 2.6.0+linux-x64 on 2024-01-01 at 12:00:00 UTC
+;MINX:10.5
+;MINY:12.25
+;MINZ:0.2
+;MAXX:200.5
+;MAXY:180.25
+;MAXZ:120.4
+M190 S60
+M109 S215
+"""
+
+FOOTER = """; filament used [mm] = 123456.78
+; total filament used [g] = 370.12
+; estimated printing time (normal mode) = 1d 2h 3m 4s
+; layer_height = 0.2
+; first_layer_height = 0.25
+; filament_type = PLA
+; filament_settings_id = "Generic PLA"
+; first_layer_temperature = 215
+; first_layer_bed_temperature = 60
+; nozzle_diameter = 0.4
+; total layers count = 602
+"""
+
+def write_gcode(path, size):
+    # Synthesize a PrusaSlicer style file of approximately 'size' bytes
+    rnd = random.Random(size)
+    lines = []
+    z = 0.2
+    for i in range(20000):
+        if not i % 500:
+            lines.append(";LAYER_CHANGE\n;BEFORE_LAYER_CHANGE\n;%.2f\n" % z)
+            lines.append("G1 Z%.3f F720\n" % z)
+            lines.append(";TYPE:External perimeter\n;WIDTH:0.45\n")
+            z += 0.2
+        lines.append("G1 X%.3f Y%.3f E%.5f\n" % (
+            rnd.uniform(0., 220.), rnd.uniform(0., 220.), rnd.random()))
+    chunk = "".join(lines)
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        written = len(HEADER)
+        while written < size:
+            f.write(chunk)
+            written += len(chunk)
+        f.write(FOOTER)
+
+def bench_file(path, count):
+    best = None
+    for i in range(count):
+        start = time.perf_counter()
+        metadata.get_file_metadata(path)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+def main():
+    usage = "%prog [options] [gcode files]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-s", "--sizes", type="string", dest="sizes",
+                    default="1,10,100,300",
+                    help="comma separated synthetic file sizes in MiB")
+    opts.add_option("-n", "--count", type="int", dest="count", default=5,
+                    help="number of runs per file (best is reported)")
+    options, args = opts.parse_args()
+    print("%12s %10s %s" % ("size (MiB)", "time (ms)", "file"))
+    for fname in args:
+        size = os.path.getsize(fname)
+        duration = bench_file(fname, options.count)
+        print("%12.1f %10.2f %s" % (size / 1048576., duration * 1000., fname))
+    if args:
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mib in [float(s) for s in options.sizes.split(',')]:
+            fname = os.path.join(tmpdir, "bench_%gM.gcode" % (mib,))
+            write_gcode(fname, int(mib * 1048576))
+            size = os.path.getsize(fname)
+            duration = bench_file(fname, options.count)
+            print("%12.1f %10.2f %s" % (size / 1048576., duration * 1000.,
+                                        os.path.basename(fname)))
+            os.remove(fname)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Benchmark the host message codecs in msgproto.py (check_packet with
+# its crc, MessageParser.parse and MessageFormat.encode) on a packet
+# corpus and check the results against the reference implementation
+# (the MessageFormat methods).
+#
+# The data dictionary (out/klipper.dict) and a recorded packet corpus
+# (a raw serial data dump, as read by klippy/parsedump.py) may be given:
+#   scripts/bench_msgproto.py out/klipper.dict serial_dump.bin
+# Without a corpus one is synthesized from the dictionary, without a
+# dictionary a built in one with common sensor and status responses is
+# used.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_msgproto.py -k <old tree>/klippy
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging, json
+
+DICTIONARY = {
+    'commands': {
+        'identify offset=%u count=%c': 1,
+        'queue_step oid=%c interval=%u count=%hu add=%hi': 40,
+        'set_next_step_dir oid=%c dir=%c': 41,
+        'queue_digital_out oid=%c clock=%u on_ticks=%u': 42,
+        'get_clock': 43,
+        'query_adxl345 oid=%c clock=%u rest_ticks=%u': 44,
+        'config_digital_out oid=%c pin=%u value=%c default_value=%c'
+        ' max_duration=%u': 45,
+    },
+    'responses': {
+        'identify_response offset=%u data=%.*s': 0,
+        'clock clock=%u': 60,
+        'stats count=%u sum=%u sumsq=%u': 61,
+        'analog_in_state oid=%c next_clock=%u value=%hu': 62,
+        'adxl345_data oid=%c sequence=%hu data=%*s': 63,
+        'adxl345_status oid=%c clock=%u query_ticks=%u next_sequence=%hu'
+        ' buffered=%c fifo=%c limit_count=%hu': 64,
+        'trsync_state oid=%c can_trigger=%c trigger_reason=%c clock=%u': 65,
+        'stepper_position oid=%c pos=%i': 66,
+        'result_hx711s oid=%c nt=%u vd=%c it=%c v0=%i v1=%i v2=%i v3=%i': 67,
+    },
+    'output': {'Got error %u at %.*s': 80},
+    'enumerations': {'pin': {'PA0': [0, 16], 'PB0': [16, 16]}},
+    'config': {'CLOCK_FREQ': 72000000},
+    'version': 'bench',
+}
+
+def random_value(rnd, msgproto, t):
+    if isinstance(t, msgproto.Enumeration):
+        return rnd.choice(sorted(t.enums))
+    if t.is_dynamic_string:
+        return bytes([rnd.randint(0, 255) for i in range(rnd.randint(1, 8))])
+    if t.max_length == 2:
+        return rnd.randint(0, 255)
+    if t.max_length == 3:
+        if t.signed:
+            return rnd.randint(-0x8000, 0x7fff)
+        return rnd.randint(0, 0xffff)
+    # Small values (oids, flags) are as common as clocks and positions
+    if rnd.random() < .5:
+        return rnd.randint(0, 50)
+    if t.signed:
+        return rnd.randint(-0x80000000, 0x7fffffff)
+    return rnd.randint(0, 0xffffffff)
+
+def build_corpus(msgproto, msgparser, count):
+    # Mostly sensor data, as when streaming an accelerometer or load cell
+    rnd = random.Random(count)
+    responses = [mid for mid in msgparser.messages_by_id.values()
+                 if isinstance(mid, msgproto.MessageFormat)]
+    weights = [20 if mid.name in ('adxl345_data', 'result_hx711s') else 1
+               for mid in responses]
+    out = bytearray()
+    for mid in rnd.choices(responses, weights, k=count):
+        values = [random_value(rnd, msgproto, t) for t in mid.param_types]
+        if mid.name == 'adxl345_data':
+            values[2] = bytes([rnd.randint(0, 255) for i in range(50)])
+        cmd = mid.encode(values)
+        if len(cmd) > msgproto.MESSAGE_PAYLOAD_MAX:
+            continue
+        msg = [len(cmd) + msgproto.MESSAGE_MIN,
+               msgproto.MESSAGE_DEST | (len(out) & msgproto.MESSAGE_SEQ_MASK)]
+        msg += cmd
+        msg += msgproto.crc16_ccitt(msg)
+        msg.append(msgproto.MESSAGE_SYNC)
+        out.extend(msg)
+    return bytes(out)
+
+def split_packets(msgparser, data):
+    out = []
+    while data:
+        l = msgparser.check_packet(data)
+        if l == 0:
+            break
+        if l < 0:
+            data = data[1:]
+            continue
+        out.append(bytes(data[:l]))
+        data = data[l:]
+    return out
+
+def best_time(func, runs):
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+def main():
+    usage = "%prog [options] [dictionary [packet corpus]]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing msgproto.py to test")
+    opts.add_option("-m", "--messages", type="int", dest="messages",
+                    default=100000, help="number of synthetic packets")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    import msgproto
+    logging.disable(logging.CRITICAL)
+    if args:
+        with open(args[0], 'rb') as f:
+            dictionary = f.read()
+    else:
+        dictionary = json.dumps(DICTIONARY).encode()
+    msgparser = msgproto.MessageParser()
+    msgparser.process_identify(dictionary, decompress=False)
+    if len(args) > 1:
+        with open(args[1], 'rb') as f:
+            data = f.read()
+    else:
+        data = build_corpus(msgproto, msgparser, options.messages)
+    packets = split_packets(msgparser, bytearray(data))
+    # Re-encode the first message of each packet
+    msgs = []
+    for packet in packets:
+        mid = msgparser.messages_by_id.get(packet[msgproto.MESSAGE_HEADER_SIZE])
+        if isinstance(mid, msgproto.MessageFormat):
+            params, pos = msgproto.MessageFormat.parse(
+                mid, packet, msgproto.MESSAGE_HEADER_SIZE)
+            msgs.append((mid, params, [params[name]
+                                       for name, t in mid.param_names]))
+    def run_check():
+        for packet in packets:
+            msgparser.check_packet(packet)
+    def run_parse():
+        for packet in packets:
+            msgparser.parse(packet)
+    def run_encode():
+        for mid, params, values in msgs:
+            mid.encode(values)
+    def run_encode_by_name():
+        for mid, params, values in msgs:
+            mid.encode_by_name(**params)
+    print("%d packets, %d bytes, %d messages (%s)" % (
+        len(packets), len(data), len(msgs), os.path.realpath(options.klippy)))
+    for name, func, count in [("check_packet", run_check, len(packets)),
+                              ("parse", run_parse, len(packets)),
+                              ("encode", run_encode, len(msgs)),
+                              ("encode_by_name", run_encode_by_name,
+                               len(msgs))]:
+        duration = best_time(func, options.count)
+        print("%16s %8.2f us/msg" % (name, duration / count * 1000000.))
+    mismatch = 0
+    hdr = msgproto.MESSAGE_HEADER_SIZE
+    for mid, params, values in msgs:
+        ref = msgproto.MessageFormat.encode(mid, values)
+        if mid.encode(values) != ref or mid.encode_by_name(**params) != ref:
+            mismatch += 1
+    for packet in packets:
+        mid = msgparser.messages_by_id.get(packet[hdr])
+        if (isinstance(mid, msgproto.MessageFormat)
+            and mid.parse(packet, hdr)
+                != msgproto.MessageFormat.parse(mid, packet, hdr)):
+            mismatch += 1
+    print("%16s %8d" % ("mismatches", mismatch))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Benchmark the reactor timer dispatch overhead (Reactor._check_timers,
+# update_timer) for a range of registered timer counts.  Timers have
+# periods between 0.1s and 3s (heaters, fans, sensors, status updates)
+# and a 1ms timer (a print job) also wakes another timer on each run,
+# as completions and mutexes do.  The reactor clock is simulated, so
+# no time is spent sleeping.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_reactor_timers.py -k <old tree>/klippy
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging, types
+
+class StubFFILib:
+    get_monotonic = staticmethod(time.monotonic)
+
+def time_dispatch(reactor, count, passes, runs):
+    rnd = random.Random(count)
+    r = reactor.Reactor()
+    calls = [0]
+    def periodic(period):
+        def callback(eventtime):
+            calls[0] += 1
+            return eventtime + period
+        return callback
+    timers = [r.register_timer(periodic(rnd.uniform(.1, 3.)), r.NOW)
+              for i in range(count)]
+    def wake(eventtime):
+        calls[0] += 1
+        return r.NEVER
+    wake_timers = [r.register_timer(wake) for i in range(8)]
+    def job(eventtime):
+        calls[0] += 1
+        r.update_timer(wake_timers[calls[0] % 8], r.NOW)
+        return eventtime + .001
+    r.register_timer(job, r.NOW)
+    best = None
+    eventtime = 0.
+    for i in range(runs):
+        calls[0] = 0
+        start = time.perf_counter()
+        for j in range(passes):
+            eventtime += .0005
+            r._check_timers(eventtime, False)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+            best_calls = calls[0]
+    return best, best_calls
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing reactor.py to test")
+    opts.add_option("-t", "--timers", type="string", dest="timers",
+                    default="10,20,50,100,200,500",
+                    help="comma separated registered timer counts")
+    opts.add_option("-p", "--passes", type="int", dest="passes",
+                    default=20000, help="reactor loop passes per run")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    # Only the monotonic clock of the C helper is needed
+    chelper = types.ModuleType('chelper')
+    chelper.get_ffi = lambda: (None, StubFFILib)
+    sys.modules['chelper'] = chelper
+    import reactor
+    logging.disable(logging.CRITICAL)
+    print("%8s %14s %14s %12s" % (
+        "timers", "pass (us)", "callback (us)", "callbacks"))
+    for count in [int(v) for v in options.timers.split(',')]:
+        duration, calls = time_dispatch(reactor, count, options.passes,
+                                        options.count)
+        print("%8d %14.2f %14.2f %12d" % (
+            count, duration / options.passes * 1000000.,
+            duration / calls * 1000000., calls))
+    print("(%s)" % (os.path.realpath(options.klippy),))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Benchmark power loss resume position recovery against g-code file size
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import importlib, optparse, os, sys, time, tempfile, random
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+gcode_index = importlib.import_module('.gcode_index', 'extras')
+
+LAYERS = 300
+
+def write_gcode(path, size):
+    # Synthesize a file with LAYERS layers of approximately 'size' bytes
+    rnd = random.Random(size)
+    layer_size = size // LAYERS
+    with open(path, 'w') as f:
+        f.write("M82\nG90\nG92 E0\n")
+        e = 0.
+        for layer in range(LAYERS):
+            f.write(";LAYER:%d\nG1 Z%.2f F600\n" % (layer, 0.2 * (layer + 1)))
+            lines = []
+            written = 0
+            while written < layer_size:
+                e += rnd.random()
+                line = "G1 X%.3f Y%.3f E%.5f\n" % (
+                    rnd.uniform(0., 220.), rnd.uniform(0., 220.), e)
+                lines.append(line)
+                written += len(line)
+            f.write("".join(lines))
+
+# Character at a time backwards search used before the block reader
+def legacy_tail_read(f):
+    cur_pos = f.tell()
+    buf = ''
+    while True:
+        b = str(f.read(1))
+        buf = b + buf
+        cur_pos -= 1
+        if cur_pos < 0: break
+        f.seek(cur_pos)
+        if b.startswith("\n") or b.startswith("\r"):
+            buf = '\n'
+        if ((buf.startswith("G1") or buf.startswith("G0"))
+            and buf.endswith("\n")):
+            break
+    return buf
+
+def legacy_get_xyze(file_path, file_position):
+    result = {"X": 0, "Y": 0, "Z": 0, "E": 0}
+    with open(file_path, "r") as f:
+        f.seek(file_position)
+        while f.tell() > 0:
+            line = legacy_tail_read(f)
+            for obj in line.split():
+                axis = obj[:1]
+                if axis in result and not result[axis]:
+                    result[axis] = float(obj[1:])
+            if all(result.values()):
+                break
+    return result
+
+def time_func(func, count):
+    best = None
+    for i in range(count):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best * 1000.
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-s", "--sizes", type="string", dest="sizes",
+                    default="1,10,50,100",
+                    help="comma separated synthetic file sizes in MiB")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs per method (best is reported)")
+    opts.add_option("-l", "--legacy", action="store_true", dest="legacy",
+                    help="also time the character based backwards search")
+    options, args = opts.parse_args()
+    print("%10s %12s %12s %12s" % (
+        "size (MiB)", "legacy (ms)", "blocks (ms)", "index (ms)"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mib in [float(s) for s in options.sizes.split(',')]:
+            fname = os.path.join(tmpdir, "bench_%gM.gcode" % (mib,))
+            write_gcode(fname, int(mib * 1048576))
+            size = os.path.getsize(fname)
+            # Resume near the end of a layer at 90% of the file
+            with open(fname, 'rb') as f:
+                f.seek(int(size * .9))
+                f.readline()
+                file_position = f.tell()
+            legacy = "-"
+            if options.legacy:
+                legacy = "%.2f" % time_func(
+                    lambda: legacy_get_xyze(fname, file_position),
+                    options.count)
+            def blocks():
+                with open(fname, 'rb') as f:
+                    gcode_index.find_resume_position(f, file_position)
+            blocks_time = time_func(blocks, options.count)
+            index = gcode_index.build_index(fname)
+            index_time = time_func(
+                lambda: index.get_position(fname, file_position),
+                options.count)
+            print("%10.1f %12s %12.2f %12.2f" % (
+                size / 1048576., legacy, blocks_time, index_time))
+            os.remove(fname)
+
+if __name__ == '__main__':
+    main()
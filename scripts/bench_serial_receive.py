@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Benchmark the number of mcu responses per second delivered by
+# SerialReader (serialqueue receive, msgproto parse and handler dispatch).
+# A stream of adxl345_data messages (with some analog_in_state messages)
+# is replayed into the serialqueue through a socketpair.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_serial_receive.py -k <old tree>/klippy
+# The klippy/chelper/c_helper.so library of the tree is built if needed.
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging, threading, socket, json, zlib
+
+DICTIONARY = {
+    'commands': {'identify offset=%u count=%c': 1},
+    'responses': {
+        'identify_response offset=%u data=%.*s': 0,
+        'adxl345_data oid=%c sequence=%hu data=%*s': 2,
+        'analog_in_state oid=%c next_clock=%u value=%hu': 3,
+    },
+    'config': {}, 'version': 'bench',
+}
+ADXL_OID = 3
+ANALOG_OID = 5
+DATA_LEN = 50
+
+class StubCompletion:
+    def __init__(self, result=None):
+        self.result = result
+    def wait(self, waketime=None, waketime_result=None):
+        return self.result
+    def complete(self, result):
+        self.result = result
+
+class StubReactor:
+    def __init__(self, identify_data):
+        self.identify_data = identify_data
+    def monotonic(self):
+        return time.monotonic()
+    def register_callback(self, callback):
+        # Only used to obtain the data dictionary
+        return StubCompletion(self.identify_data)
+    def completion(self):
+        return StubCompletion()
+    def async_complete(self, completion, result):
+        completion.complete(result)
+
+class Counter:
+    def __init__(self, total):
+        self.total = total
+        self.count = 0
+        self.done = threading.Event()
+    def handle(self, params):
+        self.count += 1
+        if self.count >= self.total:
+            self.done.set()
+    def handle_batch(self, params_list):
+        self.count += len(params_list)
+        if self.count >= self.total:
+            self.done.set()
+
+def build_stream(msgproto, msgparser, count):
+    rnd = random.Random(count)
+    adxl = msgparser.lookup_command(
+        'adxl345_data oid=%c sequence=%hu data=%*s')
+    analog = msgparser.lookup_command(
+        'analog_in_state oid=%c next_clock=%u value=%hu')
+    out = bytearray()
+    for i in range(count):
+        if i % 10 == 9:
+            cmd = analog.encode([ANALOG_OID, i * 1000, rnd.randint(0, 4095)])
+        else:
+            data = bytes([rnd.randint(0, 255) for j in range(DATA_LEN)])
+            cmd = adxl.encode([ADXL_OID, i & 0xffff, data])
+        # Every message uses the initial sequence number so none of them
+        # is treated as an out of order message
+        msg = [len(cmd) + msgproto.MESSAGE_MIN, msgproto.MESSAGE_DEST | 1]
+        msg += cmd
+        msg += msgproto.crc16_ccitt(msg)
+        msg.append(msgproto.MESSAGE_SYNC)
+        out.extend(msg)
+    return bytes(out)
+
+def run(serialhdl, stream, count):
+    identify_data = zlib.compress(json.dumps(DICTIONARY).encode())
+    reader = serialhdl.SerialReader(StubReactor(identify_data))
+    mcu_end, host_end = socket.socketpair()
+    reader._start_session(host_end)
+    counter = Counter(count)
+    reader.register_response(counter.handle, 'analog_in_state', ANALOG_OID)
+    try:
+        reader.register_response(counter.handle_batch, 'adxl345_data',
+                                 ADXL_OID, batch=True)
+    except TypeError:
+        reader.register_response(counter.handle, 'adxl345_data', ADXL_OID)
+    start = time.perf_counter()
+    mcu_end.sendall(stream)
+    counter.done.wait(60.)
+    duration = time.perf_counter() - start
+    received = counter.count
+    reader.disconnect()
+    mcu_end.close()
+    return duration, received
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing serialhdl.py to test")
+    opts.add_option("-m", "--messages", type="int", dest="messages",
+                    default=200000, help="number of messages per run")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    import chelper
+    srcdir = os.path.dirname(os.path.realpath(chelper.__file__))
+    srcfiles = chelper.get_abs_files(srcdir, chelper.SOURCE_FILES)
+    ofiles = chelper.get_abs_files(srcdir, chelper.OTHER_FILES)
+    destlib = chelper.get_abs_files(srcdir, [chelper.DEST_LIB])[0]
+    if chelper.check_build_code(srcfiles + ofiles, destlib):
+        chelper.do_build_code("%s %s" % (chelper.GCC_CMD, chelper.COMPILE_ARGS)
+                              % (destlib, ' '.join(srcfiles)))
+    import serialhdl, msgproto
+    logging.disable(logging.CRITICAL)
+    msgparser = msgproto.MessageParser()
+    msgparser.process_identify(json.dumps(DICTIONARY).encode(),
+                               decompress=False)
+    stream = build_stream(msgproto, msgparser, options.messages)
+    best = None
+    for i in range(options.count):
+        duration, received = run(serialhdl, stream, options.messages)
+        if received != options.messages:
+            print("Only %d of %d messages received" % (
+                received, options.messages))
+            sys.exit(1)
+        if best is None or duration < best:
+            best = duration
+    print("%d messages in %.3fs: %.0f messages/sec (%s)" % (
+        options.messages, best, options.messages / best,
+        os.path.realpath(options.klippy)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Benchmark the host startup work that is repeated on every RESTART and
+# FIRMWARE_RESTART: reading the printer config (PrinterConfig
+# read_main_config) and processing the mcu data dictionary
+# (MessageParser.process_identify).  The first run is timed as a cold
+# start, the remaining runs as restarts within the same process.
+#
+#   scripts/bench_startup.py printer.cfg [out/klipper.dict]
+# Without a dictionary the one of scripts/bench_msgproto.py is used.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_startup.py -k <old tree>/klippy printer.cfg
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, logging, json, zlib
+
+class StubGCode:
+    def register_command(self, cmd, func, when_not_ready=False, desc=None):
+        pass
+
+class StubPrinter:
+    def __init__(self, config_file):
+        self.start_args = {'config_file': config_file}
+    def get_start_args(self):
+        return self.start_args
+    def lookup_object(self, name, default=None):
+        return StubGCode()
+
+def time_runs(func, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times[0], min(times[1:])
+
+def main():
+    usage = "%prog [options] <config file> [dictionary]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing configfile.py to test")
+    opts.add_option("-n", "--count", type="int", dest="count", default=10,
+                    help="number of restarts (best is reported)")
+    options, args = opts.parse_args()
+    if len(args) not in (1, 2):
+        opts.error("Incorrect number of arguments")
+    sys.path.insert(0, options.klippy)
+    import configfile, msgproto
+    logging.disable(logging.CRITICAL)
+    if len(args) > 1:
+        with open(args[1], 'rb') as f:
+            dictionary = f.read()
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+        import bench_msgproto
+        dictionary = json.dumps(bench_msgproto.DICTIONARY).encode()
+    identify_data = zlib.compress(dictionary)
+    printer = StubPrinter(args[0])
+    def read_config():
+        configfile.PrinterConfig(printer).read_main_config()
+    def identify():
+        msgproto.MessageParser().process_identify(identify_data)
+    print("%16s %12s %12s" % ("", "start (ms)", "restart (ms)"))
+    for name, func in [("read_main_config", read_config),
+                       ("process_identify", identify)]:
+        first, best = time_runs(func, options.count + 1)
+        print("%16s %12.3f %12.3f" % (name, first * 1000., best * 1000.))
+    print("(%s)" % (os.path.realpath(options.klippy),))
+
+if __name__ == '__main__':
+    main()
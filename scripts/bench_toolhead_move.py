@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Benchmark the number of moves per second processed by ToolHead.move
+# (and MoveQueue.add_move / look-ahead / trapq_append).  Uses the "none"
+# kinematics and a file output style mcu so that no steps are generated.
+#
+# Run it against two source trees to compare implementations:
+#   scripts/bench_toolhead_move.py -k <old tree>/klippy
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging, collections
+
+Coord = collections.namedtuple('Coord', ('x', 'y', 'z', 'e'))
+
+class StubReactor:
+    NOW = 0.
+    NEVER = 9999999999999999.
+    def monotonic(self):
+        return 0.
+    def register_timer(self, callback, waketime=NEVER):
+        return callback
+    def update_timer(self, timer, waketime):
+        pass
+    def pause(self, waketime):
+        return waketime
+
+class StubMCU:
+    def is_fileoutput(self):
+        return True
+    def estimated_print_time(self, eventtime):
+        return 0.
+    def flush_moves(self, print_time):
+        pass
+
+class StubGCode:
+    Coord = Coord
+    def register_command(self, cmd, func, desc=None):
+        pass
+    def respond_info(self, msg, log=True):
+        pass
+
+class StubExtruder:
+    def update_move_time(self, flush_time):
+        pass
+    def check_move(self, move):
+        pass
+    def calc_junction(self, prev_move, move):
+        return move.max_cruise_v2
+    def move(self, print_time, move):
+        pass
+
+class StubBedMeshConfig:
+    mesh_min = (5., 5.)
+    mesh_max = (215., 215.)
+
+class StubBedMesh:
+    bmc = StubBedMeshConfig()
+
+class StubConfig:
+    def __init__(self, printer, values):
+        self.printer = printer
+        self.values = values
+    def get_printer(self):
+        return self.printer
+    def getsection(self, section):
+        return self
+    def get(self, option, default=None, note_valid=True):
+        return self.values.get(option, default)
+    def getfloat(self, option, default=None, minval=None, maxval=None,
+                 above=None, below=None, note_valid=True):
+        return self.values.get(option, default)
+    def getboolean(self, option, default=None, note_valid=True):
+        return self.values.get(option, default)
+    def getfloatlist(self, option, default=None, sep=',', count=None,
+                     note_valid=True):
+        return self.values.get(option, default)
+
+class StubPrinter:
+    def __init__(self):
+        self.reactor = StubReactor()
+        self.objects = {'gcode': StubGCode(), 'mcu': StubMCU(),
+                        'bed_mesh': StubBedMesh()}
+    def get_reactor(self):
+        return self.reactor
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+    def lookup_objects(self, module=None):
+        return [(module, self.objects[module])]
+    def load_object(self, config, section, default=None):
+        return None
+    def register_event_handler(self, event, callback):
+        pass
+    def send_event(self, event, *params):
+        pass
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing toolhead.py to test")
+    opts.add_option("-m", "--moves", type="int", dest="moves",
+                    default=200000, help="number of moves per run")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    opts.add_option("-g", "--gap", action="store_true", dest="gap",
+                    help="enable gap_auto_comp backlash compensation")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    import toolhead
+    logging.disable(logging.CRITICAL)
+    printer = StubPrinter()
+    config = StubConfig(printer, {'max_velocity': 500., 'max_accel': 10000.,
+                                  'kinematics': 'none'})
+    th = toolhead.ToolHead(config)
+    th.extruder = StubExtruder()
+    if options.gap:
+        from extras import gap_auto_comp
+        gap = gap_auto_comp.GapAutoComp(StubConfig(printer, {
+            'show_msg': False, 'x_gaps': [0.02, 0.03, 0.04],
+            'y_gaps': [0.05], 'z_gaps': [0.01]}))
+        printer.objects['toolhead'] = th
+        gap._handle_home_rails_begin(None, [])
+        gap._handle_home_rails_end(None, [])
+    rnd = random.Random(options.moves)
+    moves = []
+    e = 0.
+    for i in range(options.moves):
+        e += rnd.random()
+        moves.append([rnd.uniform(0., 220.), rnd.uniform(0., 220.), 0.2, e])
+    best = None
+    for i in range(options.count):
+        start = time.perf_counter()
+        for newpos in moves:
+            th.move(newpos, 150.)
+        th.flush_step_generation()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+        th.set_position([0., 0., 0., 0.])
+    print("%d moves in %.3fs: %.0f moves/sec (%s)" % (
+        len(moves), best, len(moves) / best,
+        os.path.realpath(options.klippy)))
+
+if __name__ == '__main__':
+    main()
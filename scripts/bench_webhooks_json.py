@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Benchmark the JSON codecs available to the API server socket
+# (webhooks.lookup_json_codec) on a stream of subscription messages and
+# check that their output is byte identical to the json module.
+#
+# The stream may be recorded from a running printer, one 0x03
+# terminated message after another (as sent over the API socket):
+#   scripts/bench_webhooks_json.py recorded_stream.bin
+# Without a file a synthetic stream is generated.
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, random, logging, json
+
+def make_stream(count):
+    # Synthesize status updates similar to a Moonraker subscription
+    # while printing, with an occasional large bed_mesh/configfile update
+    rnd = random.Random(count)
+    msgs = []
+    eventtime = 3052153.382083195
+    pos = [100., 100., .2, 0.]
+    for i in range(count):
+        eventtime += .25
+        pos = [round(rnd.uniform(0., 220.), 3),
+               round(rnd.uniform(0., 220.), 3), pos[2], pos[3] + rnd.random()]
+        status = {
+            'toolhead': {'position': pos,
+                         'estimated_print_time': eventtime - 3052000.,
+                         'print_time': eventtime - 3051999.5},
+            'motion_report': {'live_position': [p + rnd.random() * .1
+                                                for p in pos],
+                              'live_velocity': rnd.uniform(0., 300.),
+                              'live_extruder_velocity': rnd.uniform(-.1, 5.)},
+            'extruder': {'temperature': round(rnd.gauss(210., .3), 2),
+                         'power': rnd.random()},
+            'heater_bed': {'temperature': round(rnd.gauss(60., .1), 2),
+                           'power': rnd.random()},
+            'gcode_move': {'speed_factor': 1.0, 'gcode_position': pos},
+            'virtual_sdcard': {'progress': i / float(count),
+                               'file_position': i * 37},
+            'print_stats': {'print_duration': i * .25},
+        }
+        if not i % 400:
+            status['print_stats'].update({
+                'state': 'printing', 'filename': 'benchy.gcode',
+                'info': {'current_layer': i // 400, 'total_layer': None}})
+        if not i % 1000:
+            status['bed_mesh'] = {
+                'profile_name': 'default',
+                'probed_matrix': [[round(rnd.uniform(-.2, .2), 6)
+                                   for x in range(7)] for y in range(7)],
+                'mesh_matrix': [[round(rnd.uniform(-.2, .2), 6)
+                                 for x in range(31)] for y in range(31)]}
+        if not i % 2000:
+            status['configfile'] = {'settings': {
+                'printer': {'kinematics': 'cartesian', 'max_velocity': 500.,
+                            'max_accel': 10000., 'square_corner_velocity': 5.},
+                'extruder': {'pressure_advance': .04, 'smooth_time': 1e-05,
+                             'heater_pin': 'PA1', 'sensor_type': 'EPCOS 100K'},
+            }}
+        msgs.append({'params': {'eventtime': eventtime, 'status': status}})
+    return [json.dumps(m, separators=(',', ':')).encode() for m in msgs]
+
+def read_stream(fname):
+    with open(fname, 'rb') as f:
+        data = f.read()
+    return [m for m in data.split(b'\x03') if m.strip()]
+
+def main():
+    usage = "%prog [options] [recorded stream]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--klippy", type="string", dest="klippy",
+                    default=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), '..', 'klippy'),
+                    help="klippy directory containing webhooks.py")
+    opts.add_option("-m", "--messages", type="int", dest="messages",
+                    default=20000, help="number of synthetic messages")
+    opts.add_option("-n", "--count", type="int", dest="count", default=3,
+                    help="number of runs (best is reported)")
+    options, args = opts.parse_args()
+    sys.path.insert(0, options.klippy)
+    import webhooks
+    logging.disable(logging.CRITICAL)
+    if args:
+        raw = read_stream(args[0])
+    else:
+        raw = make_stream(options.messages)
+    reference = webhooks.JsonCodec()
+    decoded = [reference.loads(m) for m in raw]
+    expected = [reference.dumps(d) for d in decoded]
+    print("%d messages, %d bytes" % (len(raw), sum([len(m) for m in raw])))
+    print("%8s %14s %14s %10s" % (
+        "codec", "encode (us)", "decode (us)", "mismatch"))
+    for name in webhooks.JSON_CODECS:
+        codec = webhooks.lookup_json_codec([name])
+        if codec.name != name:
+            print("%8s %14s" % (name, "unavailable"))
+            continue
+        best_enc = best_dec = None
+        for i in range(options.count):
+            start = time.perf_counter()
+            for d in decoded:
+                codec.dumps(d)
+            enc = time.perf_counter() - start
+            start = time.perf_counter()
+            for m in raw:
+                codec.loads(m)
+            dec = time.perf_counter() - start
+            if best_enc is None or enc < best_enc:
+                best_enc = enc
+            if best_dec is None or dec < best_dec:
+                best_dec = dec
+        mismatch = len([1 for d, e in zip(decoded, expected)
+                        if codec.dumps(d) != e])
+        mismatch += len([1 for m, d in zip(raw, decoded)
+                         if repr(codec.loads(m)) != repr(d)])
+        print("%8s %14.2f %14.2f %10d" % (
+            name, best_enc / len(raw) * 1000000.,
+            best_dec / len(raw) * 1000000., mismatch))
+
+if __name__ == '__main__':
+    main()